@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Nodes, Edges, Annotation, CampusMap
+from . import jobs, tasks
+from .models import Nodes, Edges, Annotation, CampusMap, Job, UploadSession
 
 
 @admin.register(CampusMap)
@@ -10,8 +11,9 @@ class CampusMapAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at')
     fieldsets = (
         ('Map Information', {
-            'fields': ('name', 'blueprint_image', 'is_active'),
-            'description': 'Upload the main campus blueprint image. Only one map should be active at a time.'
+            'fields': ('name', 'blueprint_image', 'building', 'floor_level', 'is_active'),
+            'description': 'Upload the main campus blueprint image. Only one map should be active at a time '
+                           'for the whole campus and for each building/floor.'
         }),
         ('Calibration (Optional)', {
             'fields': ('scale_meters_per_pixel',),
@@ -29,6 +31,7 @@ class NodesAdmin(admin.ModelAdmin):
 	search_fields = ("node_code", "name", "building")
 	list_filter = ("building", "floor_level", "type_of_node")
 	readonly_fields = ('created_at',)
+	actions = ['regenerate_qrcodes']
 	fieldsets = (
 		('Basic Information', {
 			'fields': ('node_code', 'name', 'building', 'floor_level', 'type_of_node')
@@ -45,6 +48,12 @@ class NodesAdmin(admin.ModelAdmin):
 		}),
 	)
 
+	@admin.action(description='Regenerate QR codes of selected nodes')
+	def regenerate_qrcodes(self, request, queryset):
+		node_ids = list(queryset.values_list('node_id', flat=True))
+		jobs.enqueue(tasks.NODE_QRCODES, {'node_ids': node_ids, 'force': True}, priority=jobs.PRIORITY_HIGH)
+		self.message_user(request, f'QR codes of {len(node_ids)} node(s) queued for regeneration.')
+
 
 @admin.register(Edges)
 class EdgesAdmin(admin.ModelAdmin):
@@ -75,3 +84,26 @@ class AnnotationAdmin(admin.ModelAdmin):
 		}),
 	)
 
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+	list_display = ('filename', 'node', 'status', 'received_size', 'total_size', 'created_by', 'created_at')
+	list_filter = ('status',)
+	search_fields = ('filename', 'node__node_code')
+	readonly_fields = ('upload_id', 'created_at', 'updated_at')
+	raw_id_fields = ['node']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+	list_display = ('name', 'key', 'status', 'priority', 'attempts', 'run_after', 'finished_at')
+	list_filter = ('status', 'name')
+	search_fields = ('name', 'key')
+	readonly_fields = ('created_at', 'started_at', 'finished_at', 'locked_by', 'last_error', 'result')
+	actions = ['retry_jobs']
+
+	@admin.action(description='Retry selected failed jobs')
+	def retry_jobs(self, request, queryset):
+		retried = sum(jobs.retry(job) for job in queryset.filter(status=Job.STATUS_FAILED))
+		self.message_user(request, f'{retried} job(s) queued again.')
@@ -0,0 +1,121 @@
+"""
+Angular index over panorama annotations.
+
+For every panorama the active annotations are kept sorted by yaw, so the
+annotations that can be visible in a view (centre yaw/pitch plus field of
+view) are found with two binary searches instead of shipping every label to
+the client. An annotation is visible when its cone (``visible_radius``
+around its yaw/pitch) intersects the viewport. Yaw wraps around at ±180°.
+
+Lines of equal yaw converge towards the poles, so an angle spans more yaw
+the higher it is: the view's half width is scaled by 1/cos of the pitch of
+its edge nearest a pole, and an annotation's radius by 1/cos of its own
+pitch. Otherwise labels in the corners of a view looking up or down would
+be missed.
+The index is rebuilt lazily when annotations or nodes change.
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from .models import Annotation
+from .versioning import combined_version, ANNOTATIONS, NODES
+
+
+# Pitch up to which yaw_scale grows; beyond it every yaw counts as close
+MAX_SCALED_PITCH = 85.0
+
+
+def yaw_scale(pitch: float) -> float:
+    """Degrees of yaw spanned by one degree of arc at ``pitch``."""
+    return 1.0 / math.cos(math.radians(min(abs(pitch), MAX_SCALED_PITCH)))
+
+
+def wrap_yaw(angle: float) -> float:
+    """Normalize an angle to [-180, 180)."""
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+class PanoramaAnnotations:
+    """Annotations of one panorama sorted by yaw."""
+
+    def __init__(self, annotations: List[Dict]):
+        annotations.sort(key=lambda a: a['yaw'])
+        self.annotations = annotations
+        self.yaws = [a['yaw'] for a in annotations]
+        self.max_yaw_radius = max((a['visible_radius'] * yaw_scale(a['pitch']) for a in annotations), default=0.0)
+
+    def _yaw_window(self, yaw, half_width):
+        """Candidates whose yaw lies within ``half_width`` of ``yaw``, handling wraparound."""
+        if half_width >= 180.0:
+            return self.annotations
+        low, high = wrap_yaw(yaw - half_width), wrap_yaw(yaw + half_width)
+        if low <= high:
+            return self.annotations[bisect_left(self.yaws, low):bisect_right(self.yaws, high)]
+        # The window crosses ±180°
+        return self.annotations[bisect_left(self.yaws, low):] + self.annotations[:bisect_right(self.yaws, high)]
+
+    def visible(self, yaw: float, pitch: float, hfov: float, vfov: float) -> List[Dict]:
+        top, bottom = pitch + vfov / 2.0, pitch - vfov / 2.0
+        # Looking at a pole every yaw is on screen
+        sees_pole = top >= 90.0 or bottom <= -90.0
+        yaw_half = 180.0 if sees_pole else min(hfov / 2.0 * yaw_scale(max(abs(top), abs(bottom))), 180.0)
+
+        found = []
+        for a in self._yaw_window(yaw, yaw_half + self.max_yaw_radius):
+            radius = a['visible_radius']
+            if abs(wrap_yaw(a['yaw'] - yaw)) > yaw_half + radius * yaw_scale(a['pitch']):
+                continue
+            if a['pitch'] - radius > top or a['pitch'] + radius < bottom:
+                continue
+            found.append(a)
+        return found
+
+
+class AnnotationIndex:
+    """Per-panorama angular indexes."""
+
+    def __init__(self, annotations: Iterable[Annotation]):
+        grouped = defaultdict(list)
+        for a in annotations:
+            grouped[a.panorama_id].append({
+                'id': a.id,
+                'label': a.label,
+                'yaw': a.yaw,
+                'pitch': a.pitch,
+                'visible_radius': a.visible_radius,
+                'target_node': {
+                    'node_id': a.target_node.node_id,
+                    'node_code': a.target_node.node_code,
+                    'name': a.target_node.name
+                } if a.target_node else None
+            })
+        self.panoramas = {node_id: PanoramaAnnotations(items) for node_id, items in grouped.items()}
+
+    def visible(self, node_id: int, yaw: float, pitch: float, hfov: float, vfov: float) -> List[Dict]:
+        panorama = self.panoramas.get(node_id)
+        if panorama is None:
+            return []
+        return panorama.visible(wrap_yaw(yaw), pitch, hfov, vfov)
+
+    def all(self, node_id: int) -> List[Dict]:
+        panorama = self.panoramas.get(node_id)
+        return panorama.annotations if panorama is not None else []
+
+
+# Global instance, rebuilt when annotations or nodes change
+_annotation_index = None
+_annotation_index_version = None
+
+
+def get_annotation_index() -> AnnotationIndex:
+    """Get the annotation index for the current data version."""
+    global _annotation_index, _annotation_index_version
+    version = combined_version(ANNOTATIONS, NODES)
+    if _annotation_index is None or _annotation_index_version != version:
+        annotations = Annotation.objects.filter(is_active=True).select_related('target_node')
+        _annotation_index = AnnotationIndex(annotations.iterator(chunk_size=2000))
+        _annotation_index_version = version
+    return _annotation_index
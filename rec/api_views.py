@@ -2,28 +2,103 @@
 REST API Views for Mobile App
 Provides endpoints for the React Native mobile application
 """
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, QueryDict, Http404, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.db.models import Q, Count
 from django.core.files.base import ContentFile
+from django.urls import resolve, Resolver404
+from django.utils import timezone
+import copy
 import json
 import base64
+import math
+import time
 
-from .models import Nodes, Edges, Annotation, CampusMap
+from . import bulk, graph_health, jobs, lookups, media_pack, uploads
+from .models import Nodes, Edges, Annotation, CampusMap, Job, UploadSession
+from .panorama_tiles import manifest_for
 from .pathfinding import get_pathfinder, reset_pathfinder
+from .blueprint_tiles import public_manifest
+from .db_routing import replica_reads
+from .derivatives import public_derivatives
+from .pagination import (
+    PaginationError, is_paginated, paginate, parse_fields, columns_for
+)
+from .annotation_index import get_annotation_index
+from .search import get_search_index
+from .spatial import get_spatial_index
+from .response_cache import cached_json_response
+from .streaming import StreamingJsonResponse, Counted, wants_stream, QUERYSET_CHUNK_SIZE
+from .versioning import versioned, NODES, EDGES, ANNOTATIONS, CAMPUS_MAP
 
 
 # ============= Public API Endpoints =============
 
+def _absolute(host, url):
+    """Absolute form of a storage URL; ``host`` is the scheme and host of the request."""
+    return url if '://' in url else host + url
+
+
+# API field -> (model columns needed, value getter)
+NODE_LIST_FIELDS = {
+    'node_id': (('node_id',), lambda n, host: n.node_id),
+    'node_code': (('node_code',), lambda n, host: n.node_code),
+    'name': (('name',), lambda n, host: n.name),
+    'building': (('building',), lambda n, host: n.building),
+    'floor_level': (('floor_level',), lambda n, host: n.floor_level),
+    'type_of_node': (('type_of_node',), lambda n, host: n.type_of_node),
+    'map_x': (('map_x',), lambda n, host: float(n.map_x) if n.map_x is not None else None),
+    'map_y': (('map_y',), lambda n, host: float(n.map_y) if n.map_y is not None else None),
+    'has_360_image': (('image360',), lambda n, host: bool(n.image360)),
+    'image360_url': (('image360',), lambda n, host: _absolute(host, n.image360.url) if n.image360 else None),
+    'image360_derivatives': (('image360_derivatives',), lambda n, host: public_derivatives(
+        n.image360_derivatives, lambda url: _absolute(host, url))),
+    'qrcode_url': (('qrcode',), lambda n, host: _absolute(host, n.qrcode.url) if n.qrcode else None),
+    'description': (('description',), lambda n, host: n.description),
+}
+
+# Backed by the nodes_listing_idx index; node_id makes the order total
+NODE_LIST_ORDERING = ('building', 'floor_level', 'name', 'node_id')
+
+EDGE_LIST_FIELDS = {
+    'edge_id': (('edge_id',), lambda e, host: e.edge_id),
+    'from_node': (('from_node__node_id', 'from_node__node_code', 'from_node__name'), lambda e, host: {
+        'node_id': e.from_node.node_id,
+        'node_code': e.from_node.node_code,
+        'name': e.from_node.name
+    }),
+    'to_node': (('to_node__node_id', 'to_node__node_code', 'to_node__name'), lambda e, host: {
+        'node_id': e.to_node.node_id,
+        'node_code': e.to_node.node_code,
+        'name': e.to_node.name
+    }),
+    'distance': (('distance',), lambda e, host: e.distance),
+    'compass_angle': (('compass_angle',), lambda e, host: e.compass_angle),
+    'is_staircase': (('is_staircase',), lambda e, host: e.is_staircase),
+    'is_active': (('is_active',), lambda e, host: e.is_active),
+}
+
+EDGE_LIST_ORDERING = ('edge_id',)
+
+
 @require_http_methods(["GET"])
+@versioned(NODES)
 def api_nodes_list(request):
-    """Get list of all nodes with optional search/filter."""
+    """
+    Get list of all nodes with optional search/filter.
+
+    ``fields`` (comma separated) limits the returned columns. Passing ``limit``
+    and/or ``cursor`` switches to keyset pagination; follow ``next`` until it
+    is null. Without pagination, ``stream=1`` streams the full list.
+    """
     try:
-        nodes = Nodes.objects.all()
+        fields = parse_fields(request, NODE_LIST_FIELDS)
+        nodes = Nodes.objects.only(*columns_for(fields, NODE_LIST_FIELDS, *NODE_LIST_ORDERING))
         
         # Search parameter
         search = request.GET.get('search', '').strip()
@@ -44,25 +119,71 @@ def api_nodes_list(request):
         if floor:
             nodes = nodes.filter(floor_level=int(floor))
         
-        data = [{
-            'node_id': n.node_id,
-            'node_code': n.node_code,
-            'name': n.name,
-            'building': n.building,
-            'floor_level': n.floor_level,
-            'type_of_node': n.type_of_node,
-            'map_x': float(n.map_x) if n.map_x is not None else None,
-            'map_y': float(n.map_y) if n.map_y is not None else None,
-            'has_360_image': bool(n.image360),
-            'image360_url': request.build_absolute_uri(n.image360.url) if n.image360 else None,
-            'qrcode_url': request.build_absolute_uri(n.qrcode.url) if n.qrcode else None,
-            'description': n.description
-        } for n in nodes.order_by('building', 'floor_level', 'name')]
+        # Resolve scheme and host once instead of per URL
+        host = request.build_absolute_uri('/')[:-1]
+        
+        if is_paginated(request):
+            page, next_cursor = paginate(nodes, NODE_LIST_ORDERING, request)
+            data = [{f: NODE_LIST_FIELDS[f][1](n, host) for f in fields} for n in page]
+            return JsonResponse({
+                'success': True,
+                'nodes': data,
+                'count': len(data),
+                'next': next_cursor
+            })
+        
+        rows = ({f: NODE_LIST_FIELDS[f][1](n, host) for f in fields}
+                for n in nodes.order_by(*NODE_LIST_ORDERING).iterator(chunk_size=QUERYSET_CHUNK_SIZE))
+        
+        if wants_stream(request):
+            rows = Counted(rows)
+            return StreamingJsonResponse({
+                'success': True,
+                'nodes': rows,
+                'count': lambda: rows.count
+            })
+        
+        def build():
+            data = list(rows)
+            return {
+                'success': True,
+                'nodes': data,
+                'count': len(data)
+            }
+        
+        # The unfiltered list is fetched by every client; serve it pre-encoded
+        if not request.GET:
+            return cached_json_response(request, (NODES,), build)
+        return JsonResponse(build())
+    
+    except PaginationError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+SEARCH_DEFAULT_LIMIT = 10
+SEARCH_MAX_LIMIT = 50
+
+
+@require_http_methods(["GET"])
+@versioned(NODES)
+def api_search(request):
+    """Autocomplete search over node codes, names and buildings (``q``, ``limit``)."""
+    try:
+        query = request.GET.get('q', '').strip()
+        try:
+            limit = min(int(request.GET.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'limit must be an integer'}, status=400)
+        
+        results = get_search_index().search(query, limit=max(limit, 1)) if query else []
         
         return JsonResponse({
             'success': True,
-            'nodes': data,
-            'count': len(data)
+            'query': query,
+            'results': results,
+            'count': len(results)
         })
     
     except Exception as e:
@@ -70,23 +191,33 @@ def api_nodes_list(request):
 
 
 @require_http_methods(["GET"])
+@versioned(NODES)
 def api_buildings_list(request):
     """Get list of all buildings."""
     try:
-        buildings = Nodes.objects.values_list('building', flat=True).distinct().order_by('building')
         return JsonResponse({
             'success': True,
-            'buildings': list(buildings)
+            'buildings': lookups.buildings()
         })
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
 @require_http_methods(["GET"])
+@versioned(CAMPUS_MAP)
 def api_campus_map(request):
-    """Get active campus map information."""
+    """
+    Get active campus map information. ``building`` and ``floor`` select the
+    map of a building or floor when one exists.
+    """
     try:
-        campus_map = CampusMap.objects.filter(is_active=True).first()
+        building = request.GET.get('building', '').strip()
+        floor = request.GET.get('floor', '').strip()
+        try:
+            floor = int(floor) if floor else None
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'floor must be an integer'}, status=400)
+        campus_map = lookups.active_campus_map(building, floor)
         
         if not campus_map:
             return JsonResponse({
@@ -100,6 +231,11 @@ def api_campus_map(request):
                 'map_id': campus_map.map_id,
                 'name': campus_map.name,
                 'image_url': request.build_absolute_uri(campus_map.blueprint_image.url),
+                'image_derivatives': public_derivatives(campus_map.blueprint_derivatives,
+                                                        request.build_absolute_uri),
+                'tiles': public_manifest(campus_map.blueprint_tiles, request),
+                'building': campus_map.building or None,
+                'floor_level': campus_map.floor_level,
                 'scale_meters_per_pixel': campus_map.scale_meters_per_pixel
             }
         })
@@ -146,46 +282,45 @@ def api_find_path(request):
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+def _node_payload(request, node):
+    """Detail fields of a node, with absolute media URLs."""
+    return {
+        'node_id': node.node_id,
+        'node_code': node.node_code,
+        'name': node.name,
+        'building': node.building,
+        'floor_level': node.floor_level,
+        'type_of_node': node.type_of_node,
+        'map_x': float(node.map_x) if node.map_x is not None else None,
+        'map_y': float(node.map_y) if node.map_y is not None else None,
+        'image360_url': request.build_absolute_uri(node.image360.url) if node.image360 else None,
+        'image360_tiles': manifest_for(node, request),
+        'image360_derivatives': public_derivatives(node.image360_derivatives, request.build_absolute_uri),
+        'qrcode_url': request.build_absolute_uri(node.qrcode.url) if node.qrcode else None,
+        'description': node.description
+    }
+
+
+def _file_size(field_file):
+    """Size in bytes of a stored file, None when it is missing."""
+    try:
+        return field_file.size
+    except (OSError, ValueError):
+        return None
+
+
 @require_http_methods(["GET"])
+@versioned(NODES, ANNOTATIONS)
 def api_node_detail(request, node_id):
     """Get detailed information about a specific node."""
     try:
         node = get_object_or_404(Nodes, node_id=node_id)
         
-        # Get annotations for this node
-        annotations = Annotation.objects.filter(
-            panorama=node,
-            is_active=True
-        ).select_related('target_node')
-        
-        annotations_data = [{
-            'id': a.id,
-            'label': a.label,
-            'yaw': a.yaw,
-            'pitch': a.pitch,
-            'visible_radius': a.visible_radius,
-            'target_node': {
-                'node_id': a.target_node.node_id,
-                'node_code': a.target_node.node_code,
-                'name': a.target_node.name
-            } if a.target_node else None
-        } for a in annotations]
-        
         return JsonResponse({
             'success': True,
             'node': {
-                'node_id': node.node_id,
-                'node_code': node.node_code,
-                'name': node.name,
-                'building': node.building,
-                'floor_level': node.floor_level,
-                'type_of_node': node.type_of_node,
-                'map_x': float(node.map_x) if node.map_x is not None else None,
-                'map_y': float(node.map_y) if node.map_y is not None else None,
-                'image360_url': request.build_absolute_uri(node.image360.url) if node.image360 else None,
-                'qrcode_url': request.build_absolute_uri(node.qrcode.url) if node.qrcode else None,
-                'description': node.description,
-                'annotations': annotations_data
+                **_node_payload(request, node),
+                'annotations': get_annotation_index().all(node.node_id)
             }
         })
     
@@ -193,6 +328,157 @@ def api_node_detail(request, node_id):
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+@require_http_methods(["GET"])
+@versioned(NODES, EDGES, ANNOTATIONS)
+def api_node_bundle(request, node_id):
+    """
+    Everything the app needs to show a panorama in one response: the node, its
+    active annotations, its neighbors in the navigation graph (with the compass
+    angle towards each, for navigation hotspots) and prefetch hints for the
+    neighbor panoramas.
+    """
+    try:
+        pathfinder = get_pathfinder()
+        node = pathfinder.nodes_cache.get(node_id)
+        if node is None:
+            return JsonResponse({'success': False, 'error': 'Node not found'}, status=404)
+        
+        def build():
+            neighbors, prefetch = [], []
+            for link in pathfinder.graph.get(node_id, []):
+                neighbor = pathfinder.nodes_cache[link['to']]
+                image_url = request.build_absolute_uri(neighbor.image360.url) if neighbor.image360 else None
+                neighbors.append({
+                    'node_id': neighbor.node_id,
+                    'node_code': neighbor.node_code,
+                    'name': neighbor.name,
+                    'building': neighbor.building,
+                    'floor_level': neighbor.floor_level,
+                    'type_of_node': neighbor.type_of_node,
+                    'image360_url': image_url,
+                    'edge_id': link['edge_id'],
+                    'distance': link['distance'],
+                    'compass_angle': link['compass_angle'],
+                    'is_staircase': link['is_staircase']
+                })
+                if image_url and image_url not in (hint['url'] for hint in prefetch):
+                    prefetch.append({
+                        'node_id': neighbor.node_id,
+                        'url': image_url,
+                        'bytes': _file_size(neighbor.image360)
+                    })
+            
+            return {
+                'success': True,
+                'node': _node_payload(request, node),
+                'annotations': get_annotation_index().all(node_id),
+                'neighbors': neighbors,
+                'prefetch': prefetch
+            }
+        
+        return cached_json_response(request, (NODES, EDGES, ANNOTATIONS), build)
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Spatial Queries =============
+
+SPATIAL_MAX_K = 50
+
+
+def _float_param(request, name):
+    """Required finite float query parameter; raises ValueError with a client-facing message."""
+    try:
+        value = float(request.GET[name])
+    except (KeyError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if not math.isfinite(value):
+        raise ValueError(f'{name} must be a number')
+    return value
+
+
+def _position_param(request, name):
+    """Required map position query parameter, in percent (0-100)."""
+    value = _float_param(request, name)
+    if not 0 <= value <= 100:
+        raise ValueError(f'{name} must be between 0 and 100')
+    return value
+
+
+def _floor_param(request):
+    try:
+        return int(request.GET['floor'])
+    except (KeyError, ValueError):
+        raise ValueError('floor must be an integer')
+
+
+@require_http_methods(["GET"])
+@versioned(NODES, EDGES, CAMPUS_MAP)
+def api_spatial_nearest(request):
+    """Nearest ``k`` positioned nodes to map point ``x``, ``y`` on ``floor`` (optionally in ``building``)."""
+    try:
+        x, y, floor = _position_param(request, 'x'), _position_param(request, 'y'), _floor_param(request)
+        k = min(max(int(request.GET.get('k', 1)), 1), SPATIAL_MAX_K)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        nodes = get_spatial_index().nearest(x, y, floor, k=k, building=request.GET.get('building', '').strip())
+        return JsonResponse({
+            'success': True,
+            'nodes': nodes,
+            'count': len(nodes)
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@versioned(NODES, EDGES, CAMPUS_MAP)
+def api_spatial_viewport(request):
+    """Positioned nodes of ``floor`` inside the rectangle ``x0``, ``y0`` - ``x1``, ``y1``."""
+    try:
+        bounds = [_float_param(request, name) for name in ('x0', 'y0', 'x1', 'y1')]
+        floor = _floor_param(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        nodes = get_spatial_index().in_viewport(*bounds, floor, building=request.GET.get('building', '').strip())
+        return JsonResponse({
+            'success': True,
+            'nodes': nodes,
+            'count': len(nodes)
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@versioned(NODES, EDGES, CAMPUS_MAP)
+def api_spatial_snap(request):
+    """Snap map point ``x``, ``y`` on ``floor`` (of ``building``'s map if given) to the nearest active edge."""
+    try:
+        x, y, floor = _position_param(request, 'x'), _position_param(request, 'y'), _floor_param(request)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        snapped = get_spatial_index().snap(x, y, floor, building=request.GET.get('building', '').strip())
+        if snapped is None:
+            return JsonResponse({'success': False, 'error': 'No edges on this floor'}, status=404)
+        return JsonResponse({
+            'success': True,
+            **snapped
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
 # ============= Admin Authentication =============
 
 @require_http_methods(["POST"])
@@ -264,7 +550,7 @@ def api_node_create(request):
             image_data = base64.b64decode(data['image360_base64'])
             node.image360.save(f"{node.node_code}_360.jpg", ContentFile(image_data), save=False)
         
-        node.save()  # Auto-generates QR code
+        node.save()  # Queues QR code generation
         reset_pathfinder()
         
         return JsonResponse({
@@ -338,35 +624,51 @@ def api_node_delete(request, node_id):
 
 
 @require_http_methods(["GET"])
+@versioned(EDGES, NODES)
 def api_edges_list(request):
-    """Get list of all edges."""
+    """
+    Get list of all edges.
+
+    Supports the same ``fields``, ``limit``, ``cursor`` and ``stream``
+    parameters as the nodes list.
+    """
     try:
-        edges = Edges.objects.all().select_related('from_node', 'to_node')
+        fields = parse_fields(request, EDGE_LIST_FIELDS)
+        edges = Edges.objects.only(*columns_for(fields, EDGE_LIST_FIELDS, *EDGE_LIST_ORDERING))
+        related = [f for f in ('from_node', 'to_node') if f in fields]
+        if related:
+            edges = edges.select_related(*related)
         
-        data = [{
-            'edge_id': e.edge_id,
-            'from_node': {
-                'node_id': e.from_node.node_id,
-                'node_code': e.from_node.node_code,
-                'name': e.from_node.name
-            },
-            'to_node': {
-                'node_id': e.to_node.node_id,
-                'node_code': e.to_node.node_code,
-                'name': e.to_node.name
-            },
-            'distance': e.distance,
-            'compass_angle': e.compass_angle,
-            'is_staircase': e.is_staircase,
-            'is_active': e.is_active
-        } for e in edges]
+        if is_paginated(request):
+            page, next_cursor = paginate(edges, EDGE_LIST_ORDERING, request)
+            data = [{f: EDGE_LIST_FIELDS[f][1](e, None) for f in fields} for e in page]
+            return JsonResponse({
+                'success': True,
+                'edges': data,
+                'count': len(data),
+                'next': next_cursor
+            })
         
+        rows = ({f: EDGE_LIST_FIELDS[f][1](e, None) for f in fields}
+                for e in edges.order_by(*EDGE_LIST_ORDERING).iterator(chunk_size=QUERYSET_CHUNK_SIZE))
+        
+        if wants_stream(request):
+            rows = Counted(rows)
+            return StreamingJsonResponse({
+                'success': True,
+                'edges': rows,
+                'count': lambda: rows.count
+            })
+        
+        data = list(rows)
         return JsonResponse({
             'success': True,
             'edges': data,
             'count': len(data)
         })
     
+    except PaginationError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
@@ -456,8 +758,9 @@ def api_edge_delete(request, edge_id):
 
 
 @require_http_methods(["GET"])
+@versioned(ANNOTATIONS, NODES)
 def api_annotations_list(request):
-    """Get list of all annotations."""
+    """Get list of all annotations. ``stream=1`` streams the response."""
     try:
         annotations = Annotation.objects.all().select_related('panorama', 'target_node')
         
@@ -466,7 +769,7 @@ def api_annotations_list(request):
         if panorama_id:
             annotations = annotations.filter(panorama__node_id=panorama_id)
         
-        data = [{
+        rows = ({
             'id': a.id,
             'panorama': {
                 'node_id': a.panorama.node_id,
@@ -483,8 +786,17 @@ def api_annotations_list(request):
             'pitch': a.pitch,
             'visible_radius': a.visible_radius,
             'is_active': a.is_active
-        } for a in annotations]
+        } for a in annotations.iterator(chunk_size=QUERYSET_CHUNK_SIZE))
         
+        if wants_stream(request):
+            rows = Counted(rows)
+            return StreamingJsonResponse({
+                'success': True,
+                'annotations': rows,
+                'count': lambda: rows.count
+            })
+        
+        data = list(rows)
         return JsonResponse({
             'success': True,
             'annotations': data,
@@ -495,6 +807,121 @@ def api_annotations_list(request):
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
+ANNOTATION_DEFAULT_HFOV = 90.0
+ANNOTATION_DEFAULT_VFOV = 60.0
+ANNOTATION_PREFETCH_MAX_NODES = 200
+
+
+def _angle_param(request, name, default, low, high):
+    try:
+        value = float(request.GET.get(name, default))
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+    if not low <= value <= high:
+        raise ValueError(f'{name} must be between {low:g} and {high:g}')
+    return value
+
+
+@require_http_methods(["GET"])
+@versioned(ANNOTATIONS, NODES)
+def api_annotations_visible(request, node_id):
+    """Active annotations of a panorama visible from view ``yaw``, ``pitch`` with ``hfov`` x ``vfov``."""
+    try:
+        yaw = _angle_param(request, 'yaw', 0, -360, 360)
+        pitch = _angle_param(request, 'pitch', 0, -90, 90)
+        hfov = _angle_param(request, 'hfov', ANNOTATION_DEFAULT_HFOV, 0, 360)
+        vfov = _angle_param(request, 'vfov', ANNOTATION_DEFAULT_VFOV, 0, 180)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    
+    try:
+        if not Nodes.objects.filter(node_id=node_id).exists():
+            return JsonResponse({'success': False, 'error': 'Node not found'}, status=404)
+        
+        annotations = get_annotation_index().visible(node_id, yaw, pitch, hfov, vfov)
+        return JsonResponse({
+            'success': True,
+            'node_id': node_id,
+            'annotations': annotations,
+            'count': len(annotations)
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+def _truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _requested_node_ids(params, max_nodes):
+    """
+    Node IDs given in ``params`` as ``node_ids`` (comma separated or a list)
+    or as the route from ``start_code`` to ``goal_code`` (``avoid_stairs=1``
+    optional), in order without duplicates.
+
+    Returns ``(node_ids, None)``, or ``(None, error response)``.
+    """
+    start_code = str(params.get('start_code', '')).strip()
+    goal_code = str(params.get('goal_code', '')).strip()
+    if start_code or goal_code:
+        if not start_code or not goal_code:
+            return None, JsonResponse({
+                'success': False,
+                'error': 'start_code and goal_code are required'
+            }, status=400)
+        avoid_stairs = _truthy(params.get('avoid_stairs', ''))
+        result = get_pathfinder().find_path(start_code, goal_code, avoid_stairs)
+        if 'error' in result:
+            return None, JsonResponse({'success': False, 'error': result['error']}, status=404)
+        node_ids = [node['node_id'] for node in result['path']]
+    else:
+        values = params.get('node_ids') or []
+        if isinstance(values, str):
+            values = [value for value in values.split(',') if value.strip()]
+        try:
+            node_ids = [int(value) for value in values]
+        except (TypeError, ValueError):
+            return None, JsonResponse({'success': False, 'error': 'node_ids must be integers'}, status=400)
+        if not node_ids:
+            return None, JsonResponse({
+                'success': False,
+                'error': 'node_ids or start_code and goal_code are required'
+            }, status=400)
+    
+    node_ids = list(dict.fromkeys(node_ids))
+    if len(node_ids) > max_nodes:
+        return None, JsonResponse({
+            'success': False,
+            'error': f'At most {max_nodes} panoramas per request'
+        }, status=400)
+    return node_ids, None
+
+
+@require_http_methods(["GET"])
+@versioned(ANNOTATIONS, NODES, EDGES)
+def api_annotations_prefetch(request):
+    """
+    Active annotations of several panoramas in one response, keyed by node ID.
+    Panoramas are given as ``node_ids=1,2,3`` or as the route from
+    ``start_code`` to ``goal_code`` (``avoid_stairs=1`` optional).
+    """
+    try:
+        node_ids, error = _requested_node_ids(request.GET, ANNOTATION_PREFETCH_MAX_NODES)
+        if error:
+            return error
+        
+        index = get_annotation_index()
+        return JsonResponse({
+            'success': True,
+            'node_ids': node_ids,
+            'panoramas': {str(node_id): index.all(node_id) for node_id in node_ids}
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
 @require_http_methods(["POST"])
 @csrf_exempt
 @login_required
@@ -581,3 +1008,509 @@ def api_annotation_delete(request, annotation_id):
     
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Bulk Writes =============
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required
+def api_bulk_write(request):
+    """
+    Create, update and delete nodes, edges and annotations in one
+    transaction (Admin only). See rec/bulk.py for the request format; if any
+    operation is invalid nothing is written and ``errors`` lists them all.
+    """
+    try:
+        data = json.loads(request.body)
+        result = bulk.apply(data)
+        reset_pathfinder()
+        
+        return JsonResponse({'success': True, **result})
+    
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    except bulk.BulkError as e:
+        return JsonResponse({'success': False, 'error': str(e), 'errors': e.errors}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required
+def api_save_node_positions(request):
+    """Map coordinates of many nodes from the map editor, as ``{"nodes": [{node_id, map_x, map_y}]}`` (Admin only)."""
+    try:
+        data = json.loads(request.body)
+        nodes = data.get('nodes') if isinstance(data, dict) else None
+        if not isinstance(nodes, list):
+            return JsonResponse({'success': False, 'error': 'nodes must be a list'}, status=400)
+        updates = [{key: node[key] for key in ('node_id', 'map_x', 'map_y') if key in node}
+                   if isinstance(node, dict) else node for node in nodes]
+        result = bulk.apply({'nodes': {'update': updates}})
+        reset_pathfinder()
+        
+        return JsonResponse({'success': True, 'updated': result['nodes']['updated']})
+    
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    except bulk.BulkError as e:
+        return JsonResponse({'success': False, 'error': str(e), 'errors': e.errors}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Offline Media Packs =============
+
+MEDIA_PACK_MAX_NODES = 200
+
+
+@require_http_methods(["GET", "POST"])
+@csrf_exempt
+def api_route_pack(request):
+    """
+    Zip of the panorama and QR code images of a route, for offline use.
+
+    The route is given as in ``api_annotations_prefetch``; ``size`` is a
+    derivative size or ``original`` (default ``medium``), ``format`` ``jpg``
+    or ``webp``. ``skip`` lists stored names the client already has. With
+    ``manifest=1`` only the manifest is returned, to decide what to skip
+    before downloading. Long skip lists can be POSTed as a JSON object with
+    the same keys.
+    """
+    try:
+        if request.method == 'POST':
+            try:
+                params = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+            if not isinstance(params, dict):
+                return JsonResponse({'success': False, 'error': 'Expected a JSON object'}, status=400)
+        else:
+            params = request.GET
+        
+        node_ids, error = _requested_node_ids(params, MEDIA_PACK_MAX_NODES)
+        if error:
+            return error
+        size = params.get('size') or 'medium'
+        if size not in media_pack.PACK_SIZES:
+            return JsonResponse({
+                'success': False,
+                'error': f'size must be one of: {", ".join(media_pack.PACK_SIZES)}'
+            }, status=400)
+        format = params.get('format') or 'jpg'
+        if format not in media_pack.PACK_FORMATS:
+            return JsonResponse({
+                'success': False,
+                'error': f'format must be one of: {", ".join(media_pack.PACK_FORMATS)}'
+            }, status=400)
+        skip = params.get('skip') or []
+        if isinstance(skip, str):
+            skip = [name for name in skip.split(',') if name]
+        
+        nodes = Nodes.objects.in_bulk(node_ids)
+        files, skipped, missing = media_pack.pack_files(
+            [nodes[node_id] for node_id in node_ids if node_id in nodes], size, format, skip)
+        manifest = media_pack.pack_manifest(files, skipped, missing, node_ids=node_ids, size=size, format=format)
+        
+        if _truthy(params.get('manifest', '')):
+            return JsonResponse({'success': True, **manifest})
+        
+        response = StreamingHttpResponse(media_pack.iter_zip(files, manifest), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="route-pack.zip"'
+        return response
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Chunked Uploads =============
+
+def _upload_state(session):
+    return {
+        'upload_id': str(session.upload_id),
+        'node_id': session.node_id,
+        'status': session.status,
+        'total_size': session.total_size,
+        'chunk_size': session.chunk_size,
+        'received_size': session.received_size,
+        'parts': uploads.part_count(session),
+        'next_part': (session.received_size // session.chunk_size
+                      if session.status == UploadSession.STATUS_UPLOADING
+                      and session.received_size < session.total_size else None),
+        'width': session.width,
+        'height': session.height,
+        'error': session.error or None
+    }
+
+
+def _upload_error(upload_id, error):
+    """Error response of an upload request, with the session's current state."""
+    session = UploadSession.objects.filter(upload_id=upload_id).first()
+    state = _upload_state(session) if session else {}
+    return JsonResponse({'success': False, 'error': str(error), **state}, status=error.status)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required
+def api_upload_initiate(request):
+    """
+    Start a chunked upload of a node's 360° image (Admin only).
+
+    Body: ``node_id``, ``filename``, ``size`` and optionally ``chunk_size`` and
+    ``checksum`` (SHA-256 hex of the whole file).
+    """
+    try:
+        data = json.loads(request.body)
+        node = get_object_or_404(Nodes, node_id=int(data['node_id']))
+        total_size = int(data['size'])
+        chunk_size = int(data.get('chunk_size', uploads.DEFAULT_CHUNK_SIZE))
+        uploads.validate_new_upload(data['filename'], total_size, chunk_size)
+        
+        session = UploadSession.objects.create(
+            node=node,
+            filename=data['filename'][:255],
+            total_size=total_size,
+            chunk_size=chunk_size,
+            checksum=data.get('checksum', ''),
+            created_by=request.user
+        )
+        return JsonResponse({'success': True, **_upload_state(session)}, status=201)
+    
+    except uploads.UploadError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=e.status)
+    except KeyError as e:
+        return JsonResponse({'success': False, 'error': f'Missing field: {str(e)}'}, status=400)
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid request body'}, status=400)
+    except Http404:
+        return JsonResponse({'success': False, 'error': 'Node not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET", "DELETE"])
+@csrf_exempt
+@login_required
+def api_upload_detail(request, upload_id):
+    """Upload progress, e.g. to find where to resume (GET), or abort the upload (DELETE)."""
+    try:
+        if request.method == 'DELETE':
+            session = uploads.abort(upload_id)
+        else:
+            session = UploadSession.objects.filter(upload_id=upload_id).first()
+        if session is None:
+            return JsonResponse({'success': False, 'error': 'Upload not found'}, status=404)
+        return JsonResponse({'success': True, **_upload_state(session)})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["PUT"])
+@csrf_exempt
+@login_required
+def api_upload_part(request, upload_id, index):
+    """
+    Store part ``index`` (0-based) of an upload; the raw request body is the
+    part's bytes. Parts go in order; resending a stored part is harmless.
+    """
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        session, written = uploads.write_part(upload_id, index, request, length)
+        return JsonResponse({'success': True, 'stored': written, **_upload_state(session)})
+    
+    except uploads.UploadError as e:
+        return _upload_error(upload_id, e)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required
+def api_upload_complete(request, upload_id):
+    """Verify a fully received upload and attach it to its node."""
+    try:
+        session, node = uploads.complete(upload_id)
+        reset_pathfinder()
+        
+        return JsonResponse({
+            'success': True,
+            **_upload_state(session),
+            'image360_url': request.build_absolute_uri(node.image360.url)
+        })
+    
+    except uploads.UploadError as e:
+        return _upload_error(upload_id, e)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Graph Health =============
+
+@require_http_methods(["GET"])
+@login_required
+def api_graph_health(request):
+    """Components, bridges, articulation points and edge problems of the graph (Admin only)."""
+    try:
+        return JsonResponse({'success': True, **graph_health.analyze()})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@login_required
+def api_edge_closure_impact(request, edge_id):
+    """Nodes an entrance could no longer reach if the edge were closed; ``avoid_stairs=1`` optional (Admin only)."""
+    try:
+        impact = graph_health.closure_impact(edge_id, _truthy(request.GET.get('avoid_stairs', '')))
+        if impact is None:
+            return JsonResponse({'success': False, 'error': 'Edge not found'}, status=404)
+        return JsonResponse({'success': True, **impact})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Cache Stats =============
+
+@require_http_methods(["GET"])
+@login_required
+def api_cache_stats(request):
+    """Cache backend and hit rates of the cached lookups in this process (Admin only)."""
+    try:
+        return JsonResponse({
+            'success': True,
+            'backend': settings.CACHES['default']['BACKEND'],
+            'lookups': lookups.stats(),
+        })
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Background Jobs =============
+
+JOBS_DEFAULT_LIMIT = 50
+JOBS_MAX_LIMIT = 200
+
+
+def _job_state(job, detail=False):
+    data = {
+        'job_id': job.pk,
+        'name': job.name,
+        'key': job.key,
+        'status': job.status,
+        'priority': job.priority,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'run_after': job.run_after.isoformat(),
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'worker': job.locked_by or None,
+        'error': job.last_error.strip().splitlines()[-1] if job.last_error else None
+    }
+    if detail:
+        data.update(payload=job.payload, result=job.result, traceback=job.last_error or None)
+    return data
+
+
+@require_http_methods(["GET"])
+@login_required
+def api_jobs_status(request):
+    """
+    Job queue overview (Admin only): counts per status, the age of the oldest
+    runnable job and the most recent jobs, filterable by ``status`` and ``name``.
+    """
+    try:
+        limit = min(int(request.GET.get('limit', JOBS_DEFAULT_LIMIT)), JOBS_MAX_LIMIT)
+        if limit < 1:
+            raise ValueError
+        
+        counts = {status: 0 for status, _ in Job.STATUS_CHOICES}
+        for row in Job.objects.values('status').annotate(count=Count('pk')):
+            counts[row['status']] = row['count']
+        now = timezone.now()
+        oldest = Job.objects.filter(status=Job.STATUS_QUEUED, run_after__lte=now).order_by('run_after').first()
+        
+        queryset = Job.objects.order_by('-pk')
+        if request.GET.get('status'):
+            queryset = queryset.filter(status=request.GET['status'])
+        if request.GET.get('name'):
+            queryset = queryset.filter(name=request.GET['name'])
+        
+        return JsonResponse({
+            'success': True,
+            'counts': counts,
+            'oldest_runnable_age': (now - oldest.run_after).total_seconds() if oldest else None,
+            'jobs': [_job_state(job) for job in queryset[:limit]]
+        })
+    
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit must be a positive integer'}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@login_required
+def api_job_detail(request, job_id):
+    """One job with its payload, result and last traceback (Admin only)."""
+    try:
+        job = Job.objects.filter(pk=job_id).first()
+        if job is None:
+            return JsonResponse({'success': False, 'error': 'Job not found'}, status=404)
+        return JsonResponse({'success': True, 'job': _job_state(job, detail=True)})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required
+def api_job_retry(request, job_id):
+    """Queue a failed job again (Admin only)."""
+    try:
+        job = Job.objects.filter(pk=job_id).first()
+        if job is None:
+            return JsonResponse({'success': False, 'error': 'Job not found'}, status=404)
+        if not jobs.retry(job):
+            return JsonResponse({'success': False, 'error': f'Job is {job.status} and cannot be retried',
+                                 'job': _job_state(job)}, status=409)
+        return JsonResponse({'success': True, 'job': _job_state(job)})
+    
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+# ============= Batch Requests =============
+
+BATCH_MAX_REQUESTS = 20
+BATCH_TIME_BUDGET = 5.0  # seconds for the whole batch
+
+# URL names that may be called through the batch endpoint (read-only endpoints)
+BATCH_ALLOWED_VIEWS = {
+    'api_mobile_nodes_list',
+    'api_mobile_node_detail',
+    'api_mobile_node_bundle',
+    'api_mobile_buildings_list',
+    'api_mobile_campus_map',
+    'api_mobile_find_path',
+    'api_mobile_edges_list',
+    'api_mobile_annotations_list',
+    'api_mobile_annotations_visible',
+    'api_mobile_annotations_prefetch',
+    'api_annotations',
+    'api_graph_data',
+    'api_node_details',
+    'api_mobile_search',
+    'api_mobile_spatial_nearest',
+    'api_mobile_spatial_viewport',
+    'api_mobile_spatial_snap',
+}
+
+# Request headers that must not leak from the batch into its sub-requests
+_BATCH_DROPPED_META = ('HTTP_ACCEPT_ENCODING', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+                       'CONTENT_LENGTH', 'CONTENT_TYPE')
+
+
+def _batch_sub_request(request, method, path, query, body):
+    """Clone the batch request into a sub-request for another endpoint."""
+    sub = copy.copy(request)
+    sub.META = {k: v for k, v in request.META.items() if k not in _BATCH_DROPPED_META}
+    sub.META.update({'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query})
+    sub.environ = sub.META
+    sub.method = method
+    sub.path = sub.path_info = path
+    sub.GET = QueryDict(query)
+    sub.POST = QueryDict()
+    sub._body = json.dumps(body).encode() if body is not None else b''
+    return sub
+
+
+def _batch_response_body(response):
+    content = b''.join(response.streaming_content) if response.streaming else response.content
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content) if content else None
+    return content.decode(response.charset or 'utf-8')
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def api_batch(request):
+    """
+    Execute several read requests in one round trip.
+
+    Body: ``{"requests": [{"id": "node", "method": "GET", "path": "/api/mobile/nodes/1/"}, ...]}``.
+    ``method`` defaults to GET; ``body`` is passed as the JSON body of POST
+    sub-requests (e.g. find-path). Sub-requests run in-process and identical
+    ones are executed only once. Only read-only views are allowed, so a
+    batch reads like a GET request (from the read replica, if any) and never
+    opens a transaction. Sub-requests that would start after the time budget
+    is spent are answered with 503.
+    """
+    try:
+        data = json.loads(request.body)
+        specs = data.get('requests') if isinstance(data, dict) else None
+        if not isinstance(specs, list) or not specs:
+            return JsonResponse({'success': False, 'error': 'requests must be a non-empty list'}, status=400)
+        if len(specs) > BATCH_MAX_REQUESTS:
+            return JsonResponse({
+                'success': False,
+                'error': f'At most {BATCH_MAX_REQUESTS} requests per batch'
+            }, status=400)
+        
+        deadline = time.monotonic() + BATCH_TIME_BUDGET
+        results = []
+        memo = {}  # (method, path, body) -> (status, etag, body)
+        
+        # Every allowed view only reads, whatever its method
+        with replica_reads():
+            for index, spec in enumerate(specs):
+                if not isinstance(spec, dict) or not isinstance(spec.get('path'), str):
+                    results.append({'id': index, 'status': 400, 'body': {'success': False, 'error': 'path is required'}})
+                    continue
+                
+                request_id = spec.get('id', index)
+                method = str(spec.get('method', 'GET')).upper()
+                path, _, query = spec['path'].partition('?')
+                memo_key = (method, spec['path'], json.dumps(spec.get('body'), sort_keys=True))
+                
+                if memo_key not in memo:
+                    if time.monotonic() > deadline:
+                        results.append({'id': request_id, 'status': 503,
+                                        'body': {'success': False, 'error': 'Batch time budget exceeded'}})
+                        continue
+                    try:
+                        match = resolve(path)
+                    except Resolver404:
+                        match = None
+                    if match is None or match.url_name not in BATCH_ALLOWED_VIEWS:
+                        memo[memo_key] = (404, None, {'success': False, 'error': 'Endpoint not available in batch'})
+                    else:
+                        sub = _batch_sub_request(request, method, path, query, spec.get('body'))
+                        response = match.func(sub, *match.args, **match.kwargs)
+                        memo[memo_key] = (response.status_code, response.get('ETag'),
+                                          _batch_response_body(response))
+                
+                status, etag, body = memo[memo_key]
+                result = {'id': request_id, 'status': status, 'body': body}
+                if etag:
+                    result['etag'] = etag
+                results.append(result)
+        
+        return JsonResponse({
+            'success': True,
+            'responses': results
+        })
+    
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
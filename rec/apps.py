@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RecConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rec'
+
+    def ready(self):
+        # Register model signal handlers
+        from . import signals  # noqa: F401
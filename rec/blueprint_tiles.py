@@ -0,0 +1,135 @@
+"""
+Deep-zoom tile pyramids for campus blueprints.
+
+High-resolution blueprints are slow to download and decode on phones. When a
+``CampusMap`` is saved its blueprint is cut into a Deep Zoom (DZI) pyramid:
+
+    map_tiles/<digest>/blueprint.dzi
+    map_tiles/<digest>/blueprint_files/<level>/<col>_<row>.jpg
+    map_tiles/<digest>/manifest.json
+
+Level ``max_level`` is the full-size image and every level below halves it,
+down to a single pixel at level 0. Tiles are ``TILE_SIZE`` pixels plus
+``OVERLAP`` pixels shared with each neighbor, the layout OpenSeadragon and
+similar viewers expect; the level/col/row triple doubles as an XYZ address.
+``<digest>`` is the hash of the blueprint content, so tile URLs never change
+meaning and can be cached for good (see ``views.api_map_tile``).
+"""
+
+import json
+import math
+import re
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image
+
+from .imaging import file_digest, open_rgb, save_file, save_image, sync_manifest
+
+TILES_ROOT = 'map_tiles'
+TILE_SIZE = 254
+OVERLAP = 1
+TILE_FORMAT = 'jpg'
+JPEG_QUALITY = 85
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{format}" '
+    'Overlap="{overlap}" TileSize="{tile_size}"><Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+
+_digest_re = re.compile(r'^[0-9a-f]{20}$')
+
+
+def max_level(width, height):
+    return math.ceil(math.log2(max(width, height, 1)))
+
+
+def tile_path(base, level, col, row):
+    return f'{base}/blueprint_files/{level}/{col}_{row}.{TILE_FORMAT}'
+
+
+def open_tile(digest, level, col, row):
+    """Open a stored tile for reading; raises FileNotFoundError for unknown tiles."""
+    if not _digest_re.match(digest):
+        raise FileNotFoundError(digest)
+    return default_storage.open(tile_path(f'{TILES_ROOT}/{digest}', level, col, row), 'rb')
+
+
+def generate_blueprint_tiles(field_file, tile_size=TILE_SIZE, overlap=OVERLAP):
+    """Cut a stored blueprint into a DZI pyramid and return its manifest."""
+    base = f'{TILES_ROOT}/{file_digest(field_file)}'
+    manifest_path = f'{base}/manifest.json'
+    if default_storage.exists(manifest_path):
+        with default_storage.open(manifest_path, 'rb') as f:
+            return {**json.load(f), 'source': field_file.name}
+
+    image = open_rgb(field_file)
+    width, height = image.size
+    top = max_level(width, height)
+
+    for level in range(top, -1, -1):
+        level_width, level_height = image.size
+        for col in range(math.ceil(level_width / tile_size)):
+            for row in range(math.ceil(level_height / tile_size)):
+                box = (
+                    max(col * tile_size - overlap, 0),
+                    max(row * tile_size - overlap, 0),
+                    min((col + 1) * tile_size + overlap, level_width),
+                    min((row + 1) * tile_size + overlap, level_height),
+                )
+                save_image(tile_path(base, level, col, row), image.crop(box), 'JPEG', quality=JPEG_QUALITY)
+        if level:
+            # Each level is built from the one above, ceil(size / 2) like the DZI spec
+            image = image.resize((math.ceil(level_width / 2), math.ceil(level_height / 2)), Image.LANCZOS)
+
+    manifest = {
+        'type': 'dzi',
+        'base': base,
+        'format': TILE_FORMAT,
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'width': width,
+        'height': height,
+        'max_level': top,
+    }
+    save_file(f'{base}/blueprint.dzi', DZI_TEMPLATE.format(**manifest).encode())
+    # Written last: its presence marks a complete pyramid
+    save_file(manifest_path, json.dumps(manifest).encode())
+    return {**manifest, 'source': field_file.name}
+
+
+def ensure_blueprint_tiles(campus_map):
+    """Bring ``campus_map.blueprint_tiles`` in line with its image; True when it changed."""
+    return sync_manifest(campus_map, 'blueprint_image', 'blueprint_tiles', generate_blueprint_tiles)
+
+
+def tiles_enabled():
+    return getattr(settings, 'REC_MAP_TILES', True)
+
+
+def digest_of(manifest):
+    return manifest['base'].rsplit('/', 1)[1]
+
+
+def public_manifest(manifest, request):
+    """API form of a blueprint tile manifest, or None."""
+    if not manifest:
+        return None
+    # URL of the first tile without its "<level>/<col>_<row>.jpg" part
+    first_tile = reverse('api_map_tile', args=[digest_of(manifest), 0, 0, 0])
+    tiles_url = request.build_absolute_uri(first_tile[:-len(f'0/0_0.{TILE_FORMAT}')])
+    return {
+        'type': manifest['type'],
+        'width': manifest['width'],
+        'height': manifest['height'],
+        'tile_size': manifest['tile_size'],
+        'overlap': manifest['overlap'],
+        'format': manifest['format'],
+        'max_level': manifest['max_level'],
+        'tiles_url': tiles_url,
+        'tile_url_template': tiles_url + '{z}/{x}_{y}.' + manifest['format'],
+        'dzi_url': request.build_absolute_uri(default_storage.url(f"{manifest['base']}/blueprint.dzi")),
+    }
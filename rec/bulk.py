@@ -0,0 +1,357 @@
+"""
+Transactional bulk writes of nodes, edges and annotations.
+
+``apply(changes)`` takes, per collection, lists of ``create``s, ``update``s
+and ``delete``s::
+
+    {
+        "nodes": {"create": [{"node_code": "B-101", "name": ..., ...}],
+                  "update": [{"node_id": 7, "map_x": 12.5, "map_y": 40.0}],
+                  "delete": [9]},
+        "edges": {"create": [{"from_node_code": "B-101", "to_node_id": 7, ...}]},
+        "annotations": {"delete": [3]}
+    }
+
+Every operation is validated before anything is written; a single error
+rejects the whole batch. Rows are then written with ``bulk_create`` /
+``bulk_update`` in one transaction, deletes first (freeing node codes),
+then nodes, then edges and annotations, which may reference new nodes by
+``<field>_code``. Versions are bumped and graph precomputation queued once
+for the batch, and the QR codes of new or renamed nodes are rendered by a
+single background job.
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.utils import timezone
+
+from . import jobs, signals, tasks
+from .models import Nodes, Edges, Annotation
+from .qrcodes import qrcode_hash
+from .transactions import write_transaction
+from .versioning import NODES, EDGES, ANNOTATIONS
+
+ACTIONS = ('create', 'update', 'delete')
+
+# Most operations accepted in one batch
+MAX_OPERATIONS = 5000
+
+# Rows per INSERT / UPDATE statement
+WRITE_BATCH_SIZE = 500
+
+
+class BulkError(Exception):
+    """The batch was rejected; ``errors`` lists what is wrong with which operation."""
+
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid operation(s)')
+        self.errors = errors
+
+
+class Collection:
+    """How the operations of one collection map onto its model."""
+
+    def __init__(self, name, model, fields, required, node_fields=(), table=None):
+        self.name = name
+        self.model = model
+        self.pk = model._meta.pk.name
+        # Writable fields; foreign keys to nodes are given as <field>_id or <field>_code
+        self.fields = fields
+        self.required = required
+        self.node_fields = node_fields
+        self.table = table
+
+
+COLLECTIONS = (
+    Collection('nodes', Nodes,
+               fields=('node_code', 'name', 'building', 'floor_level', 'type_of_node', 'description',
+                       'map_x', 'map_y'),
+               required=('node_code', 'name', 'building', 'floor_level'),
+               table=NODES),
+    Collection('edges', Edges,
+               fields=('from_node', 'to_node', 'distance', 'compass_angle', 'is_staircase', 'is_active'),
+               required=('from_node', 'to_node', 'distance', 'compass_angle'),
+               node_fields=('from_node', 'to_node'),
+               table=EDGES),
+    Collection('annotations', Annotation,
+               fields=('panorama', 'target_node', 'label', 'yaw', 'pitch', 'visible_radius', 'is_active'),
+               required=('panorama', 'label', 'yaw', 'pitch'),
+               node_fields=('panorama', 'target_node'),
+               table=ANNOTATIONS),
+)
+
+
+class _Batch:
+    """Operations of a request being validated, and the errors found."""
+
+    def __init__(self, changes):
+        self.errors = []
+        self.operations = {}
+        count = 0
+        for collection in COLLECTIONS:
+            actions = changes.get(collection.name) or {}
+            if not isinstance(actions, dict):
+                self.error(collection, None, None, 'Expected an object of create, update and delete lists')
+                actions = {}
+            for action in ACTIONS:
+                items = actions.get(action) or []
+                if not isinstance(items, list):
+                    self.error(collection, action, None, 'Expected a list')
+                    items = []
+                self.operations[collection.name, action] = items
+                count += len(items)
+        unknown = set(changes) - {collection.name for collection in COLLECTIONS}
+        if unknown:
+            self.errors.append({'error': f'Unknown collection(s): {", ".join(sorted(unknown))}'})
+        if count > MAX_OPERATIONS:
+            self.errors.append({'error': f'At most {MAX_OPERATIONS} operations per batch'})
+
+    def error(self, collection, action, index, message):
+        self.errors.append({'collection': collection.name, 'action': action, 'index': index, 'error': message})
+
+    def items(self, collection, action):
+        return self.operations[collection.name, action]
+
+
+def _coerce(model, name, value):
+    """``value`` converted and validated for the model field ``name``; raises ValidationError."""
+    return model._meta.get_field(name).clean(value, None)
+
+
+def _pk(model, value):
+    """``value`` as a primary key of ``model``, or None if it is not one."""
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        return None
+
+
+def _message(error):
+    return '; '.join(error.messages) if isinstance(error, ValidationError) else str(error)
+
+
+def _node_references(batch):
+    """Node IDs and codes the edges and annotations of the batch refer to."""
+    ids, codes = set(), set()
+    for collection in COLLECTIONS:
+        for action in ('create', 'update'):
+            for item in batch.items(collection, action):
+                if not isinstance(item, dict):
+                    continue
+                for name in collection.node_fields:
+                    if item.get(f'{name}_id') is not None:
+                        ids.add(_pk(Nodes, item[f'{name}_id']))
+                    if isinstance(item.get(f'{name}_code'), str):
+                        codes.add(item[f'{name}_code'])
+    return ids, codes
+
+
+class _Nodes:
+    """Nodes the batch may refer to: existing ones not deleted by it, and the ones it creates."""
+
+    def __init__(self, batch, deleted):
+        codes = {}
+        for action in ('create', 'update'):
+            codes[action] = {item['node_code'] for item in batch.items(COLLECTIONS[0], action)
+                             if isinstance(item, dict) and isinstance(item.get('node_code'), str)}
+        self.created_codes = codes['create']
+        ids, referenced_codes = _node_references(batch)
+        self.ids = set(Nodes.objects.filter(node_id__in=ids - {None}).exclude(node_id__in=deleted)
+                       .values_list('node_id', flat=True))
+        # Code -> node ID, as of after the batch's renames (the creates are not saved yet)
+        self.owners = dict(Nodes.objects.filter(node_code__in=codes['create'] | codes['update'] | referenced_codes)
+                           .exclude(node_id__in=deleted).values_list('node_code', 'node_id'))
+        self.claimed = set()
+
+    def claim(self, code, node_id=None):
+        """Record that ``code`` belongs to ``node_id`` (None: a new node); ValidationError if taken."""
+        owner = self.owners.get(code)
+        if code in self.claimed or (owner is not None and owner != node_id):
+            raise ValidationError(f'Node code {code} already exists')
+        self.claimed.add(code)
+        if node_id is not None:
+            for old_code in [c for c, i in self.owners.items() if i == node_id]:
+                del self.owners[old_code]
+            self.owners[code] = node_id
+
+    def set_reference(self, row, name, item):
+        """Point foreign key ``name`` of ``row`` at the node given by ``<name>_id`` or ``<name>_code``."""
+        node_id, code = item.get(f'{name}_id'), item.get(f'{name}_code')
+        if code is not None and not isinstance(code, str):
+            raise ValidationError('Node codes must be strings')
+        if node_id is not None:
+            if _pk(Nodes, node_id) not in self.ids:
+                raise ValidationError(f'Node {node_id} not found')
+            setattr(row, f'{name}_id', _pk(Nodes, node_id))
+        elif code in self.owners:
+            setattr(row, f'{name}_id', self.owners[code])
+        elif code in self.created_codes:
+            # Resolved once the node is created
+            row._node_codes[name] = code
+        elif code:
+            raise ValidationError(f'Node {code} not found')
+        else:
+            setattr(row, name, None)
+
+
+def _read(collection, row, item, given, creating, nodes):
+    """Set the ``given`` fields of ``item`` on ``row``; returns (changed fields, {field: error})."""
+    model = collection.model
+    row._node_codes = {}
+    fields, problems = [], {}
+    for name in collection.fields:
+        if name in collection.node_fields:
+            keys = (f'{name}_id', f'{name}_code')
+            if not given.intersection(keys) and not creating:
+                continue
+            if name in collection.required and item.get(keys[0]) is None and not item.get(keys[1]):
+                problems[keys[0]] = 'This field is required.'
+                continue
+        elif name not in given:
+            if creating and name in collection.required:
+                problems[name] = 'This field is required.'
+            continue
+        try:
+            if name in collection.node_fields:
+                nodes.set_reference(row, name, item)
+            else:
+                setattr(row, name, _coerce(model, name, item[name]))
+                if name == 'node_code':
+                    nodes.claim(row.node_code, None if creating else row.pk)
+            fields.append(name)
+        except ValidationError as e:
+            problems[name] = _message(e)
+
+    allowed = set(collection.fields) | {f'{name}_{suffix}' for name in collection.node_fields
+                                        for suffix in ('id', 'code')}
+    for name in sorted(given - allowed):
+        problems[name] = 'Unknown field'
+    return fields, problems
+
+
+def _validate(batch):
+    """
+    Check every operation, loading the rows to update and delete.
+
+    Returns ``{collection name: {'create': [rows], 'update': [(row, fields)],
+    'delete': [pks]}}`` with unsaved rows for creates; foreign keys to nodes
+    created in the batch are left as codes in ``row._node_codes``.
+    """
+    plan = {}
+    for collection in COLLECTIONS:
+        pks = [_pk(collection.model, value) for value in batch.items(collection, 'delete')]
+        existing = set(collection.model.objects.filter(pk__in=set(pks) - {None}).values_list('pk', flat=True))
+        for index, pk in enumerate(pks):
+            if pk not in existing:
+                batch.error(collection, 'delete', index,
+                            f'{collection.model.__name__} {batch.items(collection, "delete")[index]} not found')
+        plan[collection.name] = {'create': [], 'update': [], 'delete': list(dict.fromkeys(pks))}
+
+    nodes = _Nodes(batch, plan['nodes']['delete'])
+    for collection in COLLECTIONS:
+        model = collection.model
+        deleted = set(plan[collection.name]['delete'])
+        rows = model.objects.in_bulk({_pk(model, item.get(collection.pk)) for item in batch.items(collection, 'update')
+                                      if isinstance(item, dict)} - {None} - deleted)
+        updated = set()
+        for action in ('create', 'update'):
+            for index, item in enumerate(batch.items(collection, action)):
+                if not isinstance(item, dict):
+                    batch.error(collection, action, index, 'Expected an object')
+                    continue
+                if action == 'create':
+                    row, given = model(), set(item)
+                else:
+                    row = rows.get(_pk(model, item.get(collection.pk)))
+                    if row is None:
+                        batch.error(collection, action, index, f'{model.__name__} {item.get(collection.pk)} not found')
+                        continue
+                    if row.pk in updated:
+                        batch.error(collection, action, index, f'{model.__name__} {row.pk} updated twice')
+                        continue
+                    updated.add(row.pk)
+                    given = set(item) - {collection.pk}
+                fields, problems = _read(collection, row, item, given, action == 'create', nodes)
+                if problems:
+                    batch.error(collection, action, index, problems)
+                elif action == 'create':
+                    plan[collection.name]['create'].append(row)
+                else:
+                    plan[collection.name]['update'].append((row, fields))
+    if batch.errors:
+        raise BulkError(batch.errors)
+    return plan
+
+
+def _bulk_update(model, updates):
+    """``bulk_update`` of (row, fields) pairs, one statement set per distinct field list."""
+    groups = {}
+    for row, fields in updates:
+        if fields:
+            groups.setdefault(tuple(fields), []).append(row)
+    for fields, rows in groups.items():
+        model.objects.bulk_update(rows, fields, batch_size=WRITE_BATCH_SIZE)
+
+
+def apply(changes):
+    """
+    Validate and write a batch (see the module docstring).
+
+    Returns per collection the IDs of the created rows and the numbers of
+    updated and deleted ones; raises ``BulkError`` without writing anything
+    when an operation is invalid.
+    """
+    if not isinstance(changes, dict):
+        raise BulkError([{'error': 'Expected a JSON object'}])
+    batch = _Batch(changes)
+    if batch.errors:
+        raise BulkError(batch.errors)
+    plan = _validate(batch)
+    try:
+        return _write(plan)
+    except IntegrityError as e:
+        # Constraints validation does not cover, e.g. duplicate annotations
+        raise BulkError([{'error': str(e)}])
+
+
+def _write(plan):
+    result = {}
+    tables = set()
+    qrcode_nodes = []
+    with write_transaction(), signals.deferred_invalidation():
+        # Deletes cascade and release files through the model signals
+        for collection in reversed(COLLECTIONS):
+            pks = plan[collection.name]['delete']
+            if pks:
+                collection.model.objects.filter(pk__in=pks).delete()
+
+        node_ids = {}
+        for collection in COLLECTIONS:
+            operations = plan[collection.name]
+            for row in [*operations['create'], *(row for row, fields in operations['update'])]:
+                for name, code in row._node_codes.items():
+                    setattr(row, f'{name}_id', node_ids[code])
+            created = collection.model.objects.bulk_create(operations['create'], batch_size=WRITE_BATCH_SIZE)
+            if collection.model is Annotation:
+                now = timezone.now()
+                for row, fields in operations['update']:
+                    row.updated_at = now
+                    fields.append('updated_at')
+            _bulk_update(collection.model, operations['update'])
+            if collection.model is Nodes:
+                node_ids = {row.node_code: row.node_id for row in created}
+                qrcode_nodes = [row.node_id for row in created] + [
+                    row.node_id for row, fields in operations['update'] if row.qrcode_hash != qrcode_hash(row)]
+            result[collection.name] = {
+                'created': [row.pk for row in created],
+                'updated': len(operations['update']),
+                'deleted': len(operations['delete']),
+            }
+            if created or operations['update'] or operations['delete']:
+                tables.add(collection.table)
+
+        if qrcode_nodes:
+            jobs.enqueue(tasks.NODE_QRCODES, {'node_ids': qrcode_nodes}, priority=jobs.PRIORITY_HIGH)
+        # Rows written with bulk_create / bulk_update send no signals
+        signals.tables_changed(*tables)
+    return result
@@ -0,0 +1,157 @@
+"""
+Edge distances and compass angles recomputed from node map positions.
+
+``Nodes.map_x`` / ``map_y`` are percentages of the blueprint of the node's
+building and floor (see ``CampusMap.active_for``), so with the blueprint's
+size in pixels and its ``scale_meters_per_pixel`` they give positions in
+meters. For every edge whose ends lie on the same calibrated blueprint,
+``measure_edges`` computes the straight-line distance and the bearing (0°
+north, up on the blueprint, clockwise) and compares them with the stored
+values; ``recalibrate`` writes the computed ones back.
+
+The geometry of all edges is computed in one vectorized pass when NumPy is
+installed, and in plain Python otherwise.
+"""
+
+import math
+
+from django.db import transaction
+
+from . import signals
+from .models import Edges, CampusMap
+from .versioning import EDGES
+
+try:
+    import numpy
+except ImportError:  # optional dependency
+    numpy = None
+
+# Stored distances off by more than this fraction (and MIN_DISTANCE_ERROR meters) are outliers
+DISTANCE_TOLERANCE = 0.2
+MIN_DISTANCE_ERROR = 0.5
+# Stored angles off by more than this many degrees are outliers
+ANGLE_TOLERANCE = 15.0
+
+WRITE_BATCH_SIZE = 500
+
+_EDGE_COLUMNS = (
+    'edge_id', 'distance', 'compass_angle',
+    'from_node__node_code', 'from_node__building', 'from_node__floor_level', 'from_node__map_x', 'from_node__map_y',
+    'to_node__node_code', 'to_node__building', 'to_node__floor_level', 'to_node__map_x', 'to_node__map_y',
+)
+
+
+def geometry(dx, dy):
+    """
+    Distances and bearings (degrees clockwise from north) of offsets
+    ``dx`` (east) and ``dy`` (south) in meters, as two lists.
+    """
+    if numpy is not None:
+        dx, dy = numpy.asarray(dx, dtype=float), numpy.asarray(dy, dtype=float)
+        return numpy.hypot(dx, dy).tolist(), (numpy.degrees(numpy.arctan2(dx, -dy)) % 360).tolist()
+    return ([math.hypot(x, y) for x, y in zip(dx, dy)],
+            [math.degrees(math.atan2(x, -y)) % 360 for x, y in zip(dx, dy)])
+
+
+def angle_difference(a, b):
+    """Smallest difference between two compass angles, 0 to 180 degrees."""
+    difference = abs(a - b) % 360
+    return min(difference, 360 - difference)
+
+
+class _Blueprints:
+    """Meters per map percent along x and y of the blueprint each building floor is drawn on."""
+
+    def __init__(self):
+        self._scopes = {}
+        self._maps = {}
+
+    def scale(self, building, floor_level):
+        """(map ID, meters per percent of width, meters per percent of height), or None if uncalibrated."""
+        if (building, floor_level) not in self._scopes:
+            campus_map = CampusMap.active_for(building, floor_level)
+            self._scopes[building, floor_level] = campus_map and self._scale(campus_map)
+        return self._scopes[building, floor_level]
+
+    def _scale(self, campus_map):
+        if campus_map.map_id not in self._maps:
+            scale = None
+            if campus_map.scale_meters_per_pixel and campus_map.blueprint_image:
+                try:
+                    width, height = campus_map.blueprint_image.width, campus_map.blueprint_image.height
+                except (OSError, ValueError):
+                    width = height = None
+                if width and height:
+                    meters = campus_map.scale_meters_per_pixel / 100
+                    scale = (campus_map.map_id, width * meters, height * meters)
+            self._maps[campus_map.map_id] = scale
+        return self._maps[campus_map.map_id]
+
+
+def measure_edges(edges=None, distance_tolerance=DISTANCE_TOLERANCE, angle_tolerance=ANGLE_TOLERANCE):
+    """
+    Compare the stored distance and angle of ``edges`` (default: all) with
+    the map geometry.
+
+    Returns ``(measured, skipped)``: ``measured`` has a dict per edge with
+    both ends positioned on the same calibrated blueprint (stored and
+    computed ``distance`` / ``compass_angle``, their errors and ``outlier``);
+    ``skipped`` counts the other edges.
+    """
+    blueprints = _Blueprints()
+    rows, dx, dy = [], [], []
+    skipped = 0
+    for row in (Edges.objects.all() if edges is None else edges).values(*_EDGE_COLUMNS).iterator(chunk_size=2000):
+        from_scale = blueprints.scale(row['from_node__building'], row['from_node__floor_level'])
+        to_scale = blueprints.scale(row['to_node__building'], row['to_node__floor_level'])
+        positions = (row['from_node__map_x'], row['from_node__map_y'], row['to_node__map_x'], row['to_node__map_y'])
+        # Different floors (stairs) or blueprints have no common coordinates
+        if (from_scale is None or from_scale != to_scale or None in positions
+                or row['from_node__floor_level'] != row['to_node__floor_level']):
+            skipped += 1
+            continue
+        _, x_meters, y_meters = from_scale
+        from_x, from_y, to_x, to_y = positions
+        rows.append(row)
+        dx.append((to_x - from_x) * x_meters)
+        dy.append((to_y - from_y) * y_meters)
+
+    measured = []
+    for row, distance, angle in zip(rows, *geometry(dx, dy)):
+        distance_error = row['distance'] - distance
+        # Coincident nodes have no bearing
+        angle_error = angle_difference(row['compass_angle'], angle) if distance else 0.0
+        outlier = ((abs(distance_error) > max(distance * distance_tolerance, MIN_DISTANCE_ERROR))
+                   or angle_error > angle_tolerance)
+        measured.append({
+            'edge_id': row['edge_id'],
+            'from_node_code': row['from_node__node_code'],
+            'to_node_code': row['to_node__node_code'],
+            'stored_distance': row['distance'],
+            'distance': round(distance, 2),
+            'distance_error': round(distance_error, 2),
+            'stored_compass_angle': row['compass_angle'],
+            'compass_angle': round(angle, 1) if distance else row['compass_angle'],
+            'angle_error': round(angle_error, 1),
+            'outlier': outlier,
+        })
+    return measured, skipped
+
+
+def recalibrate(measured, only_outliers=True):
+    """
+    Store the computed distance and angle of ``measured`` edges (only the
+    outliers by default) with ``bulk_update``; the graph is invalidated once.
+    Returns the number of edges updated.
+    """
+    changes = {item['edge_id']: item for item in measured if item['outlier'] or not only_outliers}
+    edges = list(Edges.objects.filter(edge_id__in=changes).only('edge_id', 'distance', 'compass_angle'))
+    for edge in edges:
+        edge.distance = changes[edge.edge_id]['distance']
+        edge.compass_angle = changes[edge.edge_id]['compass_angle']
+    if edges:
+        with transaction.atomic():
+            Edges.objects.bulk_update(edges, ['distance', 'compass_angle'], batch_size=WRITE_BATCH_SIZE)
+            # bulk_update sends no signals
+            signals.tables_changed(EDGES)
+    return len(edges)
@@ -0,0 +1,145 @@
+"""
+Lock contention harness for the SQLite settings.
+
+``measure(profile)`` copies the database to a temporary file and, for a few
+seconds, runs reader threads loading the routing graph (the pathfinder's
+queries) against writer threads doing short read-then-write transactions,
+as admin edits do. Each thread has its own connection configured like
+``PROFILES[profile]``; the result counts the operations, the ones that
+failed with "database is locked" and their latencies.
+
+``baseline`` is SQLite's defaults as Django used them before (rollback
+journal, DEFERRED transactions, 5 s timeout); ``configured`` is
+``DATABASES['default']['OPTIONS']``, with the writers' read-then-write
+transactions begun IMMEDIATE as ``rec.transactions.write_transaction()``
+does.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .models import Nodes, Edges
+
+SECONDS = 5.0
+READERS = 4
+WRITERS = 2
+
+_SCRATCH_TABLE = 'contention_writes'
+
+
+PROFILES = ('baseline', 'configured')
+
+
+def _options(profile):
+    if profile == 'baseline':
+        return {'init_command': 'PRAGMA journal_mode=DELETE', 'transaction_mode': 'DEFERRED', 'timeout': 5}
+    options = settings.DATABASES[DEFAULT_DB_ALIAS].get('OPTIONS', {})
+    return {'init_command': options.get('init_command', ''),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': options.get('timeout', 5)}
+
+
+def _sql(queryset):
+    sql, params = queryset.query.sql_with_params()
+    return sql.replace('%s', '?'), params
+
+
+def _configure(connection, options):
+    for statement in options['init_command'].split(';'):
+        if statement.strip():
+            connection.execute(statement)
+    return connection
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class _Worker(threading.Thread):
+
+    def __init__(self, path, options, deadline, operation):
+        super().__init__(daemon=True)
+        self.path, self.options, self.deadline, self.operation = path, options, deadline, operation
+        self.latencies, self.errors = [], 0
+        self.exception = None
+
+    def run(self):
+        connection = _configure(sqlite3.connect(self.path, timeout=self.options['timeout'], isolation_level=None),
+                                self.options)
+        try:
+            while time.monotonic() < self.deadline:
+                started = time.monotonic()
+                try:
+                    self.operation(connection)
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    if connection.in_transaction:
+                        connection.execute('ROLLBACK')
+                    self.errors += 1
+                else:
+                    self.latencies.append(time.monotonic() - started)
+        except Exception as e:
+            self.exception = e
+        finally:
+            connection.close()
+
+
+def measure(profile, seconds=SECONDS, readers=READERS, writers=WRITERS):
+    """Run the harness with the named profile; returns a dict of counts, rates and latencies."""
+    options = _options(profile)
+    graph_queries = [_sql(Nodes.objects.all()),
+                     _sql(Edges.objects.filter(is_active=True).select_related('from_node', 'to_node'))]
+    # Admin edits look rows up before they write
+    lookup = _sql(Nodes.objects.values('node_id')[:1])
+
+    def read(connection):
+        for sql, params in graph_queries:
+            connection.execute(sql, params).fetchall()
+
+    def write(connection):
+        connection.execute(f'BEGIN {options["transaction_mode"]}')
+        connection.execute(*lookup).fetchall()
+        connection.execute(f'INSERT INTO {_SCRATCH_TABLE} (written_at) VALUES (?)', (time.time(),))
+        connection.execute('COMMIT')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'contention.sqlite3')
+        setup = sqlite3.connect(path)
+        source = connections[DEFAULT_DB_ALIAS]
+        source.ensure_connection()
+        source.connection.backup(setup)
+        # The journal mode is stored in the file, so it is set before the workers connect
+        _configure(setup, options)
+        setup.execute(f'CREATE TABLE {_SCRATCH_TABLE} (id INTEGER PRIMARY KEY, written_at REAL)')
+        setup.close()
+
+        deadline = time.monotonic() + seconds
+        workers = ([_Worker(path, options, deadline, read) for _ in range(readers)]
+                   + [_Worker(path, options, deadline, write) for _ in range(writers)])
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        for worker in workers:
+            if worker.exception is not None:
+                raise worker.exception
+
+    result = {'profile': profile, 'seconds': seconds, 'readers': readers, 'writers': writers}
+    for kind, group in (('reads', workers[:readers]), ('writes', workers[readers:])):
+        latencies = [latency for worker in group for latency in worker.latencies]
+        result[kind] = len(latencies)
+        result[f'{kind}_per_second'] = round(len(latencies) / seconds, 1)
+        result[f'{kind}_locked'] = sum(worker.errors for worker in group)
+        result[f'{kind}_p95_ms'] = round(_percentile(latencies, 0.95) * 1000, 2)
+        result[f'{kind}_max_ms'] = round(max(latencies, default=0.0) * 1000, 2)
+    return result
@@ -0,0 +1,102 @@
+"""
+Routing of reads to an optional read replica (``DATABASES['replica']``).
+
+Reads go to the replica only inside ``replica_reads()``, which
+``ReplicaReadsMiddleware`` enters for GET, HEAD and OPTIONS requests, and
+only if the replica has caught up: the version tokens it holds (see
+rec/versioning.py) must equal the ones being served. The block then serves
+exactly those versions, so responses, cached lookups and the in-memory
+indexes built from replica rows are stored under the tokens of that data
+even if a write is published meanwhile. A replica that lags behind leaves
+the whole block on the primary.
+
+Within the block, reads return to the primary
+
+- inside a transaction on the primary, and
+- for the rest of the block after anything was written, so a request
+  reads its own writes.
+
+Writes and migrations always go to the primary. Without a replica
+configured the router changes nothing.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from . import versioning
+
+REPLICA = 'replica'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+
+
+def replica_versions():
+    """The served versions of all tables if the replica holds exactly that data, else None."""
+    served = {table: versioning.get_version(table) for table in versioning.TABLES}
+    try:
+        stored = versioning.stored_tokens(REPLICA)
+    except DatabaseError:
+        return None
+    if all(stored.get(table) == version[0] for table, version in served.items()):
+        return served
+    return None
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads of this thread to the replica until the block ends, if it has caught up."""
+    versions = replica_versions() if REPLICA in settings.DATABASES else None
+    previous = getattr(_state, 'replica', False), getattr(_state, 'pinned', False)
+    _state.replica, _state.pinned = versions is not None, False
+    try:
+        if versions is None:
+            yield
+        else:
+            with versioning.serving(versions):
+                yield
+    finally:
+        _state.replica, _state.pinned = previous
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if (getattr(_state, 'replica', False) and not getattr(_state, 'pinned', False)
+                and REPLICA in settings.DATABASES and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Read what was written from the primary, the replica may lag behind,
+        # and from then on the live versions
+        if getattr(_state, 'replica', False) and not getattr(_state, 'pinned', False):
+            versioning.stop_serving()
+        _state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both hold the same data
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db == REPLICA else None
+
+
+class ReplicaReadsMiddleware:
+    """Reads of safe requests from the replica."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            return self.get_response(request)
+        with replica_reads():
+            return self.get_response(request)
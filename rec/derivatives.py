@@ -0,0 +1,176 @@
+"""
+Responsive derivatives of uploaded images.
+
+List pages and the mobile app used to load full-size panoramas and
+blueprints just to show a preview. For every ``Nodes.image360`` and
+``CampusMap.blueprint_image`` this module renders:
+
+- ``thumb`` (320px wide) and ``medium`` (1600px wide) versions, each as WebP
+  and JPEG, never upscaled,
+- a BlurHash placeholder string (https://blurha.sh) the client can paint
+  while the real image loads.
+
+Files are stored under ``derivatives/<digest>/`` where ``<digest>`` is the
+hash of the source content, so they are generated once per distinct image
+and regenerated only when the source file changes.
+"""
+
+import json
+import math
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .imaging import file_digest, open_rgb, save_file, save_image, sync_manifest
+
+DERIVATIVES_ROOT = 'derivatives'
+
+# Derivative name -> maximum width in pixels
+SIZES = {
+    'thumb': 320,
+    'medium': 1600,
+}
+
+# File extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# BlurHash components along x and y
+PLACEHOLDER_COMPONENTS = (4, 3)
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _base83(value, length):
+    return ''.join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _srgb_to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+_LINEAR = [_srgb_to_linear(value) for value in range(256)]
+
+
+def _linear_to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def blurhash(image, components=PLACEHOLDER_COMPONENTS):
+    """BlurHash of an image, computed on a 32px wide copy."""
+    x_components, y_components = components
+    width = 32
+    height = max(1, round(width * image.height / image.width))
+    data = image.convert('RGB').resize((width, height), Image.BILINEAR).tobytes()
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                basis_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = normalisation * math.cos(math.pi * i * x / width) * basis_y
+                    offset = 3 * (y * width + x)
+                    r += basis * _LINEAR[data[offset]]
+                    g += basis * _LINEAR[data[offset + 1]]
+                    b += basis * _LINEAR[data[offset + 2]]
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, math.floor(max(abs(v) for f in ac for v in f) * 166 - 0.5)))
+        max_value = (quantised + 1) / 166
+        result += _base83(quantised, 1)
+    else:
+        max_value = 1
+        result += _base83(0, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        r, g, b = (max(0, min(18, math.floor(_sign_pow(v / max_value, 0.5) * 9 + 9.5))) for v in factor)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def generate_derivatives(field_file):
+    """Render the derivatives of a stored image and return their manifest."""
+    base = f'{DERIVATIVES_ROOT}/{file_digest(field_file)}'
+    manifest_path = f'{base}/manifest.json'
+    if default_storage.exists(manifest_path):
+        with default_storage.open(manifest_path, 'rb') as f:
+            return {**json.load(f), 'source': field_file.name}
+
+    source = open_rgb(field_file)
+    manifest = {
+        'base': base,
+        'width': source.width,
+        'height': source.height,
+        'placeholder': blurhash(source),
+        'sizes': {},
+    }
+    for name, max_width in SIZES.items():
+        width = min(max_width, source.width)
+        height = max(1, round(source.height * width / source.width))
+        image = source if width == source.width else source.resize((width, height), Image.LANCZOS)
+        files = {}
+        for extension, (format, options) in FORMATS.items():
+            files[extension] = f'{base}/{name}.{extension}'
+            save_image(files[extension], image, format, **options)
+        manifest['sizes'][name] = {'width': width, 'height': height, **files}
+
+    # Written last: its presence marks a complete set
+    save_file(manifest_path, json.dumps(manifest).encode())
+    return {**manifest, 'source': field_file.name}
+
+
+def ensure_derivatives(instance, field, target):
+    """Bring ``instance.<target>`` in line with image field ``instance.<field>``; True when it changed."""
+    return sync_manifest(instance, field, target, generate_derivatives)
+
+
+def derivatives_enabled():
+    return getattr(settings, 'REC_IMAGE_DERIVATIVES', True)
+
+
+def derivative_url(manifest, size='thumb', extension='jpg'):
+    """Storage URL of one derivative, or None."""
+    if not manifest:
+        return None
+    return default_storage.url(manifest['sizes'][size][extension])
+
+
+def public_derivatives(manifest, absolute):
+    """
+    API form of a derivatives manifest, or None.
+
+    ``absolute`` turns a storage URL into the URL returned to the client.
+    """
+    if not manifest:
+        return None
+    data = {
+        'width': manifest['width'],
+        'height': manifest['height'],
+        'placeholder': manifest['placeholder'],
+    }
+    for name, files in manifest['sizes'].items():
+        data[name] = {
+            'width': files['width'],
+            'height': files['height'],
+            'webp_url': absolute(default_storage.url(files['webp'])),
+            'jpeg_url': absolute(default_storage.url(files['jpg'])),
+        }
+    return data
@@ -0,0 +1,210 @@
+"""
+Structural checks of the navigation graph.
+
+``analyze()`` runs on the ``PathFinder`` graph (active edges, both
+directions), once with every edge and once without stairs, and reports
+
+- connected components and the nodes outside the largest one,
+- bridges (edges whose closure disconnects the graph) and articulation
+  points (nodes whose loss does),
+- nodes no entrance can reach,
+
+plus, over all stored edges, self edges and node pairs joined by more than
+one edge (``asymmetric`` when they disagree on distance or direction).
+``closure_impact(edge_id)`` lists the nodes that could no longer be reached
+from an entrance if that edge were deactivated.
+
+Every analysis is a linear-time graph traversal; the results are cached per
+graph version, so repeated calls are free until the graph changes.
+"""
+
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Edges
+from .pathfinding import get_pathfinder
+from .versioning import graph_version
+
+MODES = {'all': False, 'no_stairs': True}
+
+ENTRANCE_TYPE = 'entrance'
+
+# Distances and angles within these are considered equal for parallel edges
+DISTANCE_EPSILON = 0.01
+ANGLE_EPSILON = 1.0
+
+
+def _cached(key, build):
+    key = f'rec:graph-health:{graph_version()}:{key}'
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, getattr(settings, 'REC_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return data
+
+
+def _adjacency(pathfinder, avoid_stairs, closed_edge=None):
+    """{node_id: [(neighbor_id, edge_id), ...]} of the usable edges."""
+    return {node_id: [(edge['to'], edge['edge_id']) for edge in edges
+                      if not (avoid_stairs and edge['is_staircase']) and edge['edge_id'] != closed_edge]
+            for node_id, edges in pathfinder.graph.items()}
+
+
+def _reachable(adjacency, sources):
+    seen = set(sources)
+    queue = deque(seen)
+    while queue:
+        for neighbor, _ in adjacency[queue.popleft()]:
+            if neighbor not in seen:
+                seen.add(neighbor)
+                queue.append(neighbor)
+    return seen
+
+
+def components(adjacency):
+    """Connected components as sets of node IDs, largest first."""
+    found, seen = [], set()
+    for node_id in adjacency:
+        if node_id not in seen:
+            component = _reachable(adjacency, [node_id])
+            seen |= component
+            found.append(component)
+    return sorted(found, key=len, reverse=True)
+
+
+def bridges_and_articulation_points(adjacency):
+    """
+    (bridge edge IDs, articulation point node IDs) by Tarjan's lowlink
+    method, iterative so that long corridors do not hit the recursion limit.
+    Parallel edges are told apart by ID, so a doubled edge is no bridge.
+    """
+    order, low = {}, {}
+    bridges, articulation_points = [], set()
+    for root in adjacency:
+        if root in order:
+            continue
+        order[root] = low[root] = len(order)
+        root_children = 0
+        stack = [(root, None, iter(adjacency[root]))]
+        while stack:
+            node_id, via_edge, neighbors = stack[-1]
+            for neighbor, edge_id in neighbors:
+                if edge_id == via_edge:
+                    continue
+                if neighbor in order:
+                    low[node_id] = min(low[node_id], order[neighbor])
+                else:
+                    order[neighbor] = low[neighbor] = len(order)
+                    stack.append((neighbor, edge_id, iter(adjacency[neighbor])))
+                    break
+            else:
+                stack.pop()
+                if not stack:
+                    continue
+                parent = stack[-1][0]
+                low[parent] = min(low[parent], low[node_id])
+                if low[node_id] > order[parent]:
+                    bridges.append(via_edge)
+                if parent == root:
+                    root_children += 1
+                elif low[node_id] >= order[parent]:
+                    articulation_points.add(parent)
+        if root_children > 1:
+            articulation_points.add(root)
+    return bridges, articulation_points
+
+
+def _entrances(pathfinder):
+    return [node_id for node_id, node in pathfinder.nodes_cache.items() if node.type_of_node == ENTRANCE_TYPE]
+
+
+def _edge_problems():
+    """Self edges and groups of edges joining the same two nodes, over all stored edges."""
+    pairs = defaultdict(list)
+    self_edges = []
+    for edge in Edges.objects.values('edge_id', 'from_node_id', 'to_node_id', 'distance', 'compass_angle',
+                                     'is_active').iterator(chunk_size=2000):
+        if edge['from_node_id'] == edge['to_node_id']:
+            self_edges.append(edge['edge_id'])
+        else:
+            pairs[frozenset((edge['from_node_id'], edge['to_node_id']))].append(edge)
+    duplicates = []
+    for edges in pairs.values():
+        if len(edges) < 2:
+            continue
+        first = edges[0]
+        asymmetric = False
+        for edge in edges[1:]:
+            # A reversed edge points the opposite way
+            angle = edge['compass_angle'] + (0 if edge['from_node_id'] == first['from_node_id'] else 180)
+            difference = abs(angle - first['compass_angle']) % 360
+            if (abs(edge['distance'] - first['distance']) > DISTANCE_EPSILON
+                    or min(difference, 360 - difference) > ANGLE_EPSILON):
+                asymmetric = True
+        duplicates.append({'edge_ids': [edge['edge_id'] for edge in edges], 'asymmetric': asymmetric,
+                           'active': sum(edge['is_active'] for edge in edges)})
+    return self_edges, duplicates
+
+
+def _analyze():
+    pathfinder = get_pathfinder()
+    codes = {node_id: node.node_code for node_id, node in pathfinder.nodes_cache.items()}
+    entrances = _entrances(pathfinder)
+    edge_ends = {edge['edge_id']: (node_id, edge['to'])
+                 for node_id, edges in pathfinder.graph.items() for edge in edges}
+
+    report = {
+        'version': graph_version(),
+        'nodes': len(pathfinder.graph),
+        'active_edges': len(edge_ends),
+        'entrances': [codes[node_id] for node_id in entrances],
+        'modes': {},
+    }
+    for mode, avoid_stairs in MODES.items():
+        adjacency = _adjacency(pathfinder, avoid_stairs)
+        found = components(adjacency)
+        bridges, articulation_points = bridges_and_articulation_points(adjacency)
+        reachable = _reachable(adjacency, entrances)
+        report['modes'][mode] = {
+            'components': len(found),
+            'component_sizes': [len(component) for component in found],
+            'outside_largest_component': sorted(codes[node_id] for component in found[1:] for node_id in component),
+            'bridges': [{'edge_id': edge_id, 'from_node_code': codes[edge_ends[edge_id][0]],
+                         'to_node_code': codes[edge_ends[edge_id][1]]} for edge_id in sorted(bridges)],
+            'articulation_points': sorted(codes[node_id] for node_id in articulation_points),
+            # Without entrances there is nothing to be unreachable from
+            'unreachable_from_entrances': sorted(codes[node_id] for node_id in adjacency
+                                                 if entrances and node_id not in reachable),
+        }
+    report['self_edges'], report['duplicate_edges'] = _edge_problems()
+    return report
+
+
+def analyze():
+    """Health report of the current graph (see the module docstring), cached per graph version."""
+    return _cached('report', _analyze)
+
+
+def closure_impact(edge_id, avoid_stairs=False):
+    """
+    Nodes that could no longer be reached from an entrance (from the edge's
+    ``from_node`` when there is no entrance) if edge ``edge_id`` were
+    deactivated; None if there is no such edge.
+    """
+    def build():
+        edge = Edges.objects.filter(edge_id=edge_id).values('from_node_id', 'is_active').first()
+        if edge is None:
+            return {}
+        pathfinder = get_pathfinder()
+        sources = _entrances(pathfinder) or [edge['from_node_id']]
+        before = _reachable(_adjacency(pathfinder, avoid_stairs), sources)
+        after = _reachable(_adjacency(pathfinder, avoid_stairs, closed_edge=edge_id), sources)
+        return {
+            'edge_id': edge_id,
+            'is_active': edge['is_active'],
+            'avoid_stairs': avoid_stairs,
+            'unreachable': sorted(pathfinder.nodes_cache[node_id].node_code for node_id in before - after),
+        }
+    return _cached(f'closure:{edge_id}:{int(avoid_stairs)}', build) or None
@@ -0,0 +1,329 @@
+"""
+Import and export of the campus graph as JSON Lines, CSV or GeoJSON.
+
+Nodes, edges and annotations are written as flat records with a ``type``
+(``node``, ``edge``, ``annotation``). Foreign keys are written as node codes
+(``from_node_code``...), never as database IDs, so a file moves between
+databases: importing upserts each record by its key
+
+- nodes: ``node_code``,
+- edges: ``from_node_code`` and ``to_node_code``,
+- annotations: ``panorama_code``, ``yaw``, ``pitch`` and ``label``.
+
+Both directions stream: exports iterate chunked querysets and imports work
+through ``BATCH_SIZE`` records at a time with ``bulk_create`` /
+``bulk_update``, so memory does not grow with the file. Records may only
+refer to nodes stored before or earlier in the file (exports write nodes
+first).
+
+The formats:
+
+- ``jsonl``: one JSON record per line.
+- ``csv``: one row per record, with the union of all record columns.
+- ``geojson``: a FeatureCollection; nodes are points and edges lines in map
+  coordinates (percent of the campus map, not longitude/latitude), with the
+  other fields as properties. Exports put one feature per line, which the
+  importer then reads line by line; other GeoJSON files are parsed whole.
+"""
+
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import jobs, signals, tasks
+from .bulk import COLLECTIONS, WRITE_BATCH_SIZE
+from .models import Nodes
+from .qrcodes import qrcode_hash
+from .transactions import write_transaction
+
+FORMATS = ('jsonl', 'csv', 'geojson')
+
+# Record type -> bulk.Collection
+RECORD_TYPES = dict(zip(('node', 'edge', 'annotation'), COLLECTIONS))
+
+# Fields identifying the row a record updates
+KEYS = {
+    'node': ('node_code',),
+    'edge': ('from_node', 'to_node'),
+    'annotation': ('panorama', 'yaw', 'pitch', 'label'),
+}
+
+BATCH_SIZE = 2000
+
+GEOJSON_HEADER = '{"type": "FeatureCollection", "features": ['
+
+
+class GraphImportError(Exception):
+    """A record cannot be imported; the message names its line."""
+
+
+def record_fields(record_type):
+    """Columns of a record type, node references as ``<field>_code``."""
+    collection = RECORD_TYPES[record_type]
+    return [f'{name}_code' if name in collection.node_fields else name for name in collection.fields]
+
+
+CSV_COLUMNS = ['type'] + list(dict.fromkeys(
+    field for record_type in RECORD_TYPES for field in record_fields(record_type)))
+
+
+def format_for(path):
+    """Format named by the extension of ``path`` (``.json`` for GeoJSON), jsonl if none is."""
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    if extension == 'json':
+        return 'geojson'
+    return extension if extension in FORMATS else 'jsonl'
+
+
+# ============= Export =============
+
+def _select(record_type):
+    """Columns to read for a record type: code lookups through the node relations."""
+    collection = RECORD_TYPES[record_type]
+    return {field: f'{field[:-5]}__node_code' if field.endswith('_code') and field[:-5] in collection.node_fields
+            else field for field in record_fields(record_type)}
+
+
+def export_records(types=tuple(RECORD_TYPES)):
+    """Yield the records of ``types``, nodes first, in primary key order."""
+    for record_type in RECORD_TYPES:
+        if record_type not in types:
+            continue
+        collection = RECORD_TYPES[record_type]
+        columns = _select(record_type)
+        rows = (collection.model.objects.order_by(collection.pk).values(*columns.values())
+                .iterator(chunk_size=BATCH_SIZE))
+        for row in rows:
+            yield {'type': record_type, **{field: row[column] for field, column in columns.items()}}
+
+
+def _feature(record, positions):
+    properties = dict(record)
+    geometry = None
+    if record['type'] == 'node':
+        x, y = properties.pop('map_x'), properties.pop('map_y')
+        if x is not None and y is not None:
+            geometry = {'type': 'Point', 'coordinates': [x, y]}
+    elif record['type'] == 'edge':
+        ends = [positions.get(record['from_node_code']), positions.get(record['to_node_code'])]
+        if all(ends):
+            geometry = {'type': 'LineString', 'coordinates': [list(end) for end in ends]}
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+
+def write_records(records, out, format):
+    """Write ``records`` to the text stream ``out``; returns how many were written."""
+    count = 0
+    if format == 'jsonl':
+        for count, record in enumerate(records, 1):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    elif format == 'csv':
+        writer = csv.DictWriter(out, CSV_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        for count, record in enumerate(records, 1):
+            writer.writerow(record)
+    elif format == 'geojson':
+        # Edge lines need their end points: the map position of every node
+        # (two floats per node), collected while the nodes are written
+        positions = {}
+        out.write(GEOJSON_HEADER)
+        for count, record in enumerate(records, 1):
+            if record['type'] == 'node' and record['map_x'] is not None and record['map_y'] is not None:
+                positions[record['node_code']] = (record['map_x'], record['map_y'])
+            out.write((',\n' if count > 1 else '\n') + json.dumps(_feature(record, positions), ensure_ascii=False))
+        out.write('\n]}\n')
+    else:
+        raise ValueError(f'Unknown format {format!r}')
+    return count
+
+
+# ============= Import =============
+
+def _from_feature(feature):
+    record = dict(feature.get('properties') or {})
+    geometry = feature.get('geometry')
+    if record.get('type') == 'node':
+        coordinates = geometry['coordinates'] if geometry and geometry.get('type') == 'Point' else [None, None]
+        record['map_x'], record['map_y'] = coordinates[:2]
+    return record
+
+
+def _parse(number, text):
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise GraphImportError(f'line {number}: invalid JSON ({e})')
+
+
+def read_records(file, format):
+    """Yield ``(line number, record)`` from the text stream ``file``."""
+    if format == 'jsonl':
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                yield number, _parse(number, line)
+    elif format == 'csv':
+        reader = csv.DictReader(file)
+        for record in reader:
+            # Empty cells are missing values; columns of other record types are dropped
+            yield reader.line_num, {key: value for key, value in record.items() if value != ''}
+    elif format == 'geojson':
+        first = file.readline()
+        if first.strip() != GEOJSON_HEADER:
+            # Not laid out by write_records: parse the whole document
+            document = _parse(1, first + file.read())
+            for number, feature in enumerate(document.get('features', []), 1):
+                yield number, _from_feature(feature)
+            return
+        for number, line in enumerate(file, 2):
+            line = line.strip().rstrip(',')
+            if line and line != ']}':
+                yield number, _from_feature(_parse(number, line))
+    else:
+        raise ValueError(f'Unknown format {format!r}')
+
+
+def _clean(model, name, value):
+    field = model._meta.get_field(name)
+    if value is None or value == '':
+        if field.null:
+            return None
+        if field.has_default():
+            return field.get_default()
+    return field.clean(value, None)
+
+
+class Importer:
+    """
+    Upserts records in batches; ``counts`` holds per record type how many
+    were created, updated and unchanged, ``diff`` (if given) receives a line
+    per created or changed row.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, diff=None):
+        self.batch_size = batch_size
+        self.diff = diff
+        self.counts = {record_type: {'created': 0, 'updated': 0, 'unchanged': 0} for record_type in RECORD_TYPES}
+        self._pending = {record_type: {} for record_type in RECORD_TYPES}
+        self._size = 0
+
+    def run(self, records, dry_run=False):
+        """Import ``(line number, record)`` pairs in one transaction, rolled back with ``dry_run``."""
+        with write_transaction():
+            with signals.deferred_invalidation():
+                for number, record in records:
+                    self.add(number, record)
+                self.flush()
+            if dry_run:
+                transaction.set_rollback(True)
+        return self.counts
+
+    def add(self, number, record):
+        if not isinstance(record, dict) or record.get('type') not in RECORD_TYPES:
+            raise GraphImportError(f'line {number}: type must be one of {", ".join(RECORD_TYPES)}')
+        record_type = record['type']
+        values = self._values(number, record_type, record)
+        key = tuple(values[name] for name in KEYS[record_type])
+        # A key repeated within a batch: the later record wins, as across batches
+        self._pending[record_type][key] = (number, values)
+        self._size += 1
+        if self._size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Referenced nodes first
+        for record_type, pending in self._pending.items():
+            if pending:
+                self._upsert(record_type, list(pending.values()))
+                pending.clear()
+        self._size = 0
+
+    def _values(self, number, record_type, record):
+        collection = RECORD_TYPES[record_type]
+        values = {}
+        for name in collection.fields:
+            key = f'{name}_code' if name in collection.node_fields else name
+            try:
+                if name in collection.node_fields:
+                    code = record.get(key) or None
+                    if code is None and name in collection.required:
+                        raise ValidationError('This field is required.')
+                    values[name] = None if code is None else str(code)
+                elif key in record or name in collection.required:
+                    values[name] = _clean(collection.model, name, record.get(key))
+            except ValidationError as e:
+                raise GraphImportError(f'line {number}: {key}: {"; ".join(e.messages)}')
+        return values
+
+    def _node_ids(self, codes):
+        return dict(Nodes.objects.filter(node_code__in=codes).values_list('node_code', 'node_id'))
+
+    def _upsert(self, record_type, items):
+        collection = RECORD_TYPES[record_type]
+        model = collection.model
+        codes = {values[name] for _, values in items for name in collection.node_fields if values[name]}
+        node_ids = self._node_ids(codes)
+        for number, values in items:
+            for name in collection.node_fields:
+                if values[name] is not None and values[name] not in node_ids:
+                    raise GraphImportError(f'line {number}: {name}_code: Node {values[name]} not found')
+
+        existing = self._existing(record_type, items, node_ids)
+        created, updated, changed_fields = [], [], set()
+        for number, values in items:
+            fields = {f'{name}_id' if name in collection.node_fields else name:
+                      node_ids.get(value) if name in collection.node_fields else value
+                      for name, value in values.items()}
+            key = tuple(fields[f'{name}_id' if name in collection.node_fields else name]
+                        for name in KEYS[record_type])
+            row = existing.get(key)
+            if row is None:
+                created.append(model(**fields))
+                self._report('+', record_type, values)
+                continue
+            changes = {name: (getattr(row, name), value) for name, value in fields.items()
+                       if getattr(row, name) != value}
+            if not changes:
+                self.counts[record_type]['unchanged'] += 1
+                continue
+            for name, (old, new) in changes.items():
+                setattr(row, name, new)
+            changed_fields.update(changes)
+            updated.append(row)
+            self._report('~', record_type, values, changes)
+
+        model.objects.bulk_create(created, batch_size=WRITE_BATCH_SIZE)
+        if updated:
+            model.objects.bulk_update(updated, sorted(changed_fields), batch_size=WRITE_BATCH_SIZE)
+        self.counts[record_type]['created'] += len(created)
+        self.counts[record_type]['updated'] += len(updated)
+        if created or updated:
+            signals.tables_changed(collection.table)
+        if model is Nodes:
+            stale = [row.node_id for row in [*created, *updated] if row.qrcode_hash != qrcode_hash(row)]
+            if stale:
+                jobs.enqueue(tasks.NODE_QRCODES, {'node_ids': stale})
+
+    def _existing(self, record_type, items, node_ids):
+        """Stored rows matching the keys of ``items``, by key (with node IDs)."""
+        collection = RECORD_TYPES[record_type]
+        key_columns = [f'{name}_id' if name in collection.node_fields else name for name in KEYS[record_type]]
+        filters = {}
+        for name, column in zip(KEYS[record_type], key_columns):
+            values = {values[name] for _, values in items}
+            filters[f'{column}__in'] = {node_ids[v] for v in values} if name in collection.node_fields else values
+        rows = {}
+        # Descending, so the lowest primary key wins where keys are not unique (edges)
+        for row in collection.model.objects.filter(**filters).order_by('-' + collection.pk):
+            rows[tuple(getattr(row, column) for column in key_columns)] = row
+        return rows
+
+    def _report(self, sign, record_type, values, changes=None):
+        if self.diff is None:
+            return
+        key = ' '.join(str(values[name]) for name in KEYS[record_type])
+        line = f'{sign} {record_type} {key}'
+        if changes:
+            line += ': ' + ', '.join(f'{name} {old!r} -> {new!r}' for name, (old, new) in changes.items())
+        self.diff(line)
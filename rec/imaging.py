@@ -0,0 +1,97 @@
+"""
+Shared helpers for files generated from uploaded images.
+
+Generated files (panorama tiles, image derivatives) are content addressed:
+they live under a directory named after the hash of the source file, and the
+manifest describing them is stored on a JSON field of the owning model.
+"""
+
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean "this upload cannot be processed", not a bug
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def file_digest(field_file, length=20):
+    """Hash of a stored file's content, read in chunks."""
+    digest = hashlib.sha1()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    finally:
+        field_file.close()
+    return digest.hexdigest()[:length]
+
+
+def open_rgb(field_file):
+    """Decode a stored image into an RGB ``Image``; transparent areas become white."""
+    field_file.open('rb')
+    try:
+        with Image.open(field_file) as image:
+            if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+                image = image.convert('RGBA')
+                background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+                return Image.alpha_composite(background, image).convert('RGB')
+            return image.convert('RGB')
+    finally:
+        field_file.close()
+
+
+def save_file(path, content: bytes):
+    """Store ``content`` under exactly ``path``, replacing what is there."""
+    if default_storage.exists(path):
+        # Left over from an interrupted run; keep the name instead of getting a suffixed one
+        default_storage.delete(path)
+    default_storage.save(path, ContentFile(content))
+
+
+def save_image(path, image, format='JPEG', **options):
+    buffer = BytesIO()
+    image.save(buffer, format=format, **options)
+    save_file(path, buffer.getvalue())
+
+
+def manifest_outdated(instance, field, target):
+    """Whether ``instance.<target>`` does not describe the current file ``instance.<field>``."""
+    field_file = getattr(instance, field)
+    manifest = getattr(instance, target)
+    if field_file:
+        return not manifest or manifest.get('source') != field_file.name
+    return manifest is not None
+
+
+def sync_manifest(instance, field, target, generate):
+    """
+    Bring the manifest in ``instance.<target>`` in line with file ``instance.<field>``.
+
+    ``generate(field_file)`` builds the manifest; it must record the source
+    file name under ``'source'``. The field is written with ``update()`` so no
+    signals fire. Returns True when the stored manifest changed. Failures are
+    logged and leave the instance without a manifest.
+    """
+    if not manifest_outdated(instance, field, target):
+        return False
+    field_file = getattr(instance, field)
+    if field_file:
+        try:
+            manifest = generate(field_file)
+        except IMAGE_ERRORS:
+            logger.exception('Could not process %s of %s', field, instance)
+            manifest = None
+    else:
+        manifest = None
+
+    if manifest == getattr(instance, target):
+        return False
+    setattr(instance, target, manifest)
+    type(instance).objects.filter(pk=instance.pk).update(**{target: manifest})
+    return True
@@ -0,0 +1,241 @@
+"""
+A small database-backed job queue.
+
+Slow work triggered by a request (rendering QR codes, cutting image tiles,
+precomputing graph data) is recorded as a ``Job`` row and the request
+returns right away; ``manage.py run_jobs`` workers pick the jobs up.
+
+- Tasks are plain functions registered with ``@task('name')``; a job's
+  ``payload`` is passed to them as keyword arguments, so it must be JSON.
+- Workers claim the queued job with the highest ``priority`` whose
+  ``run_after`` has passed, with a conditional UPDATE so two workers never
+  run the same job.
+- A failing job is retried with exponential backoff until ``max_attempts``;
+  a job whose worker died is requeued after ``REC_JOB_TIMEOUT`` seconds.
+- ``key`` makes enqueueing idempotent: a burst of saves of the same node
+  queues its QR code once. Tasks must therefore also be safe to run twice.
+- Succeeded and failed jobs are deleted ``REC_JOB_RETENTION`` seconds after
+  they finished; ``run_jobs`` workers purge them periodically.
+
+Jobs are inserted in the caller's transaction, so work for a change that is
+rolled back is never queued. With ``REC_JOBS_EAGER = True`` jobs run inline
+when they are enqueued, which is handy for development without a worker.
+"""
+
+import logging
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_LOW = -10
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 10
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Delay before the first retry; doubled for every further attempt
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 60 * 60
+
+# Seconds between purges of finished jobs by a worker
+PURGE_INTERVAL = 60 * 60
+# Rows deleted per statement, so a purge never holds the write lock for long
+PURGE_BATCH_SIZE = 1000
+
+# Name -> function
+TASKS = {}
+
+
+def task(name):
+    """Register a function as the task called ``name``."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def job_timeout():
+    """Seconds after which a running job is considered abandoned by its worker."""
+    return getattr(settings, 'REC_JOB_TIMEOUT', 15 * 60)
+
+
+def job_retention():
+    """Seconds finished jobs are kept for; None keeps them forever."""
+    return getattr(settings, 'REC_JOB_RETENTION', 7 * 24 * 60 * 60)
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def enqueue(name, payload=None, key=None, priority=PRIORITY_NORMAL, delay=0,
+            max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Queue task ``name`` and return its ``Job``.
+
+    When a job with the same ``key`` is already queued that job is returned
+    instead, raised to ``priority`` if it was lower.
+    """
+    if name not in TASKS:
+        raise ValueError(f'Unknown task {name}')
+    job = None
+    if key is not None:
+        job = Job.objects.filter(key=key, status=Job.STATUS_QUEUED).first()
+    if job is None:
+        try:
+            # Savepoint, so a concurrent insert of the same key does not break the caller's transaction
+            with transaction.atomic():
+                job = Job.objects.create(
+                    name=name, key=key, payload=payload or {}, priority=priority,
+                    max_attempts=max_attempts, run_after=timezone.now() + timedelta(seconds=delay)
+                )
+        except IntegrityError:
+            job = Job.objects.get(key=key, status=Job.STATUS_QUEUED)
+    if job.priority < priority:
+        Job.objects.filter(pk=job.pk).update(priority=priority)
+        job.priority = priority
+
+    if getattr(settings, 'REC_JOBS_EAGER', False):
+        job = claim(worker='eager', job_id=job.pk) or job
+        if job.status == Job.STATUS_RUNNING:
+            run(job)
+    return job
+
+
+def claim(worker=None, job_id=None):
+    """
+    Mark the next runnable job as running and return it, or None.
+
+    ``job_id`` claims that particular job if it is runnable.
+    """
+    now = timezone.now()
+    candidates = Job.objects.filter(status=Job.STATUS_QUEUED)
+    if job_id is not None:
+        candidates = candidates.filter(pk=job_id)
+    else:
+        candidates = candidates.filter(run_after__lte=now).order_by('-priority', 'run_after', 'pk')
+    for pk in candidates.values_list('pk', flat=True)[:10]:
+        # Only one worker's UPDATE matches while the job is still queued
+        claimed = Job.objects.filter(pk=pk, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING, locked_by=worker or worker_name(), started_at=now,
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    """Run a claimed job and record its outcome; returns True on success."""
+    func = TASKS.get(job.name)
+    try:
+        if func is None:
+            raise LookupError(f'Unknown task {job.name}')
+        result = func(**job.payload)
+    except Exception:
+        logger.exception('Job %s failed (attempt %s of %s)', job, job.attempts, job.max_attempts)
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts and func is not None:
+            _retry_later(job)
+        else:
+            _finish(job, Job.STATUS_FAILED)
+        return False
+
+    job.result = result
+    job.last_error = ''
+    _finish(job, Job.STATUS_SUCCEEDED)
+    return True
+
+
+def _finish(job, status):
+    job.status = status
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'result', 'last_error'])
+
+
+def _retry_later(job):
+    job.status = Job.STATUS_QUEUED
+    job.run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+    job.locked_by = ''
+    try:
+        with transaction.atomic():
+            job.save(update_fields=['status', 'run_after', 'locked_by', 'last_error'])
+    except IntegrityError:
+        # The same work was queued again meanwhile; that job takes over
+        _finish(job, Job.STATUS_FAILED)
+
+
+def requeue_stale():
+    """Put jobs back whose worker stopped without finishing them; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=job_timeout())
+    count = 0
+    for job in Job.objects.filter(status=Job.STATUS_RUNNING, started_at__lt=cutoff):
+        job.last_error = f'Abandoned by worker {job.locked_by}'
+        if job.attempts < job.max_attempts:
+            _retry_later(job)
+        else:
+            _finish(job, Job.STATUS_FAILED)
+        count += 1
+    return count
+
+
+def purge_finished(retention=None):
+    """
+    Delete succeeded and failed jobs that finished more than ``retention``
+    seconds ago (default ``REC_JOB_RETENTION``); returns how many.
+    """
+    retention = job_retention() if retention is None else retention
+    if retention is None:
+        return 0
+    finished = Job.objects.filter(status__in=(Job.STATUS_SUCCEEDED, Job.STATUS_FAILED),
+                                  finished_at__lt=timezone.now() - timedelta(seconds=retention))
+    count = 0
+    while True:
+        batch = list(finished.values_list('pk', flat=True)[:PURGE_BATCH_SIZE])
+        if not batch:
+            return count
+        count += Job.objects.filter(pk__in=batch).delete()[0]
+
+
+def run_pending(worker=None, limit=None):
+    """Run runnable jobs until none is left (or ``limit`` ran); returns how many ran."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim(worker)
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
+
+
+def retry(job):
+    """Queue a failed job again with a fresh set of attempts; False if it cannot be."""
+    if job.status != Job.STATUS_FAILED:
+        return False
+    job.status = Job.STATUS_QUEUED
+    job.attempts = 0
+    job.run_after = timezone.now()
+    job.locked_by = ''
+    try:
+        with transaction.atomic():
+            job.save(update_fields=['status', 'attempts', 'run_after', 'locked_by'])
+    except IntegrityError:
+        # Another job with the same key is already queued
+        job.status = Job.STATUS_FAILED
+        return False
+    return True
@@ -0,0 +1,93 @@
+"""
+Cached lookups shared by the pages and API views.
+
+The dashboard, lists and map pages repeatedly ask for the active campus map,
+the building and floor lists and row counts. Each helper here caches its
+result in the shared cache under a key containing the version tokens of the
+tables it reads; the model signals bump those tokens on every save or
+delete (see rec/signals.py), which invalidates the affected lookups in
+every process at once.
+
+Hits and misses are counted per lookup and process; ``stats()`` reports them.
+"""
+
+import functools
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Nodes, Edges, Annotation, CampusMap
+from .versioning import combined_version, NODES, EDGES, ANNOTATIONS, CAMPUS_MAP
+
+_MISSING = object()
+
+_stats_lock = threading.Lock()
+_hits = Counter()
+_misses = Counter()
+
+
+def cached_lookup(*tables):
+    """Cache a function's result per arguments and version of ``tables``."""
+    def decorator(function):
+        name = function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            key = ':'.join(['rec:lookup', name, combined_version(*tables), *map(str, args)])
+            value = cache.get(key, _MISSING)
+            with _stats_lock:
+                (_misses if value is _MISSING else _hits)[name] += 1
+            if value is _MISSING:
+                value = function(*args)
+                cache.set(key, value, getattr(settings, 'REC_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24))
+            return value
+        return wrapper
+    return decorator
+
+
+def stats() -> Dict[str, Dict]:
+    """Hits, misses and hit rate of each lookup in this process."""
+    with _stats_lock:
+        names = sorted(set(_hits) | set(_misses))
+        return {name: {'hits': _hits[name], 'misses': _misses[name],
+                       'hit_rate': round(_hits[name] / (_hits[name] + _misses[name]), 3)}
+                for name in names}
+
+
+def reset_stats():
+    with _stats_lock:
+        _hits.clear()
+        _misses.clear()
+
+
+@cached_lookup(CAMPUS_MAP)
+def active_campus_map(building: str = '', floor_level: Optional[int] = None) -> Optional[CampusMap]:
+    """``CampusMap.active_for``, cached."""
+    return CampusMap.active_for(building, floor_level)
+
+
+@cached_lookup(NODES)
+def buildings() -> List[str]:
+    """Distinct building names, sorted."""
+    return list(Nodes.objects.values_list('building', flat=True).distinct().order_by('building'))
+
+
+@cached_lookup(NODES)
+def floors() -> List[int]:
+    """Distinct floor levels, sorted."""
+    return list(Nodes.objects.values_list('floor_level', flat=True).distinct().order_by('floor_level'))
+
+
+@cached_lookup(NODES, EDGES, ANNOTATIONS)
+def counts() -> Dict[str, int]:
+    """Row counts shown on the dashboard and map pages."""
+    nodes = Nodes.objects.aggregate(
+        nodes=Count('node_id'),
+        positioned_nodes=Count('node_id', filter=Q(map_x__isnull=False, map_y__isnull=False)),
+    )
+    edges = Edges.objects.aggregate(edges=Count('edge_id'), active_edges=Count('edge_id', filter=Q(is_active=True)))
+    return {**nodes, **edges, 'annotations': Annotation.objects.count()}
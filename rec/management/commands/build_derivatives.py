@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from rec.derivatives import ensure_derivatives
+from rec.models import Nodes, CampusMap
+from rec.versioning import bump_version, NODES, CAMPUS_MAP
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated thumbnails, medium versions and placeholders of uploaded images'
+
+    def handle(self, *args, **options):
+        sources = (
+            (Nodes.objects.exclude(image360='').exclude(image360__isnull=True),
+             'image360', 'image360_derivatives', NODES),
+            (CampusMap.objects.all(), 'blueprint_image', 'blueprint_derivatives', CAMPUS_MAP),
+        )
+        total = 0
+        for queryset, field, target, table in sources:
+            updated = 0
+            for instance in queryset.iterator(chunk_size=100):
+                if ensure_derivatives(instance, field, target):
+                    updated += 1
+                    status = 'done' if getattr(instance, target) else 'FAILED'
+                    self.stdout.write(f'{instance}: {status}')
+            if updated:
+                bump_version(table)
+            total += updated
+
+        self.stdout.write(self.style.SUCCESS(f'{total} image(s) updated'))
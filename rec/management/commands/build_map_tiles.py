@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from rec.blueprint_tiles import ensure_blueprint_tiles
+from rec.models import CampusMap
+from rec.versioning import bump_version, CAMPUS_MAP
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated deep-zoom tile pyramids for campus map blueprints'
+
+    def handle(self, *args, **options):
+        updated = 0
+        for campus_map in CampusMap.objects.iterator(chunk_size=100):
+            if ensure_blueprint_tiles(campus_map):
+                updated += 1
+                status = 'tiled' if campus_map.blueprint_tiles else 'FAILED'
+                self.stdout.write(f'{campus_map}: {status}')
+
+        if updated:
+            bump_version(CAMPUS_MAP)
+        self.stdout.write(self.style.SUCCESS(f'{updated} map(s) updated'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from rec.models import Nodes
+from rec.panorama_tiles import ensure_panorama_tiles
+from rec.versioning import bump_version, NODES
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated cube tile pyramids for node 360° images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('node_codes', nargs='*', help='Only these nodes (default: all)')
+
+    def handle(self, *args, **options):
+        nodes = Nodes.objects.exclude(image360='').exclude(image360__isnull=True)
+        if options['node_codes']:
+            nodes = nodes.filter(node_code__in=options['node_codes'])
+
+        updated = 0
+        for node in nodes.iterator(chunk_size=100):
+            if ensure_panorama_tiles(node):
+                updated += 1
+                status = 'tiled' if node.image360_tiles else 'FAILED'
+                self.stdout.write(f'{node.node_code}: {status}')
+
+        if updated:
+            bump_version(NODES)
+        self.stdout.write(self.style.SUCCESS(f'{updated} node(s) updated'))
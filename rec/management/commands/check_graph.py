@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rec.graph_health import MODES, analyze, closure_impact
+
+
+class Command(BaseCommand):
+    help = ('Report disconnected parts, bridges, articulation points, duplicate edges and nodes '
+            'unreachable from entrances, or the impact of closing one edge')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edge', type=int, help='Show which nodes closing this edge would cut off')
+        parser.add_argument('--avoid-stairs', action='store_true', help='With --edge, without stairs')
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+
+    def handle(self, *args, **options):
+        if options['edge'] is not None:
+            impact = closure_impact(options['edge'], options['avoid_stairs'])
+            if impact is None:
+                raise CommandError(f"Edge {options['edge']} not found")
+            if options['json']:
+                self.stdout.write(json.dumps(impact, indent=2))
+            elif impact['unreachable']:
+                self.stdout.write(self.style.WARNING(
+                    f"Closing edge {impact['edge_id']} cuts off {len(impact['unreachable'])} node(s): "
+                    + ', '.join(impact['unreachable'])))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Closing edge {impact['edge_id']} cuts off no node"))
+            return
+
+        report = analyze()
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f"{report['nodes']} node(s), {report['active_edges']} active edge(s), "
+                          f"{len(report['entrances'])} entrance(s)")
+        for mode in MODES:
+            result = report['modes'][mode]
+            self.stdout.write(f"\n{mode.replace('_', ' ').capitalize()}:")
+            self.stdout.write(f"  {result['components']} component(s), sizes {result['component_sizes'][:10]}")
+            for label, key in (('Outside the largest component', 'outside_largest_component'),
+                               ('Articulation points', 'articulation_points'),
+                               ('Unreachable from entrances', 'unreachable_from_entrances')):
+                if result[key]:
+                    self.stdout.write(f"  {label} ({len(result[key])}): {', '.join(result[key])}")
+            for bridge in result['bridges']:
+                self.stdout.write(f"  Bridge: edge {bridge['edge_id']} "
+                                  f"{bridge['from_node_code']} - {bridge['to_node_code']}")
+        if report['self_edges']:
+            self.stdout.write(f"\nSelf edges: {report['self_edges']}")
+        for duplicate in report['duplicate_edges']:
+            self.stdout.write(f"Duplicate edges {duplicate['edge_ids']}"
+                              + (' (asymmetric)' if duplicate['asymmetric'] else ''))
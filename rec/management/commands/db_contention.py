@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from rec.contention import PROFILES, READERS, SECONDS, WRITERS, measure
+
+
+class Command(BaseCommand):
+    help = ('Measure lock contention between graph reads and short write transactions on a copy of the '
+            'database, with SQLite defaults and with the configured settings')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=SECONDS, help='Duration of each run')
+        parser.add_argument('--readers', type=int, default=READERS, help='Reader threads')
+        parser.add_argument('--writers', type=int, default=WRITERS, help='Writer threads')
+        parser.add_argument('--profile', choices=PROFILES, action='append',
+                            help='Run only this profile (repeatable)')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        results = [measure(profile, options['seconds'], options['readers'], options['writers'])
+                   for profile in options['profile'] or PROFILES]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{options['readers']} reader(s), {options['writers']} writer(s), "
+                          f"{options['seconds']:g} s per profile\n")
+        for result in results:
+            self.stdout.write(f"{result['profile']}:")
+            for kind in ('reads', 'writes'):
+                locked = result[f'{kind}_locked']
+                line = (f"  {kind:<6} {result[f'{kind}_per_second']:>10}/s  p95 {result[f'{kind}_p95_ms']} ms  "
+                        f"max {result[f'{kind}_max_ms']} ms  locked {locked}")
+                self.stdout.write(self.style.WARNING(line) if locked else line)
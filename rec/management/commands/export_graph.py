@@ -0,0 +1,33 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from rec.graph_io import FORMATS, RECORD_TYPES, export_records, format_for, write_records
+
+
+class Command(BaseCommand):
+    help = 'Export nodes, edges and annotations as JSON Lines, CSV or GeoJSON, keyed by node code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='File to write (default: standard output)')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Output format (default: from the file extension, else jsonl)')
+        parser.add_argument('--type', dest='types', action='append', choices=list(RECORD_TYPES),
+                            help='Only records of this type (repeatable)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or format_for(path)
+        records = export_records(options['types'] or tuple(RECORD_TYPES))
+        started = time.monotonic()
+        if path == '-':
+            count = write_records(records, sys.stdout, format)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as out:
+                count = write_records(records, out, format)
+        self.stderr.write(self.style.SUCCESS(
+            f'{count} record(s) exported as {format} in {time.monotonic() - started:.1f}s'
+        ))
+
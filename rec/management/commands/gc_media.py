@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from rec.media_gc import collect_garbage
+from rec.uploads import expire_stale
+
+
+class Command(BaseCommand):
+    help = ('Delete uploaded files no node or campus map references, generated '
+            'tile/derivative sets no manifest points to and expired chunked uploads')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list what would be deleted')
+        parser.add_argument('--grace', type=int, default=None,
+                            help='Keep files modified within this many seconds '
+                                 '(default: REC_MEDIA_GC_GRACE, one hour)')
+
+    def handle(self, *args, **options):
+        grace = None if options['grace'] is None else max(options['grace'], 0)
+        uploads = expire_stale(dry_run=options['dry_run'])
+        report = collect_garbage(dry_run=options['dry_run'], grace=grace)
+
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        for filename in uploads['files']:
+            self.stdout.write(f'{verb} staged upload {filename}')
+        if uploads['sessions']:
+            self.stdout.write(f"{verb} {uploads['sessions']} expired upload session(s)")
+        for name in report['files']:
+            self.stdout.write(f'{verb} {name}')
+        for base in report['directories']:
+            self.stdout.write(f'{verb} {base}/')
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {len(report['files'])} file(s) and {len(report['directories'])} generated set(s), "
+            f"{report['bytes'] / 1024 / 1024:.1f} MB"
+        ))
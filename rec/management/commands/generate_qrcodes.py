@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rec.models import Nodes
+from rec.qrcodes import FORMATS, default_format, generate_qrcodes
+
+# Nodes loaded and rendered at a time
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated node QR codes, optionally for a subset of nodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--building', help='Only nodes of this building')
+        parser.add_argument('--floor', type=int, help='Only nodes on this floor')
+        parser.add_argument('--type', dest='type_of_node', help='Only nodes of this type')
+        parser.add_argument('--code', dest='codes', action='append', default=[],
+                            help='Only this node code (repeatable)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-render every selected node, even when its QR code is current')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Image format (default: REC_QRCODE_FORMAT, png)')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Size of the rendering process pool (default: one per CPU, 1 disables it)')
+
+    def handle(self, *args, **options):
+        if options['processes'] is not None and options['processes'] < 1:
+            raise CommandError('--processes must be at least 1')
+        queryset = Nodes.objects.order_by('node_id')
+        if options['building']:
+            queryset = queryset.filter(building=options['building'])
+        if options['floor'] is not None:
+            queryset = queryset.filter(floor_level=options['floor'])
+        if options['type_of_node']:
+            queryset = queryset.filter(type_of_node=options['type_of_node'])
+        if options['codes']:
+            queryset = queryset.filter(node_code__in=options['codes'])
+
+        format = options['format'] or default_format()
+        started = time.monotonic()
+        generated = skipped = 0
+        last_id = 0
+        while True:
+            nodes = list(queryset.filter(node_id__gt=last_id)[:BATCH_SIZE])
+            if not nodes:
+                break
+            last_id = nodes[-1].node_id
+            counts = generate_qrcodes(nodes, format=format, force=options['force'],
+                                      processes=options['processes'])
+            generated += counts[0]
+            skipped += counts[1]
+            self.stdout.write(f'{generated + skipped} node(s) checked')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{generated} QR code(s) generated as {format}, {skipped} up to date '
+            f'in {time.monotonic() - started:.1f}s'
+        ))
@@ -0,0 +1,46 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rec.graph_io import BATCH_SIZE, FORMATS, GraphImportError, Importer, format_for, read_records
+
+
+class Command(BaseCommand):
+    help = ('Import nodes, edges and annotations from JSON Lines, CSV or GeoJSON, updating '
+            'existing rows by node code; all or nothing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read (- for standard input)')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Input format (default: from the file extension, else jsonl)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='List what would be created or changed, without saving')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help=f'Records written per batch (default: {BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        path = options['path']
+        format = options['format'] or format_for(path)
+        # The diff lists every change, so only when asked for
+        show_diff = options['dry_run'] or options['verbosity'] > 1
+        importer = Importer(options['batch_size'], diff=self.stdout.write if show_diff else None)
+        started = time.monotonic()
+        try:
+            if path == '-':
+                counts = importer.run(read_records(sys.stdin, format), dry_run=options['dry_run'])
+            else:
+                with open(path, encoding='utf-8', newline='') as file:
+                    counts = importer.run(read_records(file, format), dry_run=options['dry_run'])
+        except GraphImportError as e:
+            raise CommandError(f'Nothing imported: {e}')
+        except OSError as e:
+            raise CommandError(str(e))
+
+        summary = ', '.join(
+            f"{record_type}s: {c['created']} created, {c['updated']} updated, {c['unchanged']} unchanged"
+            for record_type, c in counts.items())
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(f'{verb} ({time.monotonic() - started:.1f}s) {summary}'))
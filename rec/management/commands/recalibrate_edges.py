@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rec.calibration import (ANGLE_TOLERANCE, DISTANCE_TOLERANCE, measure_edges, numpy,
+                             recalibrate)
+from rec.models import Edges
+from rec.pathfinding import reset_pathfinder
+
+
+class Command(BaseCommand):
+    help = ('Compare edge distances and compass angles with the node positions on the calibrated '
+            'blueprints, report outliers and optionally store the computed values')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--building', help='Only edges starting in this building')
+        parser.add_argument('--distance-tolerance', type=float, default=DISTANCE_TOLERANCE,
+                            help=f'Allowed relative distance error (default: {DISTANCE_TOLERANCE})')
+        parser.add_argument('--angle-tolerance', type=float, default=ANGLE_TOLERANCE,
+                            help=f'Allowed compass angle error in degrees (default: {ANGLE_TOLERANCE:g})')
+        parser.add_argument('--write', action='store_true',
+                            help='Store the computed distance and angle of the outliers')
+        parser.add_argument('--all', action='store_true',
+                            help='With --write, store the computed values of every measured edge')
+
+    def handle(self, *args, **options):
+        if options['distance_tolerance'] < 0 or options['angle_tolerance'] < 0:
+            raise CommandError('Tolerances must not be negative')
+        edges = Edges.objects.all()
+        if options['building']:
+            edges = edges.filter(from_node__building=options['building'])
+        measured, skipped = measure_edges(edges, options['distance_tolerance'], options['angle_tolerance'])
+
+        outliers = [item for item in measured if item['outlier']]
+        for item in outliers:
+            self.stdout.write(
+                f"Edge {item['edge_id']} {item['from_node_code']} -> {item['to_node_code']}: "
+                f"distance {item['stored_distance']:g} m, measured {item['distance']:g} m; "
+                f"angle {item['stored_compass_angle']:g}°, measured {item['compass_angle']:g}°"
+            )
+        self.stdout.write(
+            f"{len(measured)} edge(s) measured ({'NumPy' if numpy is not None else 'pure Python'}), "
+            f"{len(outliers)} outlier(s), {skipped} skipped (other floor, no position or uncalibrated map)"
+        )
+
+        if options['write']:
+            updated = recalibrate(measured, only_outliers=not options['all'])
+            reset_pathfinder()
+            self.stdout.write(self.style.SUCCESS(f'{updated} edge(s) updated'))
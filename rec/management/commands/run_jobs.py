@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from rec import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (QR codes, image processing, graph precomputation)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is runnable instead of waiting for more')
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help='Exit after running this many jobs')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait between polls of an empty queue')
+        parser.add_argument('--worker', default=None,
+                            help='Worker name recorded on claimed jobs (default: host:pid)')
+
+    def handle(self, *args, **options):
+        worker = options['worker'] or jobs.worker_name()
+        max_jobs = options['max_jobs']
+        ran = failed = 0
+        last_purge = None
+        self.stdout.write(f'Worker {worker} started')
+        try:
+            while max_jobs is None or ran < max_jobs:
+                if last_purge is None or time.monotonic() - last_purge >= jobs.PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    purged = jobs.purge_finished()
+                    if purged:
+                        self.stdout.write(f'Purged {purged} finished job(s)')
+                requeued = jobs.requeue_stale()
+                if requeued:
+                    self.stdout.write(self.style.WARNING(f'Requeued {requeued} abandoned job(s)'))
+                job = jobs.claim(worker)
+                if job is None:
+                    if options['burst']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                started = time.monotonic()
+                ok = jobs.run(job)
+                ran += 1
+                failed += not ok
+                status = 'done' if ok else ('FAILED' if job.status == job.STATUS_FAILED else 'retrying')
+                self.stdout.write(f'{job.name} #{job.pk}: {status} in {time.monotonic() - started:.2f}s')
+        except KeyboardInterrupt:
+            self.stdout.write('Interrupted')
+
+        self.stdout.write(self.style.SUCCESS(f'{ran} job(s) run, {failed} failed'))
@@ -0,0 +1,190 @@
+"""
+Serving of files under MEDIA_ROOT.
+
+Replaces ``django.conf.urls.static``, which only works with DEBUG on and
+sends every file in full without cache headers. ``serve_media``:
+
+- answers ``If-None-Match`` / ``If-Modified-Since`` with 304,
+- serves single byte ranges (``Range``, honouring ``If-Range``), so a phone
+  can resume a large panorama instead of starting over,
+- marks content-addressed files (uploads named by their hash, generated
+  tile and derivative sets under their source digest) as immutable for a
+  year; other files must be revalidated,
+- hands the transfer to the front-end server when ``REC_MEDIA_SENDFILE`` is
+  ``'x-sendfile'`` (Apache mod_xsendfile, lighttpd) or ``'x-accel-redirect'``
+  (nginx, with an internal location at ``REC_MEDIA_ACCEL_PREFIX``), which
+  then also handles ranges,
+- otherwise streams with ``FileResponse`` in ``BLOCK_SIZE`` pieces, so memory
+  stays bounded whatever the file size.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+from .blueprint_tiles import TILES_ROOT as MAP_TILES_ROOT
+from .derivatives import DERIVATIVES_ROOT
+from .panorama_tiles import TILES_ROOT as PANORAMA_TILES_ROOT
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+BLOCK_SIZE = 64 * 1024
+
+# Uploads stored by ContentAddressedStorage and generated sets named after their source
+_hashed_re = re.compile(
+    r'(^|/)[0-9a-f]{64}\.\w+$'
+    rf'|^({re.escape(PANORAMA_TILES_ROOT)}|{re.escape(DERIVATIVES_ROOT)}|{re.escape(MAP_TILES_ROOT)})/[0-9a-f]{{20}}/'
+)
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_immutable(path):
+    return bool(_hashed_re.search(path))
+
+
+def etag_for(path, stat):
+    if is_immutable(path):
+        # The name already identifies the content
+        return '"%s"' % hashlib.sha1(path.encode()).hexdigest()
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison, as If-None-Match requires
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive of a single-range ``Range`` header, None to send
+    the whole file, or False when the range cannot be satisfied.
+    """
+    match = _range_re.match(header.replace(' ', ''))
+    if not match or not size:
+        # Multiple or malformed ranges: a full response is always allowed
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return False
+    if start > end:
+        return None
+    return start, end
+
+
+class FileRange:
+    """File-like view of ``length`` bytes of ``file`` from ``start``, for ``FileResponse``."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _sendfile_response(path, full_path, content_type):
+    mode = getattr(settings, 'REC_MEDIA_SENDFILE', None)
+    if not mode:
+        return None
+    # The front-end server fills in the body, its length and ranges
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'REC_MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path)
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = full_path
+    else:
+        raise ValueError(f'Unknown REC_MEDIA_SENDFILE mode {mode!r}')
+    return response
+
+
+@require_http_methods(["GET", "HEAD"])
+def serve_media(request, path):
+    """Serve the media file at ``path`` (relative to MEDIA_ROOT)."""
+    path = path.replace('\\', '/')
+    if any(part.startswith('.') for part in path.split('/')):
+        # Dotfiles, including files still being written
+        raise Http404('Not found')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    etag = etag_for(path, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable(path) else REVALIDATE_CACHE_CONTROL,
+    }
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if _etag_matches(if_none_match, etag) or (
+            not if_none_match and if_modified_since and int(stat.st_mtime) <= if_modified_since):
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    response = _sendfile_response(path, full_path, content_type)
+    if response is None:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if 'HTTP_RANGE' in request.META and (not if_range or if_range == etag):
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+        file = open(full_path, 'rb')
+        if byte_range:
+            start, end = byte_range
+            response = FileResponse(FileRange(file, start, end - start + 1), status=206,
+                                    content_type=content_type)
+            response.block_size = BLOCK_SIZE
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(file, content_type=content_type)
+            response.block_size = BLOCK_SIZE
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Accept-Ranges'] = 'bytes'
+    for name, value in headers.items():
+        response[name] = value
+    return response
@@ -0,0 +1,187 @@
+"""
+Reference counting and garbage collection of stored media.
+
+Uploaded files are content addressed (see rec/storage.py), so one file can
+back several rows. A file's reference count is the number of rows whose
+``FILE_FIELDS`` column holds its name; it is read from those columns rather
+than kept in a counter, so ``update()`` and ``bulk_update()`` cannot make it
+drift.
+
+- ``release(names)`` deletes the given files if nothing references them any
+  more; model signals call it after a file is replaced or its row deleted.
+- ``collect_garbage()`` (``manage.py gc_media``) sweeps the upload
+  directories for unreferenced files and the generated tile/derivative
+  directories for sets no manifest points to.
+
+Files modified within ``REC_MEDIA_GC_GRACE`` seconds are never deleted: they
+may belong to an upload whose row is not committed yet.
+"""
+
+import logging
+import os
+import posixpath
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .blueprint_tiles import TILES_ROOT as MAP_TILES_ROOT
+from .derivatives import DERIVATIVES_ROOT
+from .models import Nodes, CampusMap
+from .panorama_tiles import TILES_ROOT as PANORAMA_TILES_ROOT
+
+logger = logging.getLogger(__name__)
+
+# (model, file field) pairs that reference uploaded files
+FILE_FIELDS = (
+    (Nodes, 'image360'),
+    (Nodes, 'qrcode'),
+    (CampusMap, 'blueprint_image'),
+)
+
+# (model, manifest field) pairs whose manifest ``base`` references a generated directory
+MANIFEST_FIELDS = (
+    (Nodes, 'image360_tiles'),
+    (Nodes, 'image360_derivatives'),
+    (CampusMap, 'blueprint_tiles'),
+    (CampusMap, 'blueprint_derivatives'),
+)
+
+GENERATED_ROOTS = (PANORAMA_TILES_ROOT, DERIVATIVES_ROOT, MAP_TILES_ROOT)
+
+# Names looked up per query
+LOOKUP_BATCH_SIZE = 500
+
+
+def grace_period():
+    return getattr(settings, 'REC_MEDIA_GC_GRACE', 60 * 60)
+
+
+def _storage(model, name):
+    return model._meta.get_field(name).storage
+
+
+def reference_counts(names):
+    """Number of rows referencing each of ``names``."""
+    names = list(set(names))
+    counts = Counter({name: 0 for name in names})
+    for start in range(0, len(names), LOOKUP_BATCH_SIZE):
+        batch = names[start:start + LOOKUP_BATCH_SIZE]
+        for model, name in FILE_FIELDS:
+            counts.update(model.objects.filter(**{f'{name}__in': batch}).values_list(name, flat=True))
+    return counts
+
+
+def _is_recent(storage, name, grace=None):
+    try:
+        modified = os.path.getmtime(storage.path(name))
+    except OSError:
+        return False
+    return time.time() - modified < (grace_period() if grace is None else grace)
+
+
+def release(names, storage=None):
+    """Delete those of ``names`` that no row references any more; returns the deleted names."""
+    names = [name for name in names if name]
+    if not names:
+        return []
+    storage = storage or _storage(*FILE_FIELDS[0])
+    deleted = []
+    for name, count in reference_counts(names).items():
+        if count or _is_recent(storage, name) or not storage.exists(name):
+            continue
+        storage.delete(name)
+        deleted.append(name)
+    return deleted
+
+
+def file_names(instance):
+    """Names of the uploaded files ``instance`` references."""
+    return {getattr(instance, name).name for model, name in FILE_FIELDS
+            if isinstance(instance, model) and getattr(instance, name)}
+
+
+def _walk(storage, directory):
+    """Every file below ``directory`` as (name, size, mtime)."""
+    try:
+        subdirectories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in files:
+        name = posixpath.join(directory, filename)
+        stat = os.stat(storage.path(name))
+        yield name, stat.st_size, stat.st_mtime
+    for subdirectory in subdirectories:
+        yield from _walk(storage, posixpath.join(directory, subdirectory))
+
+
+def _remove_empty_directories(storage, directory):
+    for root, dirs, files in os.walk(storage.path(directory), topdown=False):
+        if not os.listdir(root):
+            os.rmdir(root)
+
+
+def collect_garbage(dry_run=False, grace=None):
+    """
+    Delete unreferenced uploads and generated sets not modified within
+    ``grace`` seconds (default ``REC_MEDIA_GC_GRACE``).
+
+    Returns ``{'files': [...], 'directories': [...], 'bytes': n}`` describing
+    what was (or with ``dry_run`` would be) deleted.
+    """
+    report = {'files': [], 'directories': [], 'bytes': 0}
+    now = time.time()
+    grace = grace_period() if grace is None else grace
+
+    # Uploaded files, per distinct (storage, upload directory)
+    directories = {}
+    for model, name in FILE_FIELDS:
+        model_field = model._meta.get_field(name)
+        directories[(id(model_field.storage), model_field.upload_to.rstrip('/'))] = model_field.storage
+    for (_, directory), storage in directories.items():
+        candidates = {}
+        for name, size, modified in _walk(storage, directory):
+            # Unreferenced too: temporary files left behind by an interrupted write
+            if now - modified >= grace:
+                candidates[name] = size
+        referenced = reference_counts(candidates)
+        for name, size in candidates.items():
+            # Checked again: an upload of the same bytes refreshes the file's mtime
+            if referenced[name] or _is_recent(storage, name, grace):
+                continue
+            report['files'].append(name)
+            report['bytes'] += size
+            if not dry_run:
+                storage.delete(name)
+
+    # Generated directories: <root>/<digest>/..., referenced by a manifest's base
+    bases = set()
+    for model, name in MANIFEST_FIELDS:
+        for manifest in model.objects.exclude(**{f'{name}__isnull': True}).values_list(name, flat=True):
+            if manifest and manifest.get('base'):
+                bases.add(manifest['base'])
+    for root in GENERATED_ROOTS:
+        try:
+            digests = default_storage.listdir(root)[0]
+        except FileNotFoundError:
+            continue
+        for digest in digests:
+            base = f'{root}/{digest}'
+            if base in bases:
+                continue
+            files = list(_walk(default_storage, base))
+            # A set still being generated is recent; its manifest is written last
+            if any(now - modified < grace for _, _, modified in files):
+                continue
+            report['directories'].append(base)
+            report['bytes'] += sum(size for _, size, _ in files)
+            if not dry_run:
+                for name, _, _ in files:
+                    default_storage.delete(name)
+                _remove_empty_directories(default_storage, base)
+
+    if not dry_run and (report['files'] or report['directories']):
+        logger.info('Deleted %s file(s) and %s generated set(s), %s bytes',
+                    len(report['files']), len(report['directories']), report['bytes'])
+    return report
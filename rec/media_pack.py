@@ -0,0 +1,136 @@
+"""
+Offline media packs for walking tours.
+
+A pack holds the panorama and QR code images of the nodes along a route, as
+one zip streamed while it is written: entries are read from storage and
+handed to the client piece by piece, so memory use does not grow with the
+pack size. Images are already compressed, so they are stored rather than
+deflated, which also keeps the CPU cost down to a CRC.
+
+The first entry, ``manifest.json``, lists every file with its name and size.
+Stored names are content addressed (see rec/storage.py and
+rec/derivatives.py), so a client that already has a name from an earlier
+pack has the same bytes and can pass it back in ``skip``.
+"""
+
+import json
+import zipfile
+
+from django.core.files.storage import default_storage
+
+from .derivatives import FORMATS, SIZES
+
+# Target resolutions: a derivative size or the uploaded original
+PACK_SIZES = (*SIZES, 'original')
+PACK_FORMATS = tuple(FORMATS)
+
+# Entries compressed in the zip; everything else is stored as is
+DEFLATED_EXTENSIONS = ('.svg', '.json')
+
+READ_SIZE = 64 * 1024
+
+# Fixed entry timestamp, so the same files always give the same zip
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def _panorama_file(node, size, format):
+    """(storage, name) of a node's panorama at ``size``, or None."""
+    if not node.image360:
+        return None
+    derivatives = node.image360_derivatives
+    if size != 'original' and derivatives and size in derivatives['sizes']:
+        return default_storage, derivatives['sizes'][size][format]
+    # Without derivatives (not generated yet) the original is all there is
+    return node.image360.storage, node.image360.name
+
+
+def pack_files(nodes, size='medium', format='jpg', skip=()):
+    """
+    Files of a pack for ``nodes`` (in route order).
+
+    Returns ``(files, skipped, missing)``: ``files`` are dicts with
+    ``node_id``, ``node_code``, ``kind``, ``name``, ``bytes``, ``url`` and
+    the ``storage`` to read from. A file shared by several nodes is listed once.
+    """
+    skip = set(skip)
+    files, skipped, missing, seen = [], [], [], set()
+    for node in nodes:
+        candidates = [('panorama', _panorama_file(node, size, format))]
+        if node.qrcode:
+            candidates.append(('qrcode', (node.qrcode.storage, node.qrcode.name)))
+        for kind, located in candidates:
+            if located is None or located[1] in seen:
+                continue
+            storage, name = located
+            seen.add(name)
+            if name in skip:
+                skipped.append(name)
+                continue
+            try:
+                file_size = storage.size(name)
+            except OSError:
+                missing.append(name)
+                continue
+            files.append({'node_id': node.node_id, 'node_code': node.node_code, 'kind': kind,
+                          'name': name, 'bytes': file_size, 'url': storage.url(name),
+                          'storage': storage})
+    return files, skipped, missing
+
+
+def pack_manifest(files, skipped, missing, **extra):
+    """JSON-ready description of a pack; ``extra`` keys (route, size...) are included as is."""
+    return {
+        **extra,
+        'files': [{key: value for key, value in file.items() if key != 'storage'} for file in files],
+        'skipped': skipped,
+        'missing': missing,
+        'total_bytes': sum(file['bytes'] for file in files),
+    }
+
+
+class _Sink:
+    """Write-only stream collecting what ``ZipFile`` writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        # No seek(): ZipFile then writes sizes after each entry instead of seeking back
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _entry(name):
+    info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+    info.compress_type = (zipfile.ZIP_DEFLATED if name.lower().endswith(DEFLATED_EXTENSIONS)
+                          else zipfile.ZIP_STORED)
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def iter_zip(files, manifest):
+    """Yield the bytes of the pack zip: ``manifest.json``, then ``files`` under their stored names."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        archive.writestr(_entry('manifest.json'), json.dumps(manifest, indent=2))
+        yield sink.drain()
+        for file in files:
+            with file['storage'].open(file['name'], 'rb') as source, archive.open(_entry(file['name']), 'w') as target:
+                for piece in iter(lambda: source.read(READ_SIZE), b''):
+                    target.write(piece)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0005_alter_campusmap_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='nodes',
+            index=models.Index(fields=['building', 'floor_level', 'name', 'node_id'], name='nodes_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0006_nodes_listing_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nodes',
+            name='image360_tiles',
+            field=models.JSONField(blank=True, editable=False, help_text='Tile pyramid manifest of the 360° image', null=True),
+        ),
+    ]
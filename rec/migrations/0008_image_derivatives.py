@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0007_nodes_image360_tiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campusmap',
+            name='blueprint_derivatives',
+            field=models.JSONField(blank=True, editable=False, help_text='Derivatives manifest of the blueprint image', null=True),
+        ),
+        migrations.AddField(
+            model_name='nodes',
+            name='image360_derivatives',
+            field=models.JSONField(blank=True, editable=False, help_text='Derivatives manifest of the 360° image', null=True),
+        ),
+    ]
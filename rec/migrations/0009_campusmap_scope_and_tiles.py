@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0008_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campusmap',
+            name='blueprint_tiles',
+            field=models.JSONField(blank=True, editable=False, help_text='Tile pyramid manifest of the blueprint image', null=True),
+        ),
+        migrations.AddField(
+            model_name='campusmap',
+            name='building',
+            field=models.CharField(blank=True, default='', help_text='Building this map covers (empty for the whole campus)', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='campusmap',
+            name='floor_level',
+            field=models.IntegerField(blank=True, help_text='Floor this map covers (empty for all floors)', null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:49
+
+import django.core.validators
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0009_campusmap_scope_and_tiles'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('upload_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('total_size', models.BigIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('chunk_size', models.IntegerField(help_text='Size of every part except the last, in bytes')),
+                ('received_size', models.BigIntegerField(default=0, help_text='Bytes stored so far, in order')),
+                ('checksum', models.CharField(blank=True, help_text='Expected SHA-256 of the whole file (optional)', max_length=64)),
+                ('image_format', models.CharField(blank=True, max_length=16)),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('completed', 'Completed'), ('failed', 'Failed'), ('aborted', 'Aborted')], default='uploading', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='rec.nodes')),
+            ],
+            options={
+                'verbose_name': 'Upload Session',
+                'verbose_name_plural': 'Upload Sessions',
+            },
+        ),
+    ]
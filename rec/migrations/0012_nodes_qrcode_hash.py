@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0011_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nodes',
+            name='qrcode_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+    ]
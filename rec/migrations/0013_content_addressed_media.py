@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:59
+
+import rec.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0012_nodes_qrcode_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='campusmap',
+            name='blueprint_image',
+            field=models.ImageField(help_text='Campus blueprint/floor plan image', storage=rec.storage.get_content_storage, upload_to='campus_maps/'),
+        ),
+        migrations.AlterField(
+            model_name='nodes',
+            name='image360',
+            field=models.ImageField(blank=True, help_text='Upload 360° panorama image', null=True, storage=rec.storage.get_content_storage, upload_to='360_images/'),
+        ),
+        migrations.AlterField(
+            model_name='nodes',
+            name='qrcode',
+            field=models.ImageField(blank=True, help_text='Auto-generated QR code', null=True, storage=rec.storage.get_content_storage, upload_to='qrcodes/'),
+        ),
+    ]
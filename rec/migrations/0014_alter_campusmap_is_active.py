@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0013_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='campusmap',
+            name='is_active',
+            field=models.BooleanField(default=True, help_text='Only one map should be active per building and floor'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0014_alter_campusmap_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='lease',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='leased_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
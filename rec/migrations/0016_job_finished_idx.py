@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0015_uploadsession_lease'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'finished_at'], name='job_finished_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:40
+
+import uuid
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_versions(apps, schema_editor):
+    # A token for every table, so a replica can be matched before the first write
+    DataVersion = apps.get_model('rec', 'DataVersion')
+    now = timezone.now().replace(microsecond=0)
+    DataVersion.objects.using(schema_editor.connection.alias).bulk_create([
+        DataVersion(table=table, token=uuid.uuid4().hex, modified=now)
+        for table in ('nodes', 'edges', 'annotations', 'campus_map')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rec', '0016_job_finished_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('table', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('modified', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Data Version',
+                'verbose_name_plural': 'Data Versions',
+            },
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
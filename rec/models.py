@@ -1,24 +1,40 @@
 from django.db import models
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.core.files.base import ContentFile
-import qrcode
-from io import BytesIO
+from django.utils import timezone
+import uuid
+
+from .derivatives import derivative_url
+from .storage import get_content_storage
 
 
 class CampusMap(models.Model):
     """
-    Stores the main campus blueprint image.
-    Only one active map is used for the entire campus.
+    Stores a blueprint image: the campus-wide map or the map of one building
+    (and floor). One map is active per building/floor scope.
     """
     map_id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255, default='Campus Map', help_text='Map name')
-    blueprint_image = models.ImageField(upload_to='campus_maps/', help_text='Campus blueprint/floor plan image')
+    blueprint_image = models.ImageField(upload_to='campus_maps/', storage=get_content_storage, help_text='Campus blueprint/floor plan image')
+    
+    # Optional scope: a map of one building (and floor); empty for the campus-wide map
+    building = models.CharField(max_length=255, blank=True, default='',
+                                help_text='Building this map covers (empty for the whole campus)')
+    floor_level = models.IntegerField(null=True, blank=True,
+                                      help_text='Floor this map covers (empty for all floors)')
     
     # Optional calibration data
     scale_meters_per_pixel = models.FloatField(null=True, blank=True,
                                                help_text='Scale: meters per pixel (for distance calculation)')
     
-    is_active = models.BooleanField(default=True, help_text='Only one map should be active')
+    # Deep-zoom tile pyramid of the blueprint, generated on save (see rec/blueprint_tiles.py)
+    blueprint_tiles = models.JSONField(null=True, blank=True, editable=False,
+                                       help_text='Tile pyramid manifest of the blueprint image')
+    # Thumbnail/medium versions and placeholder, generated on save (see rec/derivatives.py)
+    blueprint_derivatives = models.JSONField(null=True, blank=True, editable=False,
+                                             help_text='Derivatives manifest of the blueprint image')
+    
+    is_active = models.BooleanField(default=True, help_text='Only one map should be active per building and floor')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -30,11 +46,31 @@ class CampusMap(models.Model):
         return self.name
     
     def save(self, *args, **kwargs):
-        """Ensure only one active map."""
+        """Ensure only one active map per building/floor scope."""
         if self.is_active:
-            # Deactivate all other maps
-            CampusMap.objects.filter(is_active=True).update(is_active=False)
+            # Deactivate the other maps of the same scope
+            CampusMap.objects.filter(is_active=True, building=self.building,
+                                     floor_level=self.floor_level).update(is_active=False)
         super().save(*args, **kwargs)
+    
+    @classmethod
+    def active_for(cls, building='', floor_level=None):
+        """
+        Most specific active map: the building's floor, then the building, then
+        the campus-wide map (any active map as a last resort).
+        """
+        active = cls.objects.filter(is_active=True)
+        scopes = []
+        if building:
+            if floor_level is not None:
+                scopes.append((building, floor_level))
+            scopes.append((building, None))
+        scopes.append(('', None))
+        for scope_building, scope_floor in scopes:
+            campus_map = active.filter(building=scope_building, floor_level=scope_floor).first()
+            if campus_map:
+                return campus_map
+        return active.first()
 
 #This provides the database models for the application. for A* ALGORITHM PATH FINDING IN MY CAMPUS
 class Nodes(models.Model):
@@ -45,9 +81,18 @@ class Nodes(models.Model):
     building = models.CharField(max_length=255)
     floor_level = models.IntegerField()
     type_of_node = models.CharField(max_length=255, default='room')
-    image360 = models.ImageField(upload_to='360_images/', blank=True, null=True, help_text='Upload 360° panorama image')
+    image360 = models.ImageField(upload_to='360_images/', storage=get_content_storage, blank=True, null=True, help_text='Upload 360° panorama image')
     
-    qrcode = models.ImageField(upload_to='qrcodes/', blank=True, null=True, help_text='Auto-generated QR code')
+    # Cube-face tile pyramid of image360, generated on save (see rec/panorama_tiles.py)
+    image360_tiles = models.JSONField(null=True, blank=True, editable=False,
+                                      help_text='Tile pyramid manifest of the 360° image')
+    # Thumbnail/medium versions and placeholder of image360 (see rec/derivatives.py)
+    image360_derivatives = models.JSONField(null=True, blank=True, editable=False,
+                                            help_text='Derivatives manifest of the 360° image')
+    
+    qrcode = models.ImageField(upload_to='qrcodes/', storage=get_content_storage, blank=True, null=True, help_text='Auto-generated QR code')
+    # Hash of the payload and format qrcode was rendered from (see rec/qrcodes.py)
+    qrcode_hash = models.CharField(max_length=40, blank=True, default='', editable=False)
     description = models.TextField(blank=True, null=True)
     
     # Campus map coordinates (percentage-based for responsive positioning)
@@ -58,28 +103,18 @@ class Nodes(models.Model):
     
     created_at = models.DateTimeField(auto_now_add=True)
     
-    def save(self, *args, **kwargs):
-        """Auto-generate QR code on save."""
-        # Generate QR code if node_code exists
-        if self.node_code and not self.qrcode:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            # QR code contains node information in JSON format
-            qr_data = f'{{"node_code": "{self.node_code}", "name": "{self.name}", "building": "{self.building}"}}'
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            filename = f'qr_{self.node_code}.png'
-            self.qrcode.save(filename, ContentFile(buffer.getvalue()), save=False)
-        
-        super().save(*args, **kwargs)
+    class Meta:
+        indexes = [
+            # Keyset pagination order of the mobile nodes list
+            models.Index(fields=['building', 'floor_level', 'name', 'node_id'], name='nodes_listing_idx'),
+        ]
+    
+    @property
+    def image360_thumbnail_url(self):
+        """Small JPEG version of the 360° image, the original while it is not generated."""
+        if not self.image360:
+            return None
+        return derivative_url(self.image360_derivatives) or self.image360.url
 
 class Edges(models.Model):
     # here from_node and to_node are foreign keys referencing the Nodes model
@@ -138,4 +173,130 @@ class Annotation(models.Model):
 
     def __str__(self):
         target = f' -> {self.target_node.name}' if self.target_node else ''
-        return f'{self.label} @ {self.yaw:.1f}°, {self.pitch:.1f}° on {self.panorama.name}{target}'
\ No newline at end of file
+        return f'{self.label} @ {self.yaw:.1f}°, {self.pitch:.1f}° on {self.panorama.name}{target}'
+
+class UploadSession(models.Model):
+    """
+    A chunked, resumable upload of a node's 360° image.
+
+    Parts are appended in order to a staging file (see rec/uploads.py); once
+    every byte arrived the file is attached to the node. ``received_size``
+    tells a client where to resume after a dropped connection.
+    """
+
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_ABORTED = 'aborted'
+    STATUS_CHOICES = (
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_ABORTED, 'Aborted'),
+    )
+
+    upload_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    node = models.ForeignKey(Nodes, related_name='upload_sessions', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField(validators=[MinValueValidator(1)])
+    chunk_size = models.IntegerField(help_text='Size of every part except the last, in bytes')
+    received_size = models.BigIntegerField(default=0, help_text='Bytes stored so far, in order')
+    checksum = models.CharField(max_length=64, blank=True, help_text='Expected SHA-256 of the whole file (optional)')
+
+    # Filled in as soon as the image header has arrived
+    image_format = models.CharField(max_length=16, blank=True)
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    error = models.TextField(blank=True)
+
+    # Held by the request currently streaming a part or verifying the file
+    lease = models.CharField(max_length=32, blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True)
+
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+
+    def __str__(self):
+        return f'{self.filename} for {self.node.node_code} ({self.status})'
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by ``manage.py run_jobs`` (see rec/jobs.py).
+
+    ``key`` makes enqueueing idempotent: while a job with the same key is
+    still queued, enqueueing it again returns that job instead of adding one.
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100, help_text='Registered task name')
+    key = models.CharField(max_length=255, null=True, blank=True,
+                           help_text='Idempotency key; at most one queued job per key')
+    payload = models.JSONField(default=dict, blank=True, help_text='Keyword arguments of the task')
+    priority = models.SmallIntegerField(default=0, help_text='Higher runs first')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text='Not started before this time')
+    locked_by = models.CharField(max_length=255, blank=True, help_text='Worker running the job')
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Job'
+        verbose_name_plural = 'Jobs'
+        indexes = [
+            # Order in which workers claim jobs
+            models.Index(fields=['status', '-priority', 'run_after'], name='job_claim_idx'),
+            # Retention purge of finished jobs
+            models.Index(fields=['status', 'finished_at'], name='job_finished_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status='queued'),
+                                    name='job_unique_queued_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+class DataVersion(models.Model):
+    """
+    The version token of a table the read APIs depend on (see rec/versioning.py).
+
+    Written in the same transaction as the change it stands for, so a read
+    replica holds the token of exactly the data it has replicated.
+    """
+
+    table = models.CharField(max_length=50, primary_key=True)
+    token = models.CharField(max_length=32)
+    modified = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Data Version'
+        verbose_name_plural = 'Data Versions'
+
+    def __str__(self):
+        return f'{self.table} {self.token}'
@@ -0,0 +1,194 @@
+"""
+Multi-resolution cube tiles for 360° panoramas.
+
+Uploaded panoramas are equirectangular images that clients otherwise have to
+download in full before showing anything. From each upload this module
+renders the six cube faces at several zoom levels, cut into square tiles, plus
+a small equirectangular preview:
+
+    360_tiles/<digest>/preview.jpg
+    360_tiles/<digest>/<level>/<face><row>_<col>.jpg
+    360_tiles/<digest>/manifest.json
+
+``<digest>`` is the hash of the source file, so identical uploads share one
+pyramid and a replaced image never serves stale tiles. Level 1 is the
+smallest, each following level doubles the face size, and faces are named
+f, r, b, l, u, d (front, right, back, left, up, down) - the layout of
+Pannellum's ``multires`` panoramas, which the manifest maps onto directly.
+
+Faces are projected with Pillow's MESH transform: every face is split into a
+grid of small cells whose corners are projected exactly and the inside is
+interpolated, which keeps the work in C without requiring numpy.
+"""
+
+import json
+import math
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .imaging import file_digest, open_rgb, save_file, save_image, sync_manifest
+
+TILES_ROOT = '360_tiles'
+TILE_SIZE = 512
+MAX_CUBE_RESOLUTION = 4096
+PREVIEW_WIDTH = 1024
+JPEG_QUALITY = 85
+
+# Cells per face side used for the MESH projection
+MESH_GRID = 32
+
+FACES = ('f', 'r', 'b', 'l', 'u', 'd')
+
+# Manifest keys describing the pyramid, in the order they are returned
+MANIFEST_FIELDS = ('type', 'path', 'extension', 'tile_resolution', 'max_level', 'cube_resolution')
+
+
+def _face_vector(face, a, b):
+    """Direction through face point (a, b), both in [-1, 1] with a to the right and b down."""
+    # x to the right, y up, z towards the front (yaw 0)
+    if face == 'f':
+        return a, -b, 1.0
+    if face == 'r':
+        return 1.0, -b, -a
+    if face == 'b':
+        return -a, -b, -1.0
+    if face == 'l':
+        return -1.0, -b, a
+    if face == 'u':
+        return a, 1.0, b
+    return a, -1.0, -b
+
+
+def _source_point(face, a, b, width, height):
+    """Equirectangular pixel seen through face point (a, b), plus whether it is a pole."""
+    x, y, z = _face_vector(face, a, b)
+    horizontal = math.hypot(x, z)
+    lon = math.atan2(x, z)
+    lat = math.atan2(y, horizontal)
+    return (lon / (2 * math.pi) + 0.5) * width, (0.5 - lat / math.pi) * height, horizontal < 1e-9
+
+
+def _face_mesh(face, size, width, height, grid=MESH_GRID):
+    """MESH transform data mapping a ``size`` square face onto the (padded) equirectangular source."""
+    step = size / grid
+    mesh = []
+    for i in range(grid):
+        for j in range(grid):
+            x0, y0 = round(i * step), round(j * step)
+            x1, y1 = round((i + 1) * step), round((j + 1) * step)
+            # Corner order of a Pillow mesh quad: upper left, lower left, lower right, upper right
+            corners = [_source_point(face, 2 * px / size - 1, 2 * py / size - 1, width, height)
+                       for px, py in ((x0, y0), (x0, y1), (x1, y1), (x1, y0))]
+            xs = [sx for sx, sy, pole in corners if not pole]
+            # Cells crossing the +-180 degree seam continue into the padding on the right
+            if max(xs) - min(xs) > width / 2:
+                xs = [sx + width if sx < width / 2 else sx for sx in xs]
+            # Longitude is undefined at a pole; take it from the other corners
+            pole_x = sum(xs) / len(xs)
+            xs = iter(xs)
+            quad = []
+            for _, sy, pole in corners:
+                quad += [pole_x if pole else next(xs), sy]
+            mesh.append(((x0, y0, x1, y1), quad))
+    return mesh
+
+
+def _padded_source(image):
+    """The panorama with its left half repeated on the right, so seam cells stay contiguous."""
+    width, height = image.size
+    padded = Image.new(image.mode, (width + width // 2 + 1, height))
+    padded.paste(image, (0, 0))
+    padded.paste(image.crop((0, 0, width // 2 + 1, height)), (width, 0))
+    return padded
+
+
+def render_face(padded, face, size, width, height):
+    return padded.transform((size, size), Image.MESH, _face_mesh(face, size, width, height),
+                            resample=Image.BILINEAR)
+
+
+def pyramid_levels(source_width, tile_size=TILE_SIZE, max_resolution=MAX_CUBE_RESOLUTION):
+    """(cube resolution, number of levels) for a panorama ``source_width`` pixels wide."""
+    resolution = max(min(source_width // 4, max_resolution), 1)
+    levels = 1
+    while resolution >> (levels - 1) > tile_size:
+        levels += 1
+    # Every level is exactly half of the next one
+    resolution = (resolution >> (levels - 1)) << (levels - 1)
+    return resolution, levels
+
+
+def _save(path, image):
+    save_image(path, image, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+
+
+def generate_panorama_tiles(field_file, tile_size=TILE_SIZE):
+    """
+    Render the tile pyramid of an equirectangular image and return its manifest.
+
+    Pyramids are content addressed: when one already exists for the same image
+    content, its manifest is reused.
+    """
+    base = f'{TILES_ROOT}/{file_digest(field_file)}'
+    manifest_path = f'{base}/manifest.json'
+    if default_storage.exists(manifest_path):
+        with default_storage.open(manifest_path, 'rb') as f:
+            return {**json.load(f), 'source': field_file.name}
+
+    source = open_rgb(field_file)
+    width, height = source.size
+    resolution, levels = pyramid_levels(width, tile_size)
+
+    preview_width = min(PREVIEW_WIDTH, width)
+    _save(f'{base}/preview.jpg', source.resize((preview_width, max(preview_width // 2, 1)), Image.LANCZOS))
+
+    padded = _padded_source(source)
+    del source
+    for face in FACES:
+        face_image = render_face(padded, face, resolution, width, height)
+        for level in range(levels, 0, -1):
+            size = resolution >> (levels - level)
+            level_image = face_image if size == resolution else face_image.resize((size, size), Image.LANCZOS)
+            count = math.ceil(size / tile_size)
+            for row in range(count):
+                for col in range(count):
+                    box = (col * tile_size, row * tile_size,
+                           min((col + 1) * tile_size, size), min((row + 1) * tile_size, size))
+                    _save(f'{base}/{level}/{face}{row}_{col}.jpg', level_image.crop(box))
+
+    manifest = {
+        'type': 'multires',
+        'base': base,
+        'path': '/%l/%s%y_%x',
+        'extension': 'jpg',
+        'tile_resolution': tile_size,
+        'max_level': levels,
+        'cube_resolution': resolution,
+        'preview': f'{base}/preview.jpg',
+    }
+    # Written last: its presence marks a complete pyramid
+    save_file(manifest_path, json.dumps(manifest).encode())
+    return {**manifest, 'source': field_file.name}
+
+
+def ensure_panorama_tiles(node):
+    """Bring ``node.image360_tiles`` in line with ``node.image360``; True when it changed."""
+    return sync_manifest(node, 'image360', 'image360_tiles', generate_panorama_tiles)
+
+
+def tiles_enabled():
+    return getattr(settings, 'REC_PANORAMA_TILES', True)
+
+
+def manifest_for(node, request):
+    """Public form of a node's tile manifest with absolute URLs, or None."""
+    manifest = node.image360_tiles
+    if not manifest:
+        return None
+    return {
+        'base_url': request.build_absolute_uri(default_storage.url(manifest['base'])),
+        'preview_url': request.build_absolute_uri(default_storage.url(manifest['preview'])),
+        **{key: manifest[key] for key in MANIFEST_FIELDS},
+    }
@@ -11,6 +11,7 @@ This module implements A* pathfinding that considers:
 import heapq
 from typing import List, Dict, Tuple, Optional
 from .models import Nodes, Edges
+from .versioning import graph_version
 
 
 class PathFinder:
@@ -236,14 +237,17 @@ class PathFinder:
         return directions[index]
 
 
-# Global instance (singleton pattern)
+# Global instance (singleton pattern), rebuilt when the graph version changes
 _pathfinder_instance = None
+_pathfinder_version = None
 
 def get_pathfinder() -> PathFinder:
     """Get or create global PathFinder instance."""
-    global _pathfinder_instance
-    if _pathfinder_instance is None:
+    global _pathfinder_instance, _pathfinder_version
+    version = graph_version()
+    if _pathfinder_instance is None or _pathfinder_version != version:
         _pathfinder_instance = PathFinder()
+        _pathfinder_version = version
     return _pathfinder_instance
 
 def reset_pathfinder():
@@ -0,0 +1,154 @@
+"""
+QR code images of nodes.
+
+Every node gets a QR code encoding a small JSON payload (see
+``qrcode_payload``). ``generate_qrcodes`` (re)renders the codes of many nodes
+at once, as used by the job queue, ``manage.py generate_qrcodes`` and the
+admin action:
+
+- nodes whose payload and format hash (``Nodes.qrcode_hash``) is unchanged and
+  whose file still exists are skipped, so rerunning it is cheap,
+- images are rendered across a process pool for large sets,
+- files go through the content-addressed storage (rec/storage.py), which
+  writes them under a temporary name and renames them into place, so a
+  reader never sees a half-written image,
+- rows are updated with one ``bulk_update`` per batch.
+
+PNG is the default; SVG (``REC_QRCODE_FORMAT = 'svg'`` or ``--format svg``)
+skips raster encoding and prints sharply at any size. The SVG is a single
+path of module runs, which compresses well when served gzipped.
+"""
+
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .versioning import bump_version, NODES
+
+FORMATS = ('png', 'svg')
+
+# Rendered size of one SVG module in pixels, the box size of the PNGs
+SVG_MODULE_SIZE = 10
+
+# Below this many images a process pool costs more than it saves
+POOL_THRESHOLD = 32
+BULK_UPDATE_BATCH_SIZE = 500
+
+
+def default_format():
+    return getattr(settings, 'REC_QRCODE_FORMAT', 'png')
+
+
+def qrcode_payload(node):
+    """Data encoded in a node's QR code (JSON)."""
+    return json.dumps({'node_code': node.node_code, 'name': node.name, 'building': node.building},
+                      ensure_ascii=False)
+
+
+def payload_hash(payload, format):
+    return hashlib.sha1(f'{format}:{payload}'.encode()).hexdigest()
+
+
+def qrcode_hash(node, format=None):
+    """Hash of what the node's QR code image should contain."""
+    return payload_hash(qrcode_payload(node), format or default_format())
+
+
+def _svg(matrix):
+    """Compact SVG of a module matrix: one path with a rectangle per horizontal run of dark modules."""
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if row[x]:
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+            else:
+                x += 1
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" '
+            f'width="{size * SVG_MODULE_SIZE}" height="{size * SVG_MODULE_SIZE}" shape-rendering="crispEdges">'
+            f'<rect width="{size}" height="{size}" fill="#fff"/>'
+            f'<path d="{"".join(runs)}"/></svg>').encode()
+
+
+def render(payload, format='png'):
+    """Image bytes of a QR code; a module-level function so pool workers can run it."""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    if format == 'svg':
+        # get_matrix() includes the quiet zone border
+        return _svg(qr.get_matrix())
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _render_args(args):
+    return render(*args)
+
+
+def is_current(node, format):
+    return bool(node.qrcode) and node.qrcode_hash == qrcode_hash(node, format) \
+        and node.qrcode.storage.exists(node.qrcode.name)
+
+
+def generate_qrcodes(nodes, format=None, force=False, processes=None):
+    """
+    Render the QR codes of ``nodes`` that are missing or outdated.
+
+    ``force`` re-renders every node. ``processes`` caps the pool size
+    (1 renders in this process). Returns (generated, skipped) counts.
+    """
+    # Imported here: pool workers started by spawning import this module without Django set up
+    from .media_gc import release
+    from .models import Nodes
+
+    format = format or default_format()
+    if format not in FORMATS:
+        raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+
+    stale = [node for node in nodes if node.node_code and (force or not is_current(node, format))]
+    skipped = len(nodes) - len(stale)
+    if not stale:
+        return 0, skipped
+
+    work = [(qrcode_payload(node), format) for node in stale]
+    if processes == 1 or len(work) < POOL_THRESHOLD:
+        images = map(_render_args, work)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=processes)
+        images = pool.map(_render_args, work, chunksize=16)
+
+    replaced = []
+    try:
+        for node, (payload, _), content in zip(stale, work, images):
+            previous = node.qrcode.name
+            node.qrcode.save(f'qr_{node.node_code}.{format}', ContentFile(content), save=False)
+            if previous and previous != node.qrcode.name:
+                replaced.append(previous)
+            node.qrcode_hash = payload_hash(payload, format)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    Nodes.objects.bulk_update(stale, ['qrcode', 'qrcode_hash'], batch_size=BULK_UPDATE_BATCH_SIZE)
+    bump_version(NODES)
+
+    # Images of the previous payloads
+    release(replaced)
+    return len(stale), skipped
@@ -0,0 +1,82 @@
+"""
+Pre-serialized response cache for hot read endpoints.
+
+Payloads such as ``/api/graph-data/`` are identical for every viewer until the
+graph changes, so the encoded bytes (plus a gzipped copy) are stored in the
+Django cache under the request's ETag, which already covers the data version
+of the tables involved, the host and the query string. Any signal that bumps
+a table version therefore retires the entry, and a warm request is one cache
+lookup and a write to the socket.
+
+Settings:
+    REC_RESPONSE_CACHE_TIMEOUT  Seconds an entry is kept (default one day).
+    REC_RESPONSE_CACHE_GZIP     Store and serve a pre-gzipped body (default True).
+    REC_FAST_JSON               Encode with orjson when it is installed. Its
+                                compact output is not byte-identical to
+                                JsonResponse / streamed output (default False).
+"""
+
+import gzip
+import hashlib
+import json
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .versioning import etag_for
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# Bodies smaller than this are not worth compressing
+MIN_GZIP_SIZE = 200
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+
+
+def encode_json(data):
+    """Encode a payload to bytes, the same way ``JsonResponse`` does by default."""
+    if orjson is not None and getattr(settings, 'REC_FAST_JSON', False):
+        return orjson.dumps(data)
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+def _cache_key(etag):
+    return 'rec:response:' + hashlib.sha1(etag.encode()).hexdigest()
+
+
+def cached_json_response(request, tables, build):
+    """
+    Serve the JSON payload returned by ``build()`` from the response cache.
+
+    ``tables`` are the data versions the payload depends on; ``build`` is only
+    called on a miss.
+    """
+    etag = etag_for(*tables)(request)
+    key = _cache_key(etag)
+    entry = cache.get(key)
+    if entry is None:
+        body = encode_json(build())
+        compressed = None
+        if getattr(settings, 'REC_RESPONSE_CACHE_GZIP', True) and len(body) >= MIN_GZIP_SIZE:
+            compressed = gzip.compress(body, compresslevel=6, mtime=0)
+        entry = (body, compressed)
+        cache.set(key, entry, getattr(settings, 'REC_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+    body, compressed = entry
+    if compressed is not None and _accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(compressed, content_type='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        # Same convention as GZipMiddleware: the encoded variant gets a weak ETag
+        response.headers['ETag'] = f'W/"{etag}"'
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    if compressed is not None:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
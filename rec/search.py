@@ -0,0 +1,235 @@
+"""
+In-memory search index for node lookup.
+
+Backs the autocomplete endpoint of the mobile app. Instead of OR'ed
+``icontains`` scans over the nodes table on every keystroke, node codes,
+names and buildings are tokenized once into:
+
+- a sorted token list, so prefixes are found with a binary search, and
+- a trigram index over the tokens, used for typo tolerance when a term has
+  no prefix match.
+
+The index is rebuilt lazily whenever the nodes version changes (see
+rec/versioning.py), so it never serves stale results for long.
+"""
+
+import heapq
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from .models import Nodes
+from .versioning import get_version, NODES
+
+# Relative importance of the field a token came from
+CODE_WEIGHT = 3.0
+NAME_WEIGHT = 2.0
+BUILDING_WEIGHT = 1.0
+
+# Match quality multipliers
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.7
+FUZZY_SCORE = 0.4
+
+# Minimum trigram similarity (Dice coefficient) for a fuzzy token match
+FUZZY_THRESHOLD = 0.45
+
+# Upper bound on tokens examined for a single prefix, keeps 1-letter queries cheap
+MAX_PREFIX_TOKENS = 5000
+
+# Letters and digits of any script
+_token_re = re.compile(r'[^\W_]+')
+
+
+def fold(text: str) -> str:
+    """Case- and accent-insensitive form of ``text`` ("Café" -> "cafe")."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return _token_re.findall(fold(text))
+
+
+def trigrams(token: str) -> set:
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NodeSearchIndex:
+    """Prefix and trigram index over node code, name and building."""
+
+    def __init__(self, rows):
+        """``rows`` are (node_id, node_code, name, building, floor_level, type_of_node) tuples."""
+        # Index in name order so every posting list is already tie-broken by name
+        rows = sorted(rows, key=lambda row: (row[2].lower(), row[0]))
+        self.docs = {}
+        self.codes = {}  # folded node code -> node_id, for exact lookups
+        self.node_tokens = {}  # node_id -> {token: weight}
+        postings = defaultdict(lambda: defaultdict(list))  # token -> {weight: [node_id, ...]}
+
+        for node_id, node_code, name, building, floor_level, type_of_node in rows:
+            self.docs[node_id] = (node_code, name, building, floor_level, type_of_node)
+            self.codes[fold(node_code)] = node_id
+            weights = {}
+            fields = (
+                (tokenize(building), BUILDING_WEIGHT),
+                (tokenize(name), NAME_WEIGHT),
+                (tokenize(node_code), CODE_WEIGHT),
+            )
+            for tokens, weight in fields:
+                for token in tokens:
+                    weights[token] = weight
+            self.node_tokens[node_id] = weights
+            for token, weight in weights.items():
+                postings[token][weight].append(node_id)
+
+        self.order = {node_id: i for i, node_id in enumerate(self.docs)}
+        self.postings = {token: dict(groups) for token, groups in postings.items()}
+        self.sizes = {token: sum(len(ids) for ids in groups.values())
+                      for token, groups in self.postings.items()}
+        self.tokens = sorted(self.postings)
+        self.trigram_index = defaultdict(list)
+        for token in self.tokens:
+            for gram in trigrams(token):
+                self.trigram_index[gram].append(token)
+
+    def _prefix_tokens(self, term):
+        start = bisect_left(self.tokens, term)
+        end = min(start + MAX_PREFIX_TOKENS, len(self.tokens))
+        for token in self.tokens[start:end]:
+            if not token.startswith(term):
+                break
+            yield token
+
+    def _fuzzy_tokens(self, term):
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.trigram_index.get(gram, ()))
+        for token, count in shared.items():
+            similarity = 2.0 * count / (len(grams) + len(token) + 2)
+            if similarity >= FUZZY_THRESHOLD:
+                yield token, similarity
+
+    def _matching_tokens(self, term) -> Dict[str, float]:
+        """Tokens matching a query term, with their match quality."""
+        matches = {}
+        for token in self._prefix_tokens(term):
+            if token == term:
+                matches[token] = EXACT_SCORE
+            else:
+                # Shorter completions rank above long ones
+                matches[token] = PREFIX_SCORE * (0.5 + 0.5 * len(term) / len(token))
+        if not matches and len(term) >= 3:
+            for token, similarity in self._fuzzy_tokens(term):
+                matches[token] = FUZZY_SCORE * similarity
+        return matches
+
+    def _top_single(self, matches, limit):
+        """Top ``limit`` nodes for one term, stopping as soon as they are known."""
+        groups = sorted(((quality * weight, token, weight)
+                         for token, quality in matches.items()
+                         for weight in self.postings[token]), reverse=True)
+        ranked, seen = [], set()
+        for score, token, weight in groups:
+            for node_id in self.postings[token][weight]:
+                if node_id not in seen:
+                    # Groups are visited best first, so the first score seen is the best
+                    seen.add(node_id)
+                    ranked.append((node_id, score))
+                    if len(ranked) == limit:
+                        return ranked
+        return ranked
+
+    def _top_multi(self, term_matches, limit):
+        """Top ``limit`` nodes matching every term, driven by the most selective term."""
+        term_matches.sort(key=lambda matches: sum(self.sizes[token] for token in matches))
+        driver, others = term_matches[0], term_matches[1:]
+
+        totals = self._scores(driver)
+        for matches in others:
+            if sum(self.sizes[token] for token in matches) < 4 * len(totals):
+                # Cheaper to score this term on its own and intersect than to
+                # walk the (roughly ten) tokens of every candidate
+                scores = self._scores(matches)
+                totals = {node_id: total + scores[node_id]
+                          for node_id, total in totals.items() if node_id in scores}
+                continue
+            narrowed = {}
+            for node_id, total in totals.items():
+                best = max((matches[token] * weight
+                            for token, weight in self.node_tokens[node_id].items()
+                            if token in matches), default=0)
+                if best:
+                    narrowed[node_id] = total + best
+            totals = narrowed
+
+        order = self.order
+        return heapq.nsmallest(limit, totals.items(), key=lambda item: (-item[1], order[item[0]]))
+
+    def _scores(self, matches) -> Dict[int, float]:
+        """Best score of every node matching one term."""
+        scores = {}
+        for token, quality in matches.items():
+            for weight, node_ids in self.postings[token].items():
+                score = quality * weight
+                for node_id in node_ids:
+                    if score > scores.get(node_id, 0):
+                        scores[node_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """Rank nodes matching every term of ``query``."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        term_matches = [self._matching_tokens(term) for term in terms]
+        if not all(term_matches):
+            ranked = []
+        elif len(term_matches) == 1:
+            ranked = self._top_single(term_matches[0], limit)
+        else:
+            ranked = self._top_multi(term_matches, limit)
+
+        # Exact node code lookups (e.g. scanned or typed codes) always come first
+        code = fold(query.strip())
+        exact = self.codes.get(code)
+        if exact is not None:
+            ranked = [(exact, 10 * CODE_WEIGHT)] + [item for item in ranked if item[0] != exact]
+            ranked = ranked[:limit]
+
+        results = []
+        for node_id, score in ranked:
+            node_code, name, building, floor_level, type_of_node = self.docs[node_id]
+            results.append({
+                'node_id': node_id,
+                'node_code': node_code,
+                'name': name,
+                'building': building,
+                'floor_level': floor_level,
+                'type_of_node': type_of_node,
+                'score': round(score, 3)
+            })
+        return results
+
+
+# Global instance, rebuilt when the nodes version changes
+_search_index = None
+_search_index_version = None
+
+
+def get_search_index() -> NodeSearchIndex:
+    """Get the search index for the current nodes version."""
+    global _search_index, _search_index_version
+    version = get_version(NODES)[0]
+    if _search_index is None or _search_index_version != version:
+        rows = Nodes.objects.values_list(
+            'node_id', 'node_code', 'name', 'building', 'floor_level', 'type_of_node'
+        ).iterator(chunk_size=2000)
+        _search_index = NodeSearchIndex(rows)
+        _search_index_version = version
+    return _search_index
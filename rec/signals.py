@@ -0,0 +1,142 @@
+"""
+Model signal handlers keeping derived data in sync with the database.
+
+Slow work (QR codes, image processing, graph precomputation) is only queued
+here and done by the job worker (see rec/jobs.py and rec/tasks.py).
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Nodes, Edges, Annotation, CampusMap
+from . import blueprint_tiles, jobs, media_gc, tasks
+from .derivatives import derivatives_enabled
+from .imaging import manifest_outdated
+from .panorama_tiles import tiles_enabled
+from .qrcodes import qrcode_hash
+from .versioning import bump_version, NODES, EDGES, ANNOTATIONS, CAMPUS_MAP
+
+# Seconds graph precomputation waits for further edits, which join the queued job
+GRAPH_PRECOMPUTE_DELAY = 5
+
+
+# Tables whose changes alter the precomputed graph tiles
+PRECOMPUTED_TABLES = {NODES, EDGES, CAMPUS_MAP}
+
+_deferred = threading.local()
+
+
+def queue_graph_precompute():
+    jobs.enqueue(tasks.GRAPH_PRECOMPUTE, key=tasks.GRAPH_PRECOMPUTE, priority=jobs.PRIORITY_LOW,
+                 delay=GRAPH_PRECOMPUTE_DELAY)
+
+
+def tables_changed(*tables, raw=False):
+    """
+    Bump the versions of ``tables`` (published once the transaction commits,
+    see ``bump_version``) and queue graph precomputation if they affect it.
+    """
+    pending = getattr(_deferred, 'tables', None)
+    if pending is not None:
+        pending.update(tables)
+        return
+    bump_version(*tables)
+    if not raw and PRECOMPUTED_TABLES.intersection(tables):
+        queue_graph_precompute()
+
+
+@contextmanager
+def deferred_invalidation():
+    """
+    Collect the version bumps of the rows saved or deleted in the block and
+    do them once at its end, instead of once per row (bulk writes). Nothing
+    is bumped if the block raises: its transaction is rolled back anyway.
+    """
+    if getattr(_deferred, 'tables', None) is not None:
+        yield
+        return
+    _deferred.tables = tables = set()
+    try:
+        yield
+    finally:
+        _deferred.tables = None
+    if tables:
+        tables_changed(*tables)
+
+
+@receiver([post_save, post_delete], sender=Nodes)
+def nodes_changed(sender, raw=False, **kwargs):
+    tables_changed(NODES, raw=raw)
+
+
+@receiver(post_save, sender=Nodes)
+def node_saved(sender, instance, raw=False, **kwargs):
+    # Skipped for fixture loading; build_panorama_tiles / build_derivatives backfill those
+    if raw:
+        return
+    if instance.node_code and (not instance.qrcode or instance.qrcode_hash != qrcode_hash(instance)):
+        jobs.enqueue(tasks.NODE_QRCODE, {'node_id': instance.pk},
+                     key=f'{tasks.NODE_QRCODE}:{instance.pk}', priority=jobs.PRIORITY_HIGH)
+    if ((tiles_enabled() and manifest_outdated(instance, 'image360', 'image360_tiles'))
+            or (derivatives_enabled() and manifest_outdated(instance, 'image360', 'image360_derivatives'))):
+        jobs.enqueue(tasks.NODE_IMAGE360, {'node_id': instance.pk}, key=f'{tasks.NODE_IMAGE360}:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Edges)
+def edges_changed(sender, raw=False, **kwargs):
+    tables_changed(EDGES, raw=raw)
+
+
+@receiver([post_save, post_delete], sender=Annotation)
+def annotations_changed(sender, **kwargs):
+    tables_changed(ANNOTATIONS)
+
+
+@receiver([post_save, post_delete], sender=CampusMap)
+def campus_map_changed(sender, raw=False, **kwargs):
+    # Tile coordinates follow the active map's aspect ratio
+    tables_changed(CAMPUS_MAP, raw=raw)
+
+
+@receiver(post_save, sender=CampusMap)
+def blueprint_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if ((blueprint_tiles.tiles_enabled() and manifest_outdated(instance, 'blueprint_image', 'blueprint_tiles'))
+            or (derivatives_enabled()
+                and manifest_outdated(instance, 'blueprint_image', 'blueprint_derivatives'))):
+        jobs.enqueue(tasks.CAMPUS_MAP_BLUEPRINT, {'map_id': instance.pk},
+                     key=f'{tasks.CAMPUS_MAP_BLUEPRINT}:{instance.pk}')
+
+
+@receiver(pre_save, sender=Nodes)
+@receiver(pre_save, sender=CampusMap)
+def remember_stored_files(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Note the files a row referenced before this save, to release replaced ones."""
+    fields = [name for model, name in media_gc.FILE_FIELDS if model is sender
+              and (update_fields is None or name in update_fields)]
+    instance._stored_files = set()
+    if raw or instance._state.adding or not fields:
+        return
+    row = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._stored_files = {name for name in row.values() if name}
+
+
+@receiver(post_save, sender=Nodes)
+@receiver(post_save, sender=CampusMap)
+def release_replaced_files(sender, instance, raw=False, **kwargs):
+    replaced = getattr(instance, '_stored_files', set()) - media_gc.file_names(instance)
+    if replaced:
+        # Once committed, so a rollback never loses a file still referenced
+        transaction.on_commit(lambda: media_gc.release(replaced))
+
+
+@receiver(post_delete, sender=Nodes)
+@receiver(post_delete, sender=CampusMap)
+def release_deleted_files(sender, instance, **kwargs):
+    names = media_gc.file_names(instance)
+    if names:
+        transaction.on_commit(lambda: media_gc.release(names))
@@ -0,0 +1,310 @@
+"""
+Spatial index over node map positions.
+
+Nodes are placed on a blueprint with percentage coordinates (``map_x``/
+``map_y``, 0-100). For every building floor, positioned nodes and the active
+edges between two positioned nodes of that floor are bucketed into a uniform
+grid, which answers:
+
+- nearest-k nodes to a point (e.g. where the user tapped),
+- all nodes and edge segments inside a viewport rectangle,
+- snapping a point onto the nearest edge segment.
+
+Distances are measured after correcting x by the aspect ratio of the building
+floor's blueprint, so "nearest" matches what the user sees on a non-square map.
+They are reported in map percent units along the y axis. The index is rebuilt
+lazily whenever the graph or the campus maps change.
+"""
+
+import heapq
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from .models import Nodes, Edges, CampusMap
+from .versioning import combined_version, NODES, EDGES, CAMPUS_MAP
+
+# Grid cell size in map percent units
+CELL_SIZE = 5.0
+
+
+def _clips(x1, y1, x2, y2, rx0, ry0, rx1, ry1):
+    """Liang-Barsky test: does segment (x1, y1)-(x2, y2) intersect the rectangle?"""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - rx0), (dx, rx1 - x1), (-dy, y1 - ry0), (dy, ry1 - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+        t = q / p
+        if p < 0:
+            t0 = max(t0, t)
+        else:
+            t1 = min(t1, t)
+        if t0 > t1:
+            return False
+    return True
+
+
+class FloorIndex:
+    """Uniform grid over the nodes and edge segments of one building floor."""
+
+    def __init__(self, aspect: float):
+        self.aspect = aspect
+        self.points = defaultdict(list)    # cell -> [(x, y, node_id)]
+        self.segments = defaultdict(list)  # cell -> [(x1, y1, x2, y2, edge)]
+        self.min_cell = self.max_cell = (0, 0)
+
+    def _cell(self, x, y):
+        return int(x // CELL_SIZE), int(y // CELL_SIZE)
+
+    def _grow(self, cx, cy):
+        self.min_cell = (min(self.min_cell[0], cx), min(self.min_cell[1], cy))
+        self.max_cell = (max(self.max_cell[0], cx), max(self.max_cell[1], cy))
+
+    def add_point(self, x, y, node_id):
+        x *= self.aspect
+        cell = self._cell(x, y)
+        self._grow(*cell)
+        self.points[cell].append((x, y, node_id))
+
+    def add_segment(self, x1, y1, x2, y2, edge):
+        x1, x2 = x1 * self.aspect, x2 * self.aspect
+        min_cx, min_cy = self._cell(min(x1, x2), min(y1, y2))
+        max_cx, max_cy = self._cell(max(x1, x2), max(y1, y2))
+        self._grow(min_cx, min_cy)
+        self._grow(max_cx, max_cy)
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                self.segments[(cx, cy)].append((x1, y1, x2, y2, edge))
+
+    def _rings(self, x, y):
+        """
+        Yield (ring radius, occupied-grid cells of that ring) around the cell
+        holding (x, y), or the nearest grid cell if (x, y) lies outside the
+        grid. Cells beyond the grid are empty and cells on that side of the
+        start are no closer to (x, y), so the search never leaves the grid and
+        its cost is bounded by the index rather than by the query point.
+        """
+        (min_cx, min_cy), (max_cx, max_cy) = self.min_cell, self.max_cell
+        cx, cy = self._cell(x, y)
+        cx, cy = min(max(cx, min_cx), max_cx), min(max(cy, min_cy), max_cy)
+        max_radius = max(cx - min_cx, cy - min_cy, max_cx - cx, max_cy - cy)
+        yield 0, [(cx, cy)]
+        for r in range(1, max_radius + 1):
+            cells = [(cx + dx, cy - r) for dx in range(-r, r + 1)]
+            cells += [(cx + dx, cy + r) for dx in range(-r, r + 1)]
+            cells += [(cx - r, cy + dy) for dy in range(-r + 1, r)]
+            cells += [(cx + r, cy + dy) for dy in range(-r + 1, r)]
+            yield r, [(i, j) for i, j in cells if min_cx <= i <= max_cx and min_cy <= j <= max_cy]
+
+    def nearest(self, x, y, k):
+        """The ``k`` nearest (distance, node_id) pairs, closest first."""
+        x *= self.aspect
+        best = []  # max-heap of (-distance, node_id), at most k entries
+        for r, cells in self._rings(x, y):
+            for cell in cells:
+                for px, py, node_id in self.points.get(cell, ()):
+                    d = math.hypot(px - x, py - y)
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, node_id))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, node_id))
+            # Anything in ring r+1 or beyond is at least r cells away
+            if len(best) == k and -best[0][0] <= r * CELL_SIZE:
+                break
+        return sorted((-d, node_id) for d, node_id in best)
+
+    def in_rect(self, x0, y0, x1, y1):
+        x0, x1 = x0 * self.aspect, x1 * self.aspect
+        min_cx, min_cy = self._cell(x0, y0)
+        max_cx, max_cy = self._cell(x1, y1)
+        found = []
+        for cx in range(max(min_cx, 0), min(max_cx, self.max_cell[0]) + 1):
+            for cy in range(max(min_cy, 0), min(max_cy, self.max_cell[1]) + 1):
+                for px, py, node_id in self.points.get((cx, cy), ()):
+                    if x0 <= px <= x1 and y0 <= py <= y1:
+                        found.append(node_id)
+        return found
+
+    def segments_in_rect(self, x0, y0, x1, y1):
+        """Edges whose segment crosses the rectangle."""
+        x0, x1 = x0 * self.aspect, x1 * self.aspect
+        min_cx, min_cy = self._cell(x0, y0)
+        max_cx, max_cy = self._cell(x1, y1)
+        found = {}
+        for cx in range(max(min_cx, 0), min(max_cx, self.max_cell[0]) + 1):
+            for cy in range(max(min_cy, 0), min(max_cy, self.max_cell[1]) + 1):
+                for sx1, sy1, sx2, sy2, edge in self.segments.get((cx, cy), ()):
+                    if edge['edge_id'] not in found and _clips(sx1, sy1, sx2, sy2, x0, y0, x1, y1):
+                        found[edge['edge_id']] = edge
+        return list(found.values())
+
+    def snap(self, x, y):
+        """Nearest edge segment to (x, y) as (distance, t, px, py, edge), or None."""
+        x *= self.aspect
+        best = None
+        for r, cells in self._rings(x, y):
+            for cell in cells:
+                for x1, y1, x2, y2, edge in self.segments.get(cell, ()):
+                    dx, dy = x2 - x1, y2 - y1
+                    length_sq = dx * dx + dy * dy
+                    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length_sq))
+                    px, py = x1 + t * dx, y1 + t * dy
+                    d = math.hypot(px - x, py - y)
+                    if best is None or d < best[0]:
+                        best = (d, t, px / self.aspect, py, edge)
+            if best is not None and best[0] <= r * CELL_SIZE:
+                break
+        return best
+
+
+class SpatialIndex:
+    """
+    Grid indexes per building and floor plus the node data needed to answer
+    queries.
+
+    Each building floor may be drawn on its own blueprint (see
+    ``CampusMap.active_for``), so it gets its own grid, scaled by the aspect
+    ratio of that blueprint. Queries naming a building use its grid; the
+    others use the grids of the buildings drawn on the floor's campus-wide
+    map, whose coordinates are comparable.
+    """
+
+    def __init__(self, nodes, edges, aspect: float = 1.0, frames=None):
+        """
+        ``nodes`` are (node_id, node_code, name, building, floor_level, type_of_node, map_x, map_y)
+        tuples, ``edges`` are (edge_id, from_node_id, to_node_id, distance, compass_angle, is_staircase).
+        ``frames(building, floor_level)`` returns the (map ID, aspect ratio) the
+        floor is drawn with; by default every floor shares one map of ``aspect``.
+        """
+        self._frames = frames or (lambda building, floor_level: (None, aspect))
+        self._frame_cache = {}
+        self.grids: Dict[Tuple[str, int], FloorIndex] = {}
+        self.floors = set()
+        self.docs = {}
+        for node_id, node_code, name, building, floor_level, type_of_node, map_x, map_y in nodes:
+            if map_x is None or map_y is None:
+                continue
+            self.docs[node_id] = {
+                'node_id': node_id,
+                'node_code': node_code,
+                'name': name,
+                'building': building,
+                'floor_level': floor_level,
+                'type_of_node': type_of_node,
+                'map_x': float(map_x),
+                'map_y': float(map_y)
+            }
+            self._grid(building, floor_level).add_point(float(map_x), float(map_y), node_id)
+
+        for edge_id, from_id, to_id, distance, compass_angle, is_staircase in edges:
+            a, b = self.docs.get(from_id), self.docs.get(to_id)
+            if a is None or b is None or a['floor_level'] != b['floor_level']:
+                continue
+            # Ends drawn on different blueprints have no common coordinates
+            if self.frame(a['building'], a['floor_level']) != self.frame(b['building'], b['floor_level']):
+                continue
+            edge = {
+                'edge_id': edge_id,
+                'from_node_id': from_id,
+                'to_node_id': to_id,
+                'distance': distance,
+                'compass_angle': compass_angle,
+                'is_staircase': is_staircase
+            }
+            for building in {a['building'], b['building']}:
+                self._grid(building, a['floor_level']).add_segment(
+                    a['map_x'], a['map_y'], b['map_x'], b['map_y'], edge)
+
+    def frame(self, building, floor_level):
+        """(map ID, aspect ratio) of the blueprint a building floor is drawn on."""
+        if (building, floor_level) not in self._frame_cache:
+            self._frame_cache[building, floor_level] = self._frames(building, floor_level)
+        return self._frame_cache[building, floor_level]
+
+    def _grid(self, building, floor_level) -> FloorIndex:
+        if (building, floor_level) not in self.grids:
+            self.grids[building, floor_level] = FloorIndex(self.frame(building, floor_level)[1])
+            self.floors.add(floor_level)
+        return self.grids[building, floor_level]
+
+    def _grids(self, floor, building=None) -> List[FloorIndex]:
+        """The grid of ``building``, or those drawn on the campus-wide map of ``floor``."""
+        if building:
+            grid = self.grids.get((building, floor))
+            return [grid] if grid is not None else []
+        campus = self.frame('', floor)
+        return [grid for (grid_building, grid_floor), grid in self.grids.items()
+                if grid_floor == floor and self.frame(grid_building, floor) == campus]
+
+    def nearest(self, x: float, y: float, floor: int, k: int = 1,
+                building: Optional[str] = None) -> List[Dict]:
+        found = heapq.nsmallest(k, (hit for grid in self._grids(floor, building) for hit in grid.nearest(x, y, k)))
+        return [{**self.docs[node_id], 'distance': round(d, 3)} for d, node_id in found]
+
+    def in_viewport(self, x0: float, y0: float, x1: float, y1: float, floor: int,
+                    building: Optional[str] = None) -> List[Dict]:
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        return [self.docs[node_id] for grid in self._grids(floor, building)
+                for node_id in grid.in_rect(x0, y0, x1, y1)]
+
+    def edges_in_viewport(self, x0: float, y0: float, x1: float, y1: float, floor: int,
+                          building: Optional[str] = None) -> List[Dict]:
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        # Edges between two buildings are in both their grids
+        found = {}
+        for grid in self._grids(floor, building):
+            for edge in grid.segments_in_rect(x0, y0, x1, y1):
+                found.setdefault(edge['edge_id'], edge)
+        return list(found.values())
+
+    def snap(self, x: float, y: float, floor: int, building: Optional[str] = None) -> Optional[Dict]:
+        hits = [hit for hit in (grid.snap(x, y) for grid in self._grids(floor, building)) if hit is not None]
+        if not hits:
+            return None
+        d, t, px, py, edge = min(hits, key=lambda hit: hit[0])
+        return {
+            'edge': edge,
+            'point': {'map_x': round(px, 4), 'map_y': round(py, 4)},
+            # Position along the edge, 0 at from_node and 1 at to_node
+            'position': round(t, 4),
+            'distance': round(d, 3)
+        }
+
+
+def _map_frame(building, floor_level):
+    """(map ID, width / height) of the blueprint of a building floor; aspect 1.0 when unknown."""
+    campus_map = CampusMap.active_for(building, floor_level)
+    if campus_map is None:
+        return None, 1.0
+    try:
+        if campus_map.blueprint_image.height:
+            return campus_map.map_id, campus_map.blueprint_image.width / campus_map.blueprint_image.height
+    except (OSError, ValueError):
+        pass
+    return campus_map.map_id, 1.0
+
+
+# Global instance, rebuilt when the graph or the campus map changes
+_spatial_index = None
+_spatial_index_version = None
+
+
+def get_spatial_index() -> SpatialIndex:
+    """Get the spatial index for the current graph version."""
+    global _spatial_index, _spatial_index_version
+    version = combined_version(NODES, EDGES, CAMPUS_MAP)
+    if _spatial_index is None or _spatial_index_version != version:
+        nodes = Nodes.objects.values_list(
+            'node_id', 'node_code', 'name', 'building', 'floor_level', 'type_of_node', 'map_x', 'map_y'
+        ).iterator(chunk_size=2000)
+        edges = Edges.objects.filter(is_active=True).values_list(
+            'edge_id', 'from_node_id', 'to_node_id', 'distance', 'compass_angle', 'is_staircase'
+        ).iterator(chunk_size=2000)
+        _spatial_index = SpatialIndex(nodes, edges, frames=_map_frame)
+        _spatial_index_version = version
+    return _spatial_index
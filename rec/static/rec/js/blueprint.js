@@ -0,0 +1,86 @@
+/*
+ * Campus blueprint drawn on a canvas, shared by the map pages.
+ *
+ * With a tile manifest (see rec/blueprint_tiles.py) the canvas takes the
+ * blueprint's size and only the deep-zoom tiles covering the visible part
+ * of the canvas are downloaded, at the level matching its on-screen size.
+ * Without one (tiles not generated yet) the full image is loaded.
+ *
+ * onReady runs once the canvas has its size, onTile whenever another tile
+ * has arrived and the canvas should be redrawn.
+ */
+class Blueprint {
+    constructor(canvas, viewport, tiles, imageUrl, { onReady, onTile }) {
+        this.canvas = canvas;
+        this.ctx = canvas.getContext('2d');
+        this.viewport = viewport;  // element clipping the canvas (a scroll container), or null
+        this.tiles = tiles;
+        this.onTile = onTile;
+        this.images = new Map();  // "level/col_row" -> Image
+        if (tiles) {
+            canvas.width = tiles.width;
+            canvas.height = tiles.height;
+            setTimeout(onReady);
+        } else {
+            this.image = new Image();
+            this.image.onload = () => {
+                canvas.width = this.image.width;
+                canvas.height = this.image.height;
+                onReady();
+            };
+            this.image.src = imageUrl;
+        }
+    }
+
+    tile(level, col, row) {
+        const key = `${level}/${col}_${row}`;
+        let img = this.images.get(key);
+        if (!img) {
+            img = new Image();
+            img.onload = this.onTile;
+            img.src = `${this.tiles.tiles_url}${key}.${this.tiles.format}`;
+            this.images.set(key, img);
+        }
+        return img.complete && img.naturalWidth ? img : null;
+    }
+
+    drawLevel(level, x0, y0, x1, y1) {
+        const tiles = this.tiles;
+        const scale = Math.pow(2, tiles.max_level - level);  // blueprint px per level px
+        const size = tiles.tile_size;
+        const lastCol = Math.ceil(this.canvas.width / scale / size) - 1;
+        const lastRow = Math.ceil(this.canvas.height / scale / size) - 1;
+        for (let col = Math.floor(x0 / scale / size); col <= Math.min(lastCol, Math.floor(x1 / scale / size)); col++) {
+            for (let row = Math.floor(y0 / scale / size); row <= Math.min(lastRow, Math.floor(y1 / scale / size)); row++) {
+                const img = this.tile(level, col, row);
+                if (!img) continue;
+                const x = (col * size - (col ? tiles.overlap : 0)) * scale;
+                const y = (row * size - (row ? tiles.overlap : 0)) * scale;
+                this.ctx.drawImage(img, x, y, img.naturalWidth * scale, img.naturalHeight * scale);
+            }
+        }
+    }
+
+    draw() {
+        const canvas = this.canvas;
+        if (!this.tiles) {
+            this.ctx.drawImage(this.image, 0, 0);
+            return;
+        }
+        const tiles = this.tiles;
+        const c = canvas.getBoundingClientRect();
+        // Level matching the on-screen size of the canvas
+        const shown = c.width / canvas.width;
+        const level = Math.max(0, Math.min(tiles.max_level, tiles.max_level + Math.ceil(Math.log2(shown))));
+        // Single-tile overview first, so missing detail tiles never leave holes
+        const overview = tiles.max_level -
+            Math.ceil(Math.log2(Math.max(canvas.width, canvas.height) / tiles.tile_size));
+        this.drawLevel(Math.max(0, overview), 0, 0, canvas.width, canvas.height);
+
+        const w = this.viewport ? this.viewport.getBoundingClientRect() : c;
+        const ratio = canvas.width / c.width;
+        this.drawLevel(level,
+            Math.max(0, (w.left - c.left) * ratio), Math.max(0, (w.top - c.top) * ratio),
+            Math.min(canvas.width, (w.right - c.left) * ratio), Math.min(canvas.height, (w.bottom - c.top) * ratio));
+    }
+}
@@ -0,0 +1,79 @@
+"""
+Content-addressed storage for uploaded media.
+
+``Nodes.image360``, ``Nodes.qrcode`` and ``CampusMap.blueprint_image`` use
+``ContentAddressedStorage``: a file is stored as
+``<upload_to>/<sha256 of its content><extension>`` instead of under the name
+it was uploaded with. Uploading the same bytes again therefore stores
+nothing new and returns the existing name, where the default storage kept
+adding suffixed copies (``1282_hEnMuMO.jpg``).
+
+Since one file may now back several rows, do not delete these files through
+their field; rec/media_gc.py deletes a file once no row references it.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+
+# Prefix of files being written; they are renamed into place when complete
+TEMP_PREFIX = '.tmp-'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming every file after the SHA-256 of its content."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+
+        # Hash while writing to a temporary file next to the final one, so
+        # the file appears under its name complete or not at all
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=full_directory, prefix=TEMP_PREFIX)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            name = posixpath.join(directory, digest.hexdigest() + extension)
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # Already stored; the fresh mtime keeps cleanup from deleting it
+                # before the row referencing it is committed (see media_gc)
+                os.utime(full_path)
+                os.remove(temp_path)
+            else:
+                os.chmod(temp_path, self.file_permissions_mode or 0o644)
+                os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+def get_content_storage():
+    """Storage of the user-uploaded file fields (a callable, so migrations do not freeze it)."""
+    return content_storage
+
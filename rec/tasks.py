@@ -0,0 +1,77 @@
+"""
+Background tasks run by the job queue (see rec/jobs.py).
+
+Model signals enqueue these instead of doing the work while the request
+waits. Every task reloads its rows by primary key and is safe to run twice
+or after the row is gone.
+"""
+
+from . import blueprint_tiles
+from .derivatives import derivatives_enabled, ensure_derivatives
+from .jobs import task
+from .models import Nodes, CampusMap
+from .panorama_tiles import ensure_panorama_tiles, tiles_enabled
+from .qrcodes import generate_qrcodes
+from .tiles import precompute_tiles
+from .versioning import bump_version, NODES, CAMPUS_MAP
+
+NODE_QRCODE = 'nodes.qrcode'
+NODE_QRCODES = 'nodes.qrcodes'
+NODE_IMAGE360 = 'nodes.image360'
+CAMPUS_MAP_BLUEPRINT = 'campus_map.blueprint'
+GRAPH_PRECOMPUTE = 'graph.precompute'
+
+# Nodes loaded and rendered at a time by bulk QR jobs
+QRCODE_BATCH_SIZE = 1000
+
+
+@task(NODE_QRCODE)
+def generate_node_qrcode(node_id):
+    generated, _ = generate_qrcodes(list(Nodes.objects.filter(node_id=node_id)))
+    return {'generated': generated}
+
+
+@task(NODE_QRCODES)
+def generate_node_qrcodes(node_ids, force=False, format=None):
+    """QR codes of many nodes, e.g. after the payload format changed."""
+    generated = skipped = 0
+    for start in range(0, len(node_ids), QRCODE_BATCH_SIZE):
+        nodes = list(Nodes.objects.filter(node_id__in=node_ids[start:start + QRCODE_BATCH_SIZE]))
+        counts = generate_qrcodes(nodes, format=format, force=force)
+        generated += counts[0]
+        skipped += counts[1]
+    return {'generated': generated, 'skipped': skipped}
+
+
+@task(NODE_IMAGE360)
+def process_node_image(node_id):
+    """Tile pyramid and derivatives of a node's 360° image."""
+    node = Nodes.objects.filter(node_id=node_id).first()
+    if node is None:
+        return {'changed': False}
+    changed = tiles_enabled() and ensure_panorama_tiles(node)
+    if derivatives_enabled() and ensure_derivatives(node, 'image360', 'image360_derivatives'):
+        changed = True
+    if changed:
+        bump_version(NODES)
+    return {'changed': changed}
+
+
+@task(CAMPUS_MAP_BLUEPRINT)
+def process_blueprint(map_id):
+    """Deep-zoom tiles and derivatives of a campus map's blueprint."""
+    campus_map = CampusMap.objects.filter(map_id=map_id).first()
+    if campus_map is None:
+        return {'changed': False}
+    changed = blueprint_tiles.tiles_enabled() and blueprint_tiles.ensure_blueprint_tiles(campus_map)
+    if derivatives_enabled() and ensure_derivatives(campus_map, 'blueprint_image', 'blueprint_derivatives'):
+        changed = True
+    if changed:
+        bump_version(CAMPUS_MAP)
+    return {'changed': changed}
+
+
+@task(GRAPH_PRECOMPUTE)
+def precompute_graph():
+    """Warm the shared cache with the overview graph tiles of the current version."""
+    return {'tiles': precompute_tiles()}
@@ -0,0 +1,1436 @@
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from . import jobs
+from .models import Nodes, Edges, Annotation, CampusMap, Job, UploadSession
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'rec-tests'}}
+
+
+class TempMediaTestCase(TestCase):
+    """
+    Keeps files written by model saves (QR codes, uploads) out of MEDIA_ROOT,
+    and cache entries out of the shared cache.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp()
+        cls._media_override = override_settings(
+            MEDIA_ROOT=cls._media_root,
+            CACHES=TEST_CACHES,
+        )
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+
+def create_graph():
+    """Small two-floor graph used by the API tests."""
+    lobby = Nodes.objects.create(node_code='T-LOBBY', name='Lobby', building='Tower',
+                                 floor_level=1, type_of_node='entrance', map_x=10.0, map_y=10.0)
+    hall = Nodes.objects.create(node_code='T-HALL', name='Hallway', building='Tower',
+                                floor_level=1, type_of_node='hallway', map_x=20.0, map_y=10.0)
+    room = Nodes.objects.create(node_code='T-201', name='Room 201', building='Tower',
+                                floor_level=2, type_of_node='room', map_x=20.0, map_y=30.0)
+    Edges.objects.create(from_node=lobby, to_node=hall, distance=10.0, compass_angle=90.0)
+    Edges.objects.create(from_node=hall, to_node=room, distance=6.0, compass_angle=180.0,
+                         is_staircase=True)
+    Annotation.objects.create(panorama=lobby, target_node=hall, label='To hallway', yaw=90.0, pitch=0.0)
+    return lobby, hall, room
+
+
+class ConditionalGetTests(TempMediaTestCase):
+    read_urls = (
+        'api_mobile_nodes_list',
+        'api_mobile_edges_list',
+        'api_mobile_annotations_list',
+        'api_mobile_campus_map',
+        'api_graph_data',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def test_responses_carry_validators(self):
+        for name in self.read_urls:
+            response = self.client.get(reverse(name))
+            self.assertTrue(response['ETag'].startswith('"'), name)
+            self.assertIn('Last-Modified', response, name)
+
+    def test_matching_etag_returns_304_without_queries(self):
+        for name in self.read_urls:
+            etag = self.client.get(reverse(name))['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, name)
+
+    def test_write_invalidates_etag(self):
+        url = reverse('api_graph_data')
+        etag = self.client.get(url)['ETag']
+        self.hall.name = 'Main Hallway'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hall.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_query_string(self):
+        url = reverse('api_mobile_nodes_list')
+        self.assertNotEqual(self.client.get(url)['ETag'],
+                            self.client.get(url, {'floor': 2})['ETag'])
+
+
+class PaginationTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_graph()
+
+    def test_cursor_walks_full_ordered_list(self):
+        url = reverse('api_mobile_nodes_list')
+        expected = [n['node_id'] for n in self.client.get(url).json()['nodes']]
+        seen, params = [], {'limit': 2}
+        while True:
+            body = self.client.get(url, params).json()
+            seen.extend(n['node_id'] for n in body['nodes'])
+            if body['next'] is None:
+                break
+            params['cursor'] = body['next']
+        self.assertEqual(seen, expected)
+
+    def test_sparse_fieldset(self):
+        body = self.client.get(reverse('api_mobile_edges_list'),
+                               {'fields': 'edge_id,distance', 'limit': 1}).json()
+        self.assertEqual(list(body['edges'][0]), ['edge_id', 'distance'])
+        self.assertIsNotNone(body['next'])
+
+    def test_invalid_parameters(self):
+        url = reverse('api_mobile_nodes_list')
+        self.assertEqual(self.client.get(url, {'fields': 'bogus'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': '!!'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+
+
+class StreamingTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        lobby, hall, room = create_graph()
+        Nodes.objects.create(node_code='T-CAFE', name='Café "Annex"', building='Tower', floor_level=1)
+
+    def test_streamed_output_matches_buffered(self):
+        for name in ('api_graph_data', 'api_mobile_nodes_list', 'api_mobile_edges_list',
+                     'api_mobile_annotations_list'):
+            buffered = self.client.get(reverse(name))
+            streamed = self.client.get(reverse(name), {'stream': 1})
+            self.assertTrue(streamed.streaming, name)
+            self.assertEqual(b''.join(streamed.streaming_content), buffered.content, name)
+
+
+class ResponseCacheTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def test_warm_request_runs_no_queries(self):
+        url = reverse('api_graph_data')
+        cold = self.client.get(url)
+        with self.assertNumQueries(0):
+            warm = self.client.get(url)
+        self.assertEqual(warm.content, cold.content)
+
+    def test_gzip_variant(self):
+        import gzip
+        url = reverse('api_mobile_nodes_list')
+        plain = self.client.get(url)
+        compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertTrue(compressed['ETag'].startswith('W/'))
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=compressed['ETag']).status_code, 304)
+
+    def test_invalidated_by_graph_change(self):
+        url = reverse('api_graph_data')
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Edges.objects.filter(from_node=self.lobby).get().delete()
+        self.assertEqual(len(self.client.get(url).json()['edges']), 1)
+
+
+class BatchTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def batch(self, requests):
+        return self.client.post(reverse('api_mobile_batch'), json.dumps({'requests': requests}),
+                                content_type='application/json')
+
+    def test_runs_sub_requests_in_order(self):
+        response = self.batch([
+            {'id': 'node', 'path': reverse('api_mobile_node_detail', args=[self.lobby.node_id])},
+            {'id': 'annotations', 'path': reverse('api_mobile_annotations_list') + f'?panorama_id={self.lobby.node_id}'},
+            {'id': 'route', 'method': 'POST', 'path': reverse('api_mobile_find_path'),
+             'body': {'start_code': 'T-LOBBY', 'goal_code': 'T-201'}},
+        ])
+        results = response.json()['responses']
+        self.assertEqual([r['id'] for r in results], ['node', 'annotations', 'route'])
+        self.assertEqual([r['status'] for r in results], [200, 200, 200])
+        self.assertEqual(results[0]['body']['node']['node_code'], 'T-LOBBY')
+        self.assertEqual(results[1]['body']['count'], 1)
+        self.assertEqual(results[2]['body']['num_nodes'], 3)
+
+    def test_batches_never_open_a_transaction(self):
+        from unittest import mock
+        from django.db import transaction
+        reads = [{'path': reverse('api_mobile_buildings_list')}]
+        with mock.patch.object(transaction, 'atomic', wraps=transaction.atomic) as atomic:
+            self.assertEqual(self.batch(reads).json()['responses'][0]['status'], 200)
+            # find-path is a POST but only reads; an unsupported method is just refused
+            results = self.batch(reads + [
+                {'method': 'POST', 'path': reverse('api_mobile_find_path'),
+                 'body': {'start_code': 'T-LOBBY', 'goal_code': 'T-201'}},
+                {'method': 'PATCH', 'path': reverse('api_mobile_buildings_list')},
+            ]).json()['responses']
+            self.assertEqual([r['status'] for r in results[:2]], [200, 200])
+            atomic.assert_not_called()
+
+    def test_rejects_non_read_endpoints_and_oversized_batches(self):
+        path = reverse('api_mobile_node_delete', args=[self.lobby.node_id])
+        result = self.batch([{'method': 'DELETE', 'path': path}]).json()['responses'][0]
+        self.assertEqual(result['status'], 404)
+        self.assertTrue(Nodes.objects.filter(pk=self.lobby.pk).exists())
+        too_many = [{'path': reverse('api_mobile_buildings_list')}] * 21
+        self.assertEqual(self.batch(too_many).status_code, 400)
+
+
+class SearchTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_graph()
+        Nodes.objects.create(node_code='LIB-1', name='University Library', building='Library Hall', floor_level=1)
+
+    def search(self, q):
+        return [r['node_code'] for r in self.client.get(reverse('api_mobile_search'), {'q': q}).json()['results']]
+
+    def test_prefix_and_ranking(self):
+        self.assertEqual(self.search('lib')[0], 'LIB-1')
+        self.assertEqual(self.search('room 2'), ['T-201'])
+        self.assertEqual(self.search('t-201')[0], 'T-201')
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.search('libary'), ['LIB-1'])
+        self.assertEqual(self.search('hallwya')[0], 'T-HALL')
+
+    def test_unicode_names(self):
+        Nodes.objects.create(node_code='CAF-2', name='Café Größe', building='Mensa', floor_level=0)
+        Nodes.objects.create(node_code='KOR-1', name='강의실 101', building='Mensa', floor_level=0)
+        self.assertEqual(self.search('cafe'), ['CAF-2'])
+        self.assertEqual(self.search('CAFÉ'), ['CAF-2'])
+        self.assertEqual(self.search('grosse'), ['CAF-2'])
+        self.assertEqual(self.search('강의실'), ['KOR-1'])
+
+    def test_index_follows_node_changes(self):
+        self.assertEqual(self.search('cafeteria'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Nodes.objects.create(node_code='CAF-1', name='Cafeteria', building='Tower', floor_level=1)
+        self.assertEqual(self.search('cafe'), ['CAF-1'])
+
+
+class SpatialTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def test_endpoints(self):
+        nearest = self.client.get(reverse('api_mobile_spatial_nearest'), {'x': 12, 'y': 11, 'floor': 1, 'k': 2}).json()
+        self.assertEqual([n['node_code'] for n in nearest['nodes']], ['T-LOBBY', 'T-HALL'])
+        viewport = self.client.get(reverse('api_mobile_spatial_viewport'),
+                                   {'x0': 15, 'y0': 0, 'x1': 25, 'y1': 40, 'floor': 2}).json()
+        self.assertEqual([n['node_code'] for n in viewport['nodes']], ['T-201'])
+        snap = self.client.get(reverse('api_mobile_spatial_snap'), {'x': 15, 'y': 12, 'floor': 1}).json()
+        self.assertEqual(snap['point'], {'map_x': 15.0, 'map_y': 10.0})
+        self.assertEqual(snap['position'], 0.5)
+        self.assertEqual(self.client.get(reverse('api_mobile_spatial_snap'), {'x': 1, 'floor': 1}).status_code, 400)
+
+    def test_buildings_on_own_blueprints(self):
+        from .spatial import SpatialIndex
+        nodes = [(1, 'A-1', 'A1', 'Annex', 0, 'room', 10.0, 10.0), (2, 'A-2', 'A2', 'Annex', 0, 'room', 30.0, 10.0),
+                 (3, 'L-1', 'L1', 'Library', 0, 'room', 12.0, 11.0), (4, 'L-2', 'L2', 'Library', 0, 'room', 12.0, 40.0),
+                 (5, 'Q-1', 'Q1', 'Quad', 0, 'landmark', 50.0, 50.0)]
+        edges = [(1, 1, 2, 5.0, 90.0, False), (2, 3, 4, 8.0, 180.0, False), (3, 2, 3, 9.0, 0.0, False)]
+        # The library has a blueprint of its own, the others are on the campus map
+        frames = {'Library': (2, 0.5)}
+        index = SpatialIndex(nodes, edges, frames=lambda building, floor: frames.get(building, (1, 1.0)))
+        self.assertEqual(index.snap(12, 12, 0, building='Library')['edge']['edge_id'], 2)
+        # Without a building only the campus map's grids; the annex - library edge joins two frames
+        self.assertEqual(index.snap(12, 12, 0)['edge']['edge_id'], 1)
+        self.assertEqual([n['node_code'] for n in index.nearest(12, 11, 0, k=5)], ['A-1', 'A-2', 'Q-1'])
+        self.assertEqual([n['node_code'] for n in index.nearest(12, 11, 0, k=1, building='Library')], ['L-1'])
+        self.assertEqual([n['node_code'] for n in index.in_viewport(0, 0, 100, 100, 0, building='Library')],
+                         ['L-1', 'L-2'])
+        self.assertEqual(index.grids['Library', 0].aspect, 0.5)
+
+    def test_grid_matches_brute_force(self):
+        import math
+        import random
+        from .spatial import SpatialIndex
+        rng = random.Random(7)
+        points = [(i, f'N{i}', f'N{i}', 'B', 0, 'room', rng.uniform(0, 100), rng.uniform(0, 100))
+                  for i in range(300)]
+        index = SpatialIndex(points, [], aspect=1.5)
+        for _ in range(50):
+            x, y = rng.uniform(-5, 105), rng.uniform(-5, 105)
+            expected = sorted(points, key=lambda p: math.hypot((p[6] - x) * 1.5, p[7] - y))[:5]
+            found = index.nearest(x, y, floor=0, k=5)
+            self.assertEqual([n['node_id'] for n in found], [p[0] for p in expected])
+
+    def test_rejects_bad_coordinates(self):
+        for name in ('api_mobile_spatial_nearest', 'api_mobile_spatial_snap'):
+            for x in ('nan', 'inf', '-inf', '100.5', '-1', '40000'):
+                response = self.client.get(reverse(name), {'x': x, 'y': 10, 'floor': 1})
+                self.assertEqual(response.status_code, 400, (name, x))
+                self.assertFalse(response.json()['success'])
+        self.assertEqual(self.client.get(reverse('api_mobile_spatial_viewport'),
+                                         {'x0': 'nan', 'y0': 0, 'x1': 10, 'y1': 10, 'floor': 1}).status_code, 400)
+
+    def test_query_cost_is_bounded_by_the_grid(self):
+        import time
+        from .spatial import SpatialIndex
+        nodes = [(1, 'N-1', 'N1', 'B', 0, 'room', 10.0, 10.0), (2, 'N-2', 'N2', 'B', 0, 'room', 20.0, 10.0)]
+        index = SpatialIndex(nodes, [(1, 1, 2, 10.0, 90.0, False)])
+        started = time.monotonic()
+        for x in (4e4, 1e9, -1e9):
+            self.assertEqual([n['node_code'] for n in index.nearest(x, 10, floor=0, k=1)],
+                             ['N-2' if x > 0 else 'N-1'])
+            self.assertEqual(index.snap(x, 10, floor=0)['edge']['edge_id'], 1)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class GraphTileTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def tile(self, z, x, y, **params):
+        return self.client.get(reverse('api_graph_tile', args=[z, x, y]), params)
+
+    def test_tile_is_clipped_to_viewport_and_floor(self):
+        tile = self.tile(2, 0, 0, floor=1).json()
+        codes = [row[1] for row in tile['nodes']['rows']]
+        self.assertEqual(codes, ['T-LOBBY', 'T-HALL'])
+        self.assertEqual(len(tile['edges']['rows']), 1)
+        self.assertEqual(self.tile(2, 3, 3, floor=1).json()['nodes']['rows'], [])
+
+    def test_low_zoom_keeps_only_landmarks(self):
+        tile = self.tile(0, 0, 0).json()
+        self.assertEqual(tile['lod'], 'landmarks')
+        self.assertEqual([row[1] for row in tile['nodes']['rows']], ['T-LOBBY'])
+        self.assertEqual(tile['edges']['rows'], [])
+        Nodes.objects.create(node_code='T-STAIRS', name='Stairs', building='Tower', floor_level=1,
+                             type_of_node='staircase', map_x=30.0, map_y=10.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Nodes.objects.create(node_code='T-CAFE', name='Cafe', building='Tower', floor_level=1,
+                                 type_of_node='cafe', map_x=40.0, map_y=10.0)
+        self.assertEqual([row[1] for row in self.tile(0, 0, 0).json()['nodes']['rows']], ['T-LOBBY', 'T-STAIRS'])
+        with self.settings(REC_TILE_LANDMARK_TYPES=['cafe']):
+            self.assertEqual([row[1] for row in self.tile(1, 0, 0).json()['nodes']['rows']], ['T-CAFE'])
+
+    def test_out_of_range(self):
+        self.assertEqual(self.tile(1, 2, 0).status_code, 404)
+
+
+class AnnotationIndexTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+        Annotation.objects.create(panorama=cls.lobby, label='Behind', yaw=175.0, pitch=0.0,
+                                  visible_radius=10.0)
+        Annotation.objects.create(panorama=cls.lobby, label='Ceiling', yaw=-90.0, pitch=80.0,
+                                  visible_radius=5.0)
+
+    def visible(self, **params):
+        response = self.client.get(reverse('api_mobile_annotations_visible', args=[self.lobby.node_id]), params)
+        return [a['label'] for a in response.json()['annotations']]
+
+    def test_viewport_query(self):
+        self.assertEqual(self.visible(yaw=90, hfov=60), ['To hallway'])
+        # Window crossing +-180 degrees
+        self.assertEqual(self.visible(yaw=-170, hfov=20), ['Behind'])
+        # Looking up, every yaw is on screen
+        self.assertEqual(self.visible(yaw=90, pitch=70, vfov=60), ['Ceiling'])
+        self.assertEqual(self.visible(yaw=0, hfov=30), [])
+        # Looking up, yaw spreads towards the top corners
+        self.assertEqual(self.visible(yaw=0, pitch=55, hfov=90, vfov=40), ['Ceiling'])
+        response = self.client.get(reverse('api_mobile_annotations_visible', args=[self.lobby.node_id]),
+                                   {'pitch': 120})
+        self.assertEqual(response.status_code, 400)
+
+    def test_matches_brute_force(self):
+        import random
+        from .annotation_index import PanoramaAnnotations, wrap_yaw, yaw_scale
+        rng = random.Random(3)
+        items = [{'id': i, 'yaw': rng.uniform(-180, 180), 'pitch': rng.uniform(-60, 60),
+                  'visible_radius': rng.uniform(2, 20)} for i in range(200)]
+        panorama = PanoramaAnnotations(list(items))
+        for _ in range(100):
+            yaw, pitch = rng.uniform(-180, 180), rng.uniform(-40, 40)
+            hfov, vfov = rng.uniform(30, 120), rng.uniform(30, 90)
+            yaw_half = min(hfov / 2 * yaw_scale(max(abs(pitch + vfov / 2), abs(pitch - vfov / 2))), 180)
+            expected = {a['id'] for a in items
+                        if abs(wrap_yaw(a['yaw'] - yaw)) <= yaw_half + a['visible_radius'] * yaw_scale(a['pitch'])
+                        and abs(a['pitch'] - pitch) <= vfov / 2 + a['visible_radius']}
+            self.assertEqual({a['id'] for a in panorama.visible(yaw, pitch, hfov, vfov)}, expected)
+
+    def test_route_prefetch(self):
+        response = self.client.get(reverse('api_mobile_annotations_prefetch'),
+                                   {'start_code': 'T-LOBBY', 'goal_code': 'T-201'})
+        data = response.json()
+        self.assertEqual(data['node_ids'], [self.lobby.node_id, self.hall.node_id, self.room.node_id])
+        self.assertEqual(len(data['panoramas'][str(self.lobby.node_id)]), 3)
+        self.assertEqual(data['panoramas'][str(self.hall.node_id)], [])
+        response = self.client.get(reverse('api_mobile_annotations_prefetch'), {'node_ids': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class NodeBundleTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def bundle(self, node_id, **headers):
+        return self.client.get(reverse('api_mobile_node_bundle', args=[node_id]), **headers)
+
+    def test_bundle_contents(self):
+        data = self.bundle(self.hall.node_id).json()
+        self.assertEqual(data['node']['node_code'], 'T-HALL')
+        self.assertEqual(data['annotations'], [])
+        neighbors = {n['node_code']: n for n in data['neighbors']}
+        # Reverse direction of the lobby -> hall edge
+        self.assertEqual(neighbors['T-LOBBY']['compass_angle'], 270.0)
+        self.assertTrue(neighbors['T-201']['is_staircase'])
+        self.assertEqual(data['prefetch'], [])
+        self.assertEqual(self.bundle(self.lobby.node_id).json()['annotations'][0]['label'], 'To hallway')
+        self.assertEqual(self.bundle(999999).status_code, 404)
+
+    def test_cached_until_graph_changes(self):
+        self.bundle(self.lobby.node_id)
+        with self.assertNumQueries(0):
+            self.bundle(self.lobby.node_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            Edges.objects.filter(from_node=self.lobby).first().delete()
+        self.assertEqual(self.bundle(self.lobby.node_id).json()['neighbors'], [])
+
+
+def equirect_image(width=512, height=256, name='pano.png'):
+    """Panorama colored by direction: red front, green right, blue back, yellow left, white sky."""
+    from io import BytesIO
+    from PIL import Image
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    image = Image.new('RGB', (width, height))
+    quarter = width // 4
+    colors = ((0, 0, 255), (255, 255, 0), (255, 0, 0), (0, 255, 0), (0, 0, 255))
+    for i, color in enumerate(colors):
+        # Quarters centered on yaw -180, -90, 0, 90, 180
+        image.paste(color, (max(i * quarter - quarter // 2, 0), 0, min(i * quarter + quarter // 2, width), height))
+    image.paste((255, 255, 255), (0, 0, width, height // 8))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class PanoramaTileTests(TempMediaTestCase):
+
+    @override_settings(REC_PANORAMA_TILES=False)
+    def test_cube_faces_and_pyramid(self):
+        from django.core.files.storage import default_storage
+        from PIL import Image
+        from .panorama_tiles import generate_panorama_tiles
+        node = Nodes.objects.create(node_code='P-1', name='Pano', building='B', floor_level=1,
+                                    image360=equirect_image())
+        manifest = generate_panorama_tiles(node.image360, tile_size=32)
+        self.assertEqual((manifest['cube_resolution'], manifest['max_level']), (128, 3))
+        expected = {'f': (255, 0, 0), 'r': (0, 255, 0), 'b': (0, 0, 255), 'l': (255, 255, 0), 'u': (255, 255, 255)}
+        for face, color in expected.items():
+            # Tile (1, 1) of level 2 touches the face centre
+            with default_storage.open(f"{manifest['base']}/2/{face}1_1.jpg") as f:
+                pixel = Image.open(f).convert('RGB').getpixel((2, 2))
+            self.assertTrue(all(abs(p - c) < 40 for p, c in zip(pixel, color)), (face, pixel))
+        self.assertTrue(default_storage.exists(f"{manifest['base']}/3/d3_3.jpg"))
+        self.assertFalse(default_storage.exists(f"{manifest['base']}/3/d4_0.jpg"))
+
+    def test_manifest_generated_on_save_and_exposed(self):
+        node = Nodes.objects.create(node_code='P-2', name='Pano', building='B', floor_level=1,
+                                    image360=equirect_image())
+        jobs.run_pending()
+        node.refresh_from_db()
+        self.assertEqual(node.image360_tiles['source'], node.image360.name)
+        tiles = self.client.get(reverse('api_mobile_node_detail', args=[node.node_id])).json()['node']['image360_tiles']
+        self.assertEqual(tiles['type'], 'multires')
+        self.assertTrue(tiles['base_url'].startswith('http://testserver/media/360_tiles/'))
+        # Same content uploaded again reuses the pyramid
+        other = Nodes.objects.create(node_code='P-3', name='Pano', building='B', floor_level=1,
+                                     image360=equirect_image())
+        jobs.run_pending()
+        other.refresh_from_db()
+        self.assertEqual(other.image360_tiles['base'], node.image360_tiles['base'])
+        node.image360 = None
+        node.save()
+        jobs.run_pending()
+        node.refresh_from_db()
+        self.assertIsNone(node.image360_tiles)
+
+
+class DerivativeTests(TempMediaTestCase):
+
+    def test_blurhash_layout(self):
+        from PIL import Image
+        from .derivatives import blurhash, _base83
+        value = blurhash(Image.new('RGB', (64, 32), (255, 0, 0)))
+        # Size flag for 4x3 components, max AC, average color, 11 AC components
+        self.assertEqual(len(value), 1 + 1 + 4 + 11 * 2)
+        self.assertEqual(value[0], 'L')
+        self.assertEqual(value[2:6], _base83(0xFF0000, 4))
+
+    def test_generated_on_save_and_listed(self):
+        from django.core.files.storage import default_storage
+        node = Nodes.objects.create(node_code='P-1', name='Pano', building='B', floor_level=1,
+                                    image360=equirect_image(640, 320))
+        jobs.run_pending()
+        node.refresh_from_db()
+        manifest = node.image360_derivatives
+        self.assertEqual(manifest['sizes']['thumb']['width'], 320)
+        # Never upscaled
+        self.assertEqual(manifest['sizes']['medium']['width'], 640)
+        self.assertTrue(default_storage.exists(manifest['sizes']['thumb']['webp']))
+        self.assertEqual(node.image360_thumbnail_url, default_storage.url(manifest['sizes']['thumb']['jpg']))
+
+        listed = self.client.get(reverse('api_mobile_nodes_list')).json()['nodes'][0]['image360_derivatives']
+        self.assertTrue(listed['thumb']['webp_url'].startswith('http://testserver/media/derivatives/'))
+        self.assertEqual(listed['placeholder'], manifest['placeholder'])
+        detail = self.client.get(reverse('api_mobile_node_detail', args=[node.node_id])).json()['node']
+        self.assertEqual(detail['image360_derivatives'], listed)
+        details = self.client.get(reverse('api_node_details', args=[node.node_id])).json()
+        self.assertEqual(details['image360_derivatives'], listed)
+
+
+def blueprint_image(width=600, height=300, name='plan.png'):
+    from io import BytesIO
+    from PIL import Image
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    buffer = BytesIO()
+    Image.new('RGBA', (width, height), (0, 0, 0, 0)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class BlueprintTileTests(TempMediaTestCase):
+
+    def test_pyramid_manifest_and_tile_serving(self):
+        from PIL import Image
+        from io import BytesIO
+        CampusMap.objects.create(name='Campus', blueprint_image=blueprint_image())
+        jobs.run_pending()
+        data = self.client.get(reverse('api_mobile_campus_map')).json()['map']
+        tiles = data['tiles']
+        self.assertEqual((tiles['width'], tiles['height'], tiles['max_level']), (600, 300, 10))
+        self.assertTrue(tiles['tile_url_template'].endswith('/{z}/{x}_{y}.jpg'))
+
+        response = self.client.get(tiles['tiles_url'] + '10/1_0.jpg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        tile = Image.open(BytesIO(b''.join(response.streaming_content)))
+        # 254px plus one pixel of overlap on each side, clipped at the top edge
+        self.assertEqual(tile.size, (256, 255))
+        # Transparency is flattened onto white
+        self.assertGreater(min(tile.convert('L').getextrema()), 240)
+        self.assertEqual(self.client.get(tiles['tiles_url'] + '0/0_0.jpg').status_code, 200)
+        self.assertEqual(self.client.get(tiles['tiles_url'] + '10/9_9.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/api/map-tiles/nothex/0/0_0.jpg').status_code, 404)
+        self.assertContains(self.client.get(reverse('map_viewer')), 'id="blueprintTiles"')
+
+    @override_settings(REC_MAP_TILES=False, REC_IMAGE_DERIVATIVES=False)
+    def test_per_building_maps(self):
+        campus = CampusMap.objects.create(name='Campus', blueprint_image=blueprint_image())
+        tower = CampusMap.objects.create(name='Tower', building='Tower', blueprint_image=blueprint_image())
+        tower_2 = CampusMap.objects.create(name='Tower 2F', building='Tower', floor_level=2,
+                                           blueprint_image=blueprint_image())
+        # Maps of other scopes stay active
+        self.assertEqual(CampusMap.objects.filter(is_active=True).count(), 3)
+        url = reverse('api_mobile_campus_map')
+        for params, expected in (({}, campus), ({'building': 'Tower'}, tower),
+                                 ({'building': 'Tower', 'floor': 2}, tower_2),
+                                 ({'building': 'Tower', 'floor': 3}, tower),
+                                 ({'building': 'Annex'}, campus)):
+            self.assertEqual(self.client.get(url, params).json()['map']['map_id'], expected.map_id, params)
+        self.assertEqual(self.client.get(url, {'floor': 'x'}).status_code, 400)
+
+
+class ChunkedUploadTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+        cls.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def setUp(self):
+        from unittest import mock
+        super().setUp()
+        self.client.force_login(self.admin)
+        self.staging = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging, ignore_errors=True)
+        settings_override = override_settings(REC_UPLOAD_DIR=self.staging, REC_PANORAMA_TILES=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch('rec.uploads.MIN_CHUNK_SIZE', 1024)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def initiate(self, content, **extra):
+        return self.client.post(reverse('api_mobile_upload_initiate'), json.dumps({
+            'node_id': self.hall.node_id, 'filename': 'hall.png', 'size': len(content),
+            'chunk_size': 1024, **extra
+        }), content_type='application/json')
+
+    def put_part(self, upload_id, index, content):
+        return self.client.put(reverse('api_mobile_upload_part', args=[upload_id, index]),
+                               content, content_type='application/octet-stream')
+
+    def test_resumable_upload_attaches_image(self):
+        import hashlib
+        import random
+        from io import BytesIO
+        from PIL import Image
+        buffer = BytesIO()
+        rng = random.Random(1)
+        noise = bytes(rng.getrandbits(8) for _ in range(256 * 128 * 3))
+        Image.frombytes('RGB', (256, 128), noise).save(buffer, format='PNG')
+        content = buffer.getvalue()
+        parts = [content[i:i + 16384] for i in range(0, len(content), 16384)]
+        upload = self.initiate(content, chunk_size=16384, checksum=hashlib.sha256(content).hexdigest()).json()
+        upload_id = upload['upload_id']
+        self.assertEqual(upload['parts'], len(parts))
+
+        self.assertEqual(self.put_part(upload_id, 1, parts[1]).status_code, 409)
+        first = self.put_part(upload_id, 0, parts[0]).json()
+        # Dimensions are known after the first part
+        self.assertEqual((first['width'], first['height']), (256, 128))
+        self.assertFalse(self.put_part(upload_id, 0, parts[0]).json()['stored'])
+        response = self.client.post(reverse('api_mobile_upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 409)
+
+        detail = self.client.get(reverse('api_mobile_upload_detail', args=[upload_id])).json()
+        for index in range(detail['next_part'], len(parts)):
+            self.assertTrue(self.put_part(upload_id, index, parts[index]).json()['stored'])
+        response = self.client.post(reverse('api_mobile_upload_complete', args=[upload_id]))
+        self.assertEqual(response.json()['status'], 'completed')
+
+        self.hall.refresh_from_db()
+        with self.hall.image360.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_rejects_non_panorama_after_first_part(self):
+        from io import BytesIO
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (300, 300)).save(buffer, format='PNG')
+        content = buffer.getvalue() + b'\0' * 4096
+        upload_id = self.initiate(content).json()['upload_id']
+        response = self.put_part(upload_id, 0, content[:1024])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(os.listdir(self.staging), [])
+        self.assertEqual(self.put_part(upload_id, 1, content[1024:2048]).status_code, 409)
+
+    def test_part_is_streamed_outside_the_session_lock(self):
+        from unittest import mock
+        upload_id = self.initiate(b'\0' * 4096).json()['upload_id']
+        leases = []
+
+        def stream(path, start, body, length, index):
+            # The session is leased, not locked: a second request is turned away right away
+            leases.append(UploadSession.objects.get(upload_id=upload_id).lease)
+            self.assertEqual(self.put_part(upload_id, 0, b'\0' * 1024).status_code, 409)
+            with open(path, 'wb') as f:
+                f.write(body.read(length))
+
+        with mock.patch('rec.uploads._stream', side_effect=stream):
+            response = self.put_part(upload_id, 0, b'\0' * 1024)
+        self.assertTrue(leases[0])
+        session = UploadSession.objects.get(upload_id=upload_id)
+        self.assertEqual((session.received_size, session.lease, session.leased_until), (1024, '', None))
+        self.assertEqual(response.status_code, 200)
+
+        # A request whose expired lease was taken over does not record its part
+        def taken_over(*args):
+            UploadSession.objects.filter(upload_id=upload_id).update(lease='b' * 32)
+
+        with mock.patch('rec.uploads._stream', side_effect=taken_over):
+            self.assertEqual(self.put_part(upload_id, 1, b'\0' * 1024).status_code, 409)
+        self.assertEqual(UploadSession.objects.get(upload_id=upload_id).received_size, 1024)
+
+    def test_gc_media_expires_stale_uploads(self):
+        from datetime import timedelta
+        from django.core.management import call_command
+        from django.utils import timezone
+        from io import StringIO
+        stale = self.initiate(b'\0' * 4096).json()['upload_id']
+        fresh = self.initiate(b'\0' * 4096).json()['upload_id']
+        for upload_id in (stale, fresh):
+            with open(os.path.join(self.staging, f'{uuid.UUID(upload_id).hex}.part'), 'wb') as f:
+                f.write(b'\0' * 1024)
+        UploadSession.objects.filter(upload_id=stale).update(updated_at=timezone.now() - timedelta(days=2))
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(os.path.join(self.staging, f'{uuid.UUID(stale).hex}.part'), (old, old))
+
+        call_command('gc_media', '--dry-run', stdout=StringIO())
+        self.assertEqual(UploadSession.objects.count(), 2)
+        call_command('gc_media', stdout=StringIO())
+        self.assertEqual([str(upload_id) for upload_id in UploadSession.objects.values_list('upload_id', flat=True)],
+                         [fresh])
+        self.assertEqual(os.listdir(self.staging), [f'{uuid.UUID(fresh).hex}.part'])
+
+
+class JobQueueTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+        cls.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+
+    def test_saving_a_node_queues_its_qr_code_once(self):
+        node = Nodes.objects.create(node_code='Q-1', name='Quad', building='B', floor_level=1)
+        self.assertFalse(node.qrcode)
+        node.name = 'Quadrangle'
+        node.save()
+        queued = Job.objects.filter(name='nodes.qrcode', status=Job.STATUS_QUEUED)
+        self.assertEqual(queued.count(), 1)
+        self.assertEqual(queued.get().priority, jobs.PRIORITY_HIGH)
+
+        self.assertGreaterEqual(jobs.run_pending(), 1)
+        node.refresh_from_db()
+        self.assertRegex(node.qrcode.name, r'^qrcodes/[0-9a-f]{64}\.png$')
+        self.assertEqual(queued.count(), 0)
+        # Graph precomputation waits for further edits
+        self.assertTrue(Job.objects.filter(name='graph.precompute', status=Job.STATUS_QUEUED).exists())
+
+    def test_priority_retry_and_failure(self):
+        from datetime import timedelta
+        from unittest import mock
+        from django.utils import timezone
+        calls = []
+        with mock.patch.dict(jobs.TASKS, {'test.flaky': lambda n: calls.append(n) or 1 / 0,
+                                          'test.ok': lambda n: calls.append(n) or {'n': n}}):
+            flaky = jobs.enqueue('test.flaky', {'n': 1}, max_attempts=2)
+            jobs.enqueue('test.ok', {'n': 2}, priority=jobs.PRIORITY_HIGH)
+            with self.assertLogs('rec.jobs', 'ERROR'):
+                self.assertEqual(jobs.run_pending(), 2)
+            self.assertEqual(calls, [2, 1])
+
+            flaky.refresh_from_db()
+            self.assertEqual((flaky.status, flaky.attempts), (Job.STATUS_QUEUED, 1))
+            self.assertGreater(flaky.run_after, timezone.now())
+            self.assertIn('ZeroDivisionError', flaky.last_error)
+            Job.objects.filter(pk=flaky.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+            with self.assertLogs('rec.jobs', 'ERROR'):
+                jobs.run_pending()
+            flaky.refresh_from_db()
+            self.assertEqual(flaky.status, Job.STATUS_FAILED)
+            self.assertEqual(Job.objects.get(name='test.ok').result, {'n': 2})
+
+            # Jobs of a dead worker are put back
+            stale = jobs.enqueue('test.ok', {'n': 3})
+            jobs.claim('gone', job_id=stale.pk)
+            Job.objects.filter(pk=stale.pk).update(started_at=timezone.now() - timedelta(hours=1))
+            self.assertEqual(jobs.requeue_stale(), 1)
+            self.assertEqual(Job.objects.get(pk=stale.pk).status, Job.STATUS_QUEUED)
+
+        with self.assertRaises(ValueError):
+            jobs.enqueue('test.unknown')
+
+    def test_run_jobs_purges_finished_jobs(self):
+        from datetime import timedelta
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from django.utils import timezone
+        with mock.patch.dict(jobs.TASKS, {'test.ok': lambda n: n}):
+            old, recent, queued = (jobs.enqueue('test.ok', {'n': n}) for n in range(3))
+            for job in (old, recent):
+                jobs.run(jobs.claim(job_id=job.pk))
+            Job.objects.filter(pk=old.pk).update(finished_at=timezone.now() - timedelta(days=8))
+            Job.objects.filter(pk=queued.pk).update(created_at=timezone.now() - timedelta(days=8))
+
+            with mock.patch('rec.jobs.PURGE_BATCH_SIZE', 1), override_settings(REC_JOB_RETENTION=None):
+                self.assertEqual(jobs.purge_finished(), 0)
+            out = StringIO()
+            call_command('run_jobs', '--burst', stdout=out)
+        self.assertIn('Purged 1 finished job(s)', out.getvalue())
+        self.assertEqual(set(Job.objects.filter(name='test.ok').values_list('pk', flat=True)),
+                         {recent.pk, queued.pk})
+
+    def test_graph_precompute_fills_tile_cache(self):
+        from django.core.cache import cache
+        from .tasks import precompute_graph
+        from .tiles import TILE_TABLES
+        from .versioning import combined_version
+        create_graph()
+        self.assertEqual(precompute_graph(), {'tiles': (1 + 4 + 16) * 3})
+        self.assertIsNotNone(cache.get(f'rec:tile:{combined_version(*TILE_TABLES)}:2/0/0:2:'))
+        response = self.client.get(reverse('api_graph_tile', args=[0, 0, 0]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_status_api(self):
+        from unittest import mock
+        Nodes.objects.create(node_code='Q-1', name='Quad', building='B', floor_level=1)
+        url = reverse('api_mobile_jobs_status')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.admin)
+        data = self.client.get(url, {'name': 'nodes.qrcode'}).json()
+        self.assertEqual(data['counts']['queued'], 2)
+        self.assertEqual([job['name'] for job in data['jobs']], ['nodes.qrcode'])
+        self.assertEqual(self.client.get(url, {'limit': 0}).status_code, 400)
+
+        with mock.patch.dict(jobs.TASKS, {'test.broken': lambda: 1 / 0}):
+            job = jobs.enqueue('test.broken', max_attempts=1)
+            with self.assertLogs('rec.jobs', 'ERROR'):
+                jobs.run(jobs.claim(job_id=job.pk))
+            detail = self.client.get(reverse('api_mobile_job_detail', args=[job.pk])).json()['job']
+            self.assertEqual(detail['status'], 'failed')
+            self.assertEqual(detail['error'], 'ZeroDivisionError: division by zero')
+            retry_url = reverse('api_mobile_job_retry', args=[job.pk])
+            self.assertEqual(self.client.post(retry_url).json()['job']['status'], 'queued')
+            self.assertEqual(self.client.post(retry_url).status_code, 409)
+        self.assertEqual(self.client.get(reverse('api_mobile_job_detail', args=[999])).status_code, 404)
+
+
+class QrCodeTests(TempMediaTestCase):
+
+    def test_bulk_generation_skips_current_codes(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.files.storage import default_storage
+        from django.core.management import call_command
+        lobby, hall, room = create_graph()
+        Nodes.objects.create(node_code='A-1', name='Annex', building='Annex', floor_level=1)
+
+        out = StringIO()
+        # A pool even for this small set
+        with mock.patch('rec.qrcodes.POOL_THRESHOLD', 2):
+            call_command('generate_qrcodes', '--building', 'Tower', '--processes', '2', stdout=out)
+        self.assertIn('3 QR code(s) generated as png, 0 up to date', out.getvalue())
+        hall.refresh_from_db()
+        self.assertRegex(hall.qrcode.name, r'^qrcodes/[0-9a-f]{64}\.png$')
+        png_name = hall.qrcode.name
+        self.assertTrue(default_storage.exists(hall.qrcode.name))
+        self.assertFalse(Nodes.objects.get(node_code='A-1').qrcode)
+
+        call_command('generate_qrcodes', '--building', 'Tower', stdout=out)
+        self.assertIn('0 QR code(s) generated as png, 3 up to date', out.getvalue())
+
+        # A new payload format re-renders and removes the old file
+        Nodes.objects.filter(pk=hall.pk).update(node_code='T-HALL-2')
+        with override_settings(REC_MEDIA_GC_GRACE=0):
+            call_command('generate_qrcodes', '--code', 'T-HALL-2', '--format', 'svg', stdout=out)
+        hall.refresh_from_db()
+        self.assertRegex(hall.qrcode.name, r'^qrcodes/[0-9a-f]{64}\.svg$')
+        with default_storage.open(hall.qrcode.name) as f:
+            self.assertTrue(f.read().startswith(b'<svg'))
+        self.assertFalse(default_storage.exists(png_name))
+
+    def test_payload_change_queues_regeneration(self):
+        node = Nodes.objects.create(node_code='Q-1', name='Quad', building='B', floor_level=1)
+        jobs.run_pending()
+        node.refresh_from_db()
+        first_hash = node.qrcode_hash
+        node.save()
+        self.assertFalse(Job.objects.filter(name='nodes.qrcode', status=Job.STATUS_QUEUED).exists())
+        node.name = 'Quadrangle'
+        node.save()
+        jobs.run_pending()
+        node.refresh_from_db()
+        self.assertNotEqual(node.qrcode_hash, first_hash)
+        self.assertTrue(node.qrcode.storage.exists(node.qrcode.name))
+
+
+@override_settings(REC_MEDIA_GC_GRACE=0)
+class ContentAddressedMediaTests(TempMediaTestCase):
+
+    def test_identical_uploads_share_one_file(self):
+        first = Nodes.objects.create(node_code='M-1', name='A', building='B', floor_level=1,
+                                     image360=equirect_image(name='first.png'))
+        second = Nodes.objects.create(node_code='M-2', name='A', building='B', floor_level=1,
+                                      image360=equirect_image(name='second.png'))
+        self.assertRegex(first.image360.name, r'^360_images/[0-9a-f]{64}\.png$')
+        self.assertEqual(first.image360.name, second.image360.name)
+        self.assertEqual(os.listdir(os.path.join(self._media_root, '360_images')), [os.path.basename(first.image360.name)])
+
+        # Still referenced by the second node
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(second.image360.storage.exists(second.image360.name))
+        # Replaced: nothing references it any more
+        name = second.image360.name
+        second.image360 = equirect_image(640, 320)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+        self.assertFalse(second.image360.storage.exists(name))
+        self.assertTrue(second.image360.storage.exists(second.image360.name))
+
+    def test_gc_media(self):
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from django.core.management import call_command
+        node = Nodes.objects.create(node_code='M-1', name='A', building='B', floor_level=1,
+                                    image360=equirect_image())
+        jobs.run_pending()
+        node.refresh_from_db()
+        storage = node.image360.storage
+        orphan = storage.save('360_images/old.jpg', ContentFile(b'old bytes'))
+        default_storage.save('360_tiles/0123456789abcdef0123/manifest.json', ContentFile(b'{}'))
+
+        out = StringIO()
+        call_command('gc_media', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1 file(s) and 1 generated set(s)', out.getvalue())
+        self.assertTrue(storage.exists(orphan))
+        call_command('gc_media', '--grace', '3600', stdout=out)
+        self.assertTrue(storage.exists(orphan))
+
+        call_command('gc_media', stdout=out)
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(os.path.exists(os.path.join(self._media_root, '360_tiles', '0123456789abcdef0123')))
+        # Referenced files and generated sets stay
+        self.assertTrue(storage.exists(node.image360.name))
+        self.assertTrue(storage.exists(node.qrcode.name))
+        self.assertTrue(default_storage.exists(node.image360_tiles['base'] + '/manifest.json'))
+        self.assertTrue(default_storage.exists(node.image360_derivatives['base'] + '/manifest.json'))
+
+
+class MediaServingTests(TempMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from django.core.files.base import ContentFile
+        from .storage import content_storage
+        self.content = bytes(range(256)) * 40
+        self.hashed = content_storage.save('360_images/pano.jpg', ContentFile(self.content))
+        os.makedirs(os.path.join(self._media_root, 'legacy'), exist_ok=True)
+        with open(os.path.join(self._media_root, 'legacy', 'old.jpg'), 'wb') as f:
+            f.write(self.content)
+
+    def test_full_and_conditional(self):
+        response = self.client.get('/media/' + self.hashed)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.client.get('/media/' + self.hashed, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        legacy = self.client.get('/media/legacy/old.jpg')
+        self.assertEqual(legacy['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.client.get('/media/legacy/old.jpg',
+                                         HTTP_IF_MODIFIED_SINCE=legacy['Last-Modified']).status_code, 304)
+        for missing in ('/media/legacy/none.jpg', '/media/legacy', '/media/../manage.py', '/media/360_images/.tmp-x'):
+            self.assertEqual(self.client.get(missing).status_code, 404, missing)
+
+    def test_ranges(self):
+        url = '/media/' + self.hashed
+        size = len(self.content)
+        response = self.client.get(url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{size}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        # Resume from an offset, and the last bytes
+        self.assertEqual(b''.join(self.client.get(url, HTTP_RANGE='bytes=10000-').streaming_content),
+                         self.content[10000:])
+        self.assertEqual(b''.join(self.client.get(url, HTTP_RANGE='bytes=-24').streaming_content),
+                         self.content[-24:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        # Multiple ranges and a stale If-Range get the whole file
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_sendfile_offload(self):
+        with override_settings(REC_MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get('/media/' + self.hashed)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.hashed)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with override_settings(REC_MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get('/media/legacy/old.jpg')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self._media_root, 'legacy', 'old.jpg'))
+
+
+class RoutePackTests(TempMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lobby, self.hall, self.room = create_graph()
+        for node in (self.lobby, self.hall):
+            node.image360 = equirect_image(640, 320)
+            node.save()
+        jobs.run_pending()
+        for node in (self.lobby, self.hall, self.room):
+            node.refresh_from_db()
+
+    def pack(self, **params):
+        response = self.client.get(reverse('api_mobile_route_pack'), params)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_route_zip(self):
+        from django.core.files.storage import default_storage
+        archive = self.pack(start_code='T-LOBBY', goal_code='T-201', size='thumb')
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual(manifest['node_ids'], [self.lobby.node_id, self.hall.node_id, self.room.node_id])
+        thumb = self.lobby.image360_derivatives['sizes']['thumb']['jpg']
+        # Both panoramas are identical, so their derivative is packed once
+        self.assertEqual([(f['kind'], f['name']) for f in manifest['files']], [
+            ('panorama', thumb), ('qrcode', self.lobby.qrcode.name),
+            ('qrcode', self.hall.qrcode.name), ('qrcode', self.room.qrcode.name)])
+        self.assertEqual(archive.namelist(), ['manifest.json'] + [f['name'] for f in manifest['files']])
+        with default_storage.open(thumb) as f:
+            self.assertEqual(archive.read(thumb), f.read())
+        self.assertEqual(archive.getinfo(thumb).compress_type, 0)
+        self.assertIsNone(archive.testzip())
+
+    def test_manifest_and_skip(self):
+        url = reverse('api_mobile_route_pack')
+        manifest = self.client.get(url, {'node_ids': f'{self.lobby.node_id}', 'size': 'original',
+                                         'manifest': '1'}).json()
+        self.assertEqual([f['name'] for f in manifest['files']], [self.lobby.image360.name, self.lobby.qrcode.name])
+        self.assertEqual(manifest['total_bytes'], sum(f['bytes'] for f in manifest['files']))
+
+        response = self.client.post(url, {'node_ids': [self.lobby.node_id], 'size': 'original',
+                                           'skip': [self.lobby.image360.name]}, content_type='application/json')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['manifest.json', self.lobby.qrcode.name])
+        self.assertEqual(json.loads(archive.read('manifest.json'))['skipped'], [self.lobby.image360.name])
+
+        self.assertEqual(self.client.get(url, {'node_ids': '1', 'size': 'huge'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start_code': 'T-LOBBY'}).status_code, 400)
+
+
+class BulkWriteTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+        cls.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        cls.lobby, cls.hall, cls.room = create_graph()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+        jobs.run_pending()
+        Job.objects.all().delete()
+
+    def bulk(self, changes):
+        return self.client.post(reverse('api_mobile_bulk_write'), changes, content_type='application/json')
+
+    def test_apply_batch(self):
+        from .versioning import get_version, NODES
+        version = get_version(NODES)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk({
+                'nodes': {
+                    'create': [{'node_code': 'T-301', 'name': 'Room 301', 'building': 'Tower', 'floor_level': '3'}],
+                    'update': [{'node_id': self.hall.node_id, 'map_x': 25, 'name': 'Main hallway'}],
+                    'delete': [self.lobby.node_id],
+                },
+                'edges': {'create': [{'from_node_code': 'T-201', 'to_node_code': 'T-301', 'distance': 5,
+                                      'compass_angle': 0, 'is_staircase': True}]},
+                'annotations': {'create': [{'panorama_code': 'T-301', 'target_node_id': self.room.node_id,
+                                            'label': 'Down', 'yaw': 10, 'pitch': -5}]},
+            })
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        new = Nodes.objects.get(node_code='T-301')
+        self.assertEqual(data['nodes'], {'created': [new.node_id], 'updated': 1, 'deleted': 1})
+        self.assertEqual(new.floor_level, 3)
+        self.hall.refresh_from_db()
+        self.assertEqual((self.hall.map_x, self.hall.name), (25.0, 'Main hallway'))
+        self.assertFalse(Nodes.objects.filter(node_id=self.lobby.node_id).exists())
+        self.assertTrue(Edges.objects.filter(from_node=self.room, to_node=new, is_staircase=True).exists())
+        self.assertEqual(Annotation.objects.get(label='Down').panorama, new)
+        self.assertNotEqual(get_version(NODES), version)
+        # One QR job for the new and the renamed node, one graph precompute
+        qr_job = Job.objects.get(name='nodes.qrcodes')
+        self.assertEqual(sorted(qr_job.payload['node_ids']), sorted([new.node_id, self.hall.node_id]))
+        self.assertEqual(Job.objects.filter(name='graph.precompute').count(), 1)
+
+    def test_invalid_batch_writes_nothing(self):
+        response = self.bulk({
+            'nodes': {
+                'create': [{'node_code': 'T-301', 'name': 'Room 301', 'building': 'Tower', 'floor_level': 3},
+                           {'node_code': 'T-HALL', 'name': 'Dup', 'building': 'Tower', 'floor_level': 1}],
+                'update': [{'node_id': self.hall.node_id, 'map_x': 150}],
+            },
+            'edges': {'create': [{'from_node_id': 999, 'to_node_code': 'T-301', 'distance': 1, 'compass_angle': 0}],
+                      'delete': [998]},
+        })
+        self.assertEqual(response.status_code, 400)
+        errors = {(e['collection'], e['action'], e['index']): e['error'] for e in response.json()['errors']}
+        self.assertEqual(set(errors), {('nodes', 'create', 1), ('nodes', 'update', 0),
+                                       ('edges', 'create', 0), ('edges', 'delete', 0)})
+        self.assertIn('node_code', errors['nodes', 'create', 1])
+        self.assertIn('map_x', errors['nodes', 'update', 0])
+        self.assertEqual(errors['edges', 'create', 0], {'from_node': 'Node 999 not found'})
+        self.assertFalse(Nodes.objects.filter(node_code='T-301').exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_save_node_positions(self):
+        response = self.client.post(reverse('api_save_node_positions'), {'nodes': [
+            {'node_id': self.lobby.node_id, 'map_x': 1.5, 'map_y': 2.5},
+            {'node_id': self.room.node_id, 'map_x': 3, 'map_y': 4},
+        ]}, content_type='application/json')
+        self.assertEqual(response.json(), {'success': True, 'updated': 2})
+        self.lobby.refresh_from_db()
+        self.assertEqual((self.lobby.map_x, self.lobby.map_y), (1.5, 2.5))
+        # Positions are not part of the QR code
+        self.assertFalse(Job.objects.filter(name='nodes.qrcodes').exists())
+
+
+class GraphImportExportTests(TempMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lobby, self.hall, self.room = create_graph()
+        self.lobby.map_x, self.lobby.map_y = 10.0, 20.0
+        self.lobby.save()
+        self.hall.map_x, self.hall.map_y = 30.0, 20.0
+        self.hall.save()
+        self.path = os.path.join(self._media_root, 'graph')
+
+    def call(self, *args):
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command(*args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_round_trip_every_format(self):
+        for format in ('jsonl', 'csv', 'geojson'):
+            path = f'{self.path}.{format}'
+            self.call('export_graph', path)
+            Nodes.objects.all().delete()
+            self.call('import_graph', path)
+            lobby = Nodes.objects.get(node_code='T-LOBBY')
+            self.assertEqual((lobby.name, lobby.map_x, lobby.map_y), ('Lobby', 10.0, 20.0), format)
+            self.assertEqual(Nodes.objects.get(node_code='T-201').map_x, 20.0)
+            self.assertEqual(Edges.objects.get(to_node__node_code='T-201').is_staircase, True)
+            annotation = Annotation.objects.get()
+            self.assertEqual((annotation.panorama, annotation.target_node.node_code), (lobby, 'T-HALL'))
+            # Importing again matches every record
+            self.assertIn('nodes: 0 created, 0 updated, 3 unchanged', self.call('import_graph', path))
+        with open(f'{self.path}.geojson') as f:
+            features = json.load(f)['features']
+        self.assertEqual(features[0]['geometry'], {'type': 'Point', 'coordinates': [10.0, 20.0]})
+        self.assertEqual(features[3]['geometry']['coordinates'], [[10.0, 20.0], [30.0, 20.0]])
+
+    def test_upsert_dry_run_and_errors(self):
+        from django.core.management.base import CommandError
+        path = f'{self.path}.jsonl'
+        records = [
+            {'type': 'node', 'node_code': 'T-HALL', 'name': 'Main hallway', 'building': 'Tower', 'floor_level': 1},
+            {'type': 'node', 'node_code': 'T-301', 'name': 'Room 301', 'building': 'Tower', 'floor_level': 3},
+            {'type': 'edge', 'from_node_code': 'T-201', 'to_node_code': 'T-301', 'distance': 4, 'compass_angle': 0},
+        ]
+        with open(path, 'w') as f:
+            f.write('\n'.join(json.dumps(record) for record in records))
+        output = self.call('import_graph', path, '--dry-run')
+        self.assertIn("~ node T-HALL: name 'Hallway' -> 'Main hallway'", output)
+        self.assertIn('+ node T-301', output)
+        self.assertIn('+ edge T-201 T-301', output)
+        self.assertFalse(Nodes.objects.filter(node_code='T-301').exists())
+
+        self.call('import_graph', path, '--batch-size', '1')
+        self.assertEqual(Nodes.objects.get(node_code='T-HALL').name, 'Main hallway')
+        # Untouched fields are kept
+        self.assertEqual(Nodes.objects.get(node_code='T-HALL').map_x, 30.0)
+        self.assertTrue(Edges.objects.filter(to_node__node_code='T-301').exists())
+        # QR codes of the renamed and the new node, queued per batch
+        queued = [node_id for job in Job.objects.filter(name='nodes.qrcodes') for node_id in job.payload['node_ids']]
+        self.assertEqual(sorted(queued), sorted(Nodes.objects.filter(node_code__in=['T-HALL', 'T-301'])
+                                               .values_list('node_id', flat=True)))
+
+        with open(path, 'a') as f:
+            f.write('\n' + json.dumps({'type': 'node', 'node_code': 'T-302', 'name': 'Room 302',
+                                       'building': 'Tower', 'floor_level': 3}))
+            f.write('\n' + json.dumps({'type': 'edge', 'from_node_code': 'T-302', 'to_node_code': 'NOPE',
+                                       'distance': 1, 'compass_angle': 0}))
+        with self.assertRaisesMessage(CommandError, 'line 5: to_node_code: Node NOPE not found'):
+            self.call('import_graph', path)
+        self.assertFalse(Nodes.objects.filter(node_code='T-302').exists())
+
+
+class EdgeCalibrationTests(TempMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lobby, self.hall, self.room = create_graph()
+        # 600 x 300 px at 0.1 m/px: 60 m x 30 m
+        CampusMap.objects.create(name='Tower', blueprint_image=blueprint_image(), building='Tower',
+                                 scale_meters_per_pixel=0.1)
+        Nodes.objects.filter(node_id=self.room.node_id).update(map_x=20.0, map_y=30.0)
+        self.lower = Nodes.objects.create(node_code='T-LOWER', name='Lower', building='Tower', floor_level=1,
+                                          map_x=10.0, map_y=30.0)
+        self.south = Edges.objects.create(from_node=self.lobby, to_node=self.lower, distance=6.1, compass_angle=175.0)
+
+    def test_measure_and_recalibrate(self):
+        from django.core.management import call_command
+        from . import calibration
+        from .versioning import get_version, EDGES
+        measured, skipped = calibration.measure_edges()
+        # The staircase edge joins two floors
+        self.assertEqual(skipped, 1)
+        by_edge = {item['edge_id']: item for item in measured}
+        east = by_edge[Edges.objects.get(to_node=self.hall).edge_id]
+        self.assertEqual((east['distance'], east['compass_angle'], east['outlier']), (6.0, 90.0, True))
+        south = by_edge[self.south.edge_id]
+        self.assertEqual((south['distance'], south['compass_angle'], south['outlier']), (6.0, 180.0, False))
+        self.assertEqual(calibration.angle_difference(350, 10), 20)
+
+        version = get_version(EDGES)
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('recalibrate_edges', '--write', stdout=out)
+        self.assertIn('T-LOBBY -> T-HALL: distance 10 m, measured 6 m', out.getvalue())
+        self.assertIn('1 edge(s) updated', out.getvalue())
+        self.assertEqual(Edges.objects.get(to_node=self.hall).distance, 6.0)
+        self.assertEqual(Edges.objects.get(edge_id=self.south.edge_id).distance, 6.1)
+        self.assertNotEqual(get_version(EDGES), version)
+
+    def test_pure_python_matches(self):
+        from unittest import mock
+        from . import calibration
+        with mock.patch.object(calibration, 'numpy', None):
+            distances, angles = calibration.geometry([3.0, 0.0, -1.0], [-4.0, 2.0, 0.0])
+        self.assertEqual([round(d, 6) for d in distances], [5.0, 2.0, 1.0])
+        self.assertEqual([round(a, 6) for a in angles], [round(math.degrees(math.atan2(3, 4)), 6), 180.0, 270.0])
+
+
+class GraphHealthTests(TempMediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        from django.contrib.auth.models import User
+        cls.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        cls.lobby, cls.hall, cls.room = create_graph()
+        Nodes.objects.create(node_code='T-ATTIC', name='Attic', building='Tower', floor_level=3)
+        # Reverse duplicate of lobby -> hall, disagreeing on the distance
+        cls.duplicate = Edges.objects.create(from_node=cls.hall, to_node=cls.lobby, distance=12.0, compass_angle=270.0)
+        cls.loop = Edges.objects.create(from_node=cls.room, to_node=cls.room, distance=0.0, compass_angle=0.0)
+        cls.stairs = Edges.objects.get(is_staircase=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def test_report(self):
+        data = self.client.get(reverse('api_mobile_graph_health')).json()
+        self.assertEqual(data['entrances'], ['T-LOBBY'])
+        everything, no_stairs = data['modes']['all'], data['modes']['no_stairs']
+        self.assertEqual(everything['component_sizes'], [3, 1])
+        self.assertEqual(everything['outside_largest_component'], ['T-ATTIC'])
+        # The doubled lobby - hall connection is no bridge
+        self.assertEqual([b['edge_id'] for b in everything['bridges']], [self.stairs.edge_id])
+        self.assertEqual(everything['articulation_points'], ['T-HALL'])
+        self.assertEqual(everything['unreachable_from_entrances'], ['T-ATTIC'])
+        self.assertEqual(no_stairs['components'], 3)
+        self.assertEqual(no_stairs['unreachable_from_entrances'], ['T-201', 'T-ATTIC'])
+        self.assertEqual(data['self_edges'], [self.loop.edge_id])
+        self.assertEqual(len(data['duplicate_edges']), 1)
+        self.assertTrue(data['duplicate_edges'][0]['asymmetric'])
+
+        # Cached until the graph changes
+        attic = Nodes.objects.get(node_code='T-ATTIC')
+        with self.captureOnCommitCallbacks(execute=True):
+            Edges.objects.create(from_node=self.room, to_node=attic, distance=4.0, compass_angle=0.0,
+                                 is_staircase=True)
+        data = self.client.get(reverse('api_mobile_graph_health')).json()
+        self.assertEqual(data['modes']['all']['component_sizes'], [4])
+
+    def test_closure_impact(self):
+        url = reverse('api_mobile_edge_closure_impact', args=[self.stairs.edge_id])
+        self.assertEqual(self.client.get(url).json()['unreachable'], ['T-201'])
+        # Without stairs the room is unreachable anyway
+        self.assertEqual(self.client.get(url, {'avoid_stairs': '1'}).json()['unreachable'], [])
+        self.assertEqual(self.client.get(reverse('api_mobile_edge_closure_impact',
+                                                 args=[self.duplicate.edge_id])).json()['unreachable'], [])
+        self.assertEqual(self.client.get(reverse('api_mobile_edge_closure_impact', args=[999])).status_code, 404)
+
+    def test_long_corridor(self):
+        from .graph_health import bridges_and_articulation_points, components
+        # Deeper than the recursion limit
+        size = 5000
+        adjacency = {i: [] for i in range(size)}
+        for i in range(size - 1):
+            adjacency[i].append((i + 1, i))
+            adjacency[i + 1].append((i, i))
+        bridges, points = bridges_and_articulation_points(adjacency)
+        self.assertEqual(len(bridges), size - 1)
+        self.assertEqual(points, set(range(1, size - 1)))
+        self.assertEqual(len(components(adjacency)), 1)
+
+
+class LookupCacheTests(TempMediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from . import lookups
+        self.lookups = lookups
+        lookups.reset_stats()
+        create_graph()
+
+    def test_hits_until_saved(self):
+        self.assertEqual(self.lookups.buildings(), ['Tower'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookups.buildings(), ['Tower'])
+        self.assertEqual(self.lookups.stats()['buildings'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+        # Saves and deletes invalidate through the model signals, once committed
+        with self.captureOnCommitCallbacks() as callbacks:
+            node = Nodes.objects.create(node_code='A-1', name='Annex', building='Annex', floor_level=0)
+        self.assertEqual(self.lookups.buildings(), ['Tower'])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.lookups.buildings(), ['Annex', 'Tower'])
+        self.assertEqual(self.lookups.floors(), [0, 1, 2])
+        with self.captureOnCommitCallbacks(execute=True):
+            node.delete()
+        self.assertEqual(self.lookups.buildings(), ['Tower'])
+
+        counts = self.lookups.counts()
+        self.assertEqual((counts['nodes'], counts['edges'], counts['annotations']), (3, 2, 1))
+        edge = Edges.objects.get(is_staircase=True)
+        edge.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            edge.save()
+        self.assertEqual(self.lookups.counts()['active_edges'], 1)
+
+    def test_missing_campus_map_is_cached(self):
+        self.assertIsNone(self.lookups.active_campus_map())
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.lookups.active_campus_map())
+        self.assertEqual(self.client.get(reverse('api_mobile_campus_map')).status_code, 404)
+
+    def test_stats_endpoint(self):
+        from django.contrib.auth.models import User
+        self.client.get(reverse('api_mobile_buildings_list'))
+        self.client.get(reverse('api_mobile_buildings_list'))
+        self.assertEqual(self.client.get(reverse('api_mobile_cache_stats')).status_code, 302)
+        self.client.force_login(User.objects.create_user('admin', password='secret', is_staff=True))
+        data = self.client.get(reverse('api_mobile_cache_stats')).json()
+        self.assertEqual(data['backend'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(data['lookups']['buildings']['hit_rate'], 0.5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class DatabaseSettingsTests(TransactionTestCase):
+
+    def test_sqlite_profile(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .transactions import write_transaction
+        connection.ensure_connection()
+        # DEFERRED, except for the blocks that read before they write
+        self.assertIsNone(connection.transaction_mode)
+        with CaptureQueriesContext(connection) as queries:
+            with write_transaction():
+                Nodes.objects.exists()
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertIsNone(connection.transaction_mode)
+        # Read-only endpoints never take the write lock, even when they are POSTs
+        create_graph()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('api_mobile_batch'), json.dumps({'requests': [
+                {'method': 'POST', 'path': reverse('api_mobile_find_path'),
+                 'body': {'start_code': 'T-LOBBY', 'goal_code': 'T-201'}},
+            ]}), content_type='application/json')
+        self.assertEqual(response.json()['responses'][0]['status'], 200)
+        self.assertNotIn('BEGIN IMMEDIATE', [query['sql'] for query in queries.captured_queries])
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_replica_routing(self):
+        from django.conf import settings
+        import threading
+        from django.db import connection, transaction
+        from unittest import mock
+        from . import versioning
+        from .db_routing import REPLICA, ReplicaRouter, replica_reads
+
+        router = ReplicaRouter()
+        with replica_reads():
+            # Nothing changes without a replica
+            self.assertIsNone(router.db_for_read(Nodes))
+        served = {table: versioning.get_version(table)[0] for table in versioning.TABLES}
+        replicated = dict(served)
+
+        def write_elsewhere():
+            versioning.bump_version(versioning.NODES)
+            connection.close()
+
+        with mock.patch.dict(settings.DATABASES, {REPLICA: {}}), \
+                mock.patch('rec.versioning.stored_tokens', side_effect=lambda using: replicated):
+            self.assertIsNone(router.db_for_read(Nodes))
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Nodes), REPLICA)
+                with transaction.atomic():
+                    self.assertIsNone(router.db_for_read(Nodes))
+                # A write published by another request meanwhile does not change
+                # the versions served with the replica's rows
+                writer = threading.Thread(target=write_elsewhere)
+                writer.start()
+                writer.join()
+                self.assertEqual(versioning.get_version(versioning.NODES)[0], served[versioning.NODES])
+                self.assertEqual(router.db_for_write(Nodes), 'default')
+                # Reads follow the write to the primary, with the live versions
+                self.assertIsNone(router.db_for_read(Nodes))
+                self.assertNotEqual(versioning.get_version(versioning.NODES)[0], served[versioning.NODES])
+            # The replica lags behind that write
+            with replica_reads():
+                self.assertIsNone(router.db_for_read(Nodes))
+            replicated[versioning.NODES] = versioning.get_version(versioning.NODES)[0]
+            with replica_reads():
+                self.assertEqual(router.db_for_read(Nodes), REPLICA)
+        self.assertFalse(router.allow_migrate(REPLICA, 'rec'))
+
+    def test_contention_harness(self):
+        from .contention import measure
+        create_graph()
+        result = measure('configured', seconds=0.5, readers=2, writers=2)
+        self.assertGreater(result['reads'], 0)
+        self.assertGreater(result['writes'], 0)
+        self.assertEqual(result['reads_locked'] + result['writes_locked'], 0)
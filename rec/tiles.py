@@ -0,0 +1,103 @@
+"""
+Viewport-clipped graph tiles for the map viewers.
+
+A blueprint's 0-100 percentage space is cut into a z/x/y quadtree: zoom
+level z has 2**z x 2**z tiles. Tiles cover the campus-wide map, or with a
+``building`` that building's blueprint (see ``SpatialIndex``). A tile holds the positioned nodes inside it
+and the same-floor active edges crossing it, in a compact columnar format.
+Below ``LOD_FULL_ZOOM`` tiles only carry landmark nodes and no edges, so the
+zoomed-out campus stays light. Tiles are read from the spatial index and
+cached per data version; the overview zooms are precomputed by a background
+job whenever the graph changes (see rec/tasks.py).
+"""
+
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .spatial import get_spatial_index
+from .versioning import combined_version, NODES, EDGES, CAMPUS_MAP
+
+TILE_MAX_ZOOM = 6
+
+# Zoom level from which tiles carry every node and edge
+LOD_FULL_ZOOM = 2
+
+# Node types still shown at low zoom (REC_TILE_LANDMARK_TYPES overrides): the
+# entrances and floor connections every campus has, plus the form's landmarks
+LANDMARK_TYPES = ('entrance', 'staircase', 'elevator', 'landmark')
+
+# Data the tiles are built from (the spatial index scales by the map aspect)
+TILE_TABLES = (NODES, EDGES, CAMPUS_MAP)
+
+NODE_FIELDS = ('id', 'code', 'name', 'building', 'floor', 'type', 'map_x', 'map_y')
+EDGE_FIELDS = ('id', 'from', 'to', 'distance', 'compass', 'staircase')
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int):
+    """(x0, y0, x1, y1) of a tile in map percent units."""
+    size = 100.0 / 2 ** z
+    return x * size, y * size, (x + 1) * size, (y + 1) * size
+
+
+def landmark_types():
+    return frozenset(getattr(settings, 'REC_TILE_LANDMARK_TYPES', LANDMARK_TYPES))
+
+
+def build_tile(z: int, x: int, y: int, floor: Optional[int] = None, building: str = '') -> Dict:
+    """Nodes and edges of one tile, optionally limited to one floor, of ``building``'s map if given."""
+    index = get_spatial_index()
+    bounds = tile_bounds(z, x, y)
+    floors = [floor] if floor is not None else sorted(index.floors)
+    full = z >= LOD_FULL_ZOOM
+    landmarks = landmark_types()
+
+    nodes, edges = [], []
+    for floor_level in floors:
+        for n in index.in_viewport(*bounds, floor_level, building):
+            if full or n['type_of_node'] in landmarks:
+                nodes.append([n['node_id'], n['node_code'], n['name'], n['building'],
+                              n['floor_level'], n['type_of_node'], n['map_x'], n['map_y']])
+        if full:
+            for e in index.edges_in_viewport(*bounds, floor_level, building):
+                edges.append([e['edge_id'], e['from_node_id'], e['to_node_id'],
+                              e['distance'], e['compass_angle'], e['is_staircase']])
+
+    return {
+        'z': z,
+        'x': x,
+        'y': y,
+        'floor': floor,
+        'building': building,
+        'lod': 'full' if full else 'landmarks',
+        'nodes': {'fields': NODE_FIELDS, 'rows': nodes},
+        'edges': {'fields': EDGE_FIELDS, 'rows': edges}
+    }
+
+
+def cached_tile(z: int, x: int, y: int, floor: Optional[int] = None, building: str = '') -> Dict:
+    """``build_tile`` through the cache, keyed by data version so every process shares it."""
+    key = f'rec:tile:{combined_version(*TILE_TABLES)}:{z}/{x}/{y}:{floor}:{building}'
+    data = cache.get(key)
+    if data is None:
+        data = build_tile(z, x, y, floor, building)
+        cache.set(key, data, getattr(settings, 'REC_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return data
+
+
+def precompute_tiles(max_zoom: int = LOD_FULL_ZOOM) -> int:
+    """Fill the cache with every campus-wide tile up to ``max_zoom``, all floors and per floor; returns the count."""
+    floors = [None, *sorted(get_spatial_index().floors)]
+    count = 0
+    for z in range(max_zoom + 1):
+        for x in range(2 ** z):
+            for y in range(2 ** z):
+                for floor in floors:
+                    cached_tile(z, x, y, floor)
+                    count += 1
+    return count
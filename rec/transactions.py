@@ -0,0 +1,37 @@
+"""
+Transactions that read before they write.
+
+SQLite transactions are DEFERRED: they take the write lock at their first
+write, so reading transactions never block each other and a transaction is
+only queued behind writers once it writes. A transaction that reads and
+*then* writes cannot wait for the lock, though: when another writer
+committed after its read, the upgrade fails at once with "database is
+locked". ``write_transaction()`` begins such blocks IMMEDIATE, taking the
+write lock up front so they queue for it (``timeout``) instead of failing.
+
+Keep these blocks short and free of file or network I/O: every other writer
+waits for them.
+"""
+
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+@contextmanager
+def write_transaction(using=None):
+    """``transaction.atomic()`` that holds the write lock from the start (on SQLite)."""
+    connection = transaction.get_connection(using)
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        # A savepoint cannot change how the outer transaction began
+        with transaction.atomic(using=using):
+            yield
+        return
+    connection.ensure_connection()
+    mode, connection.transaction_mode = connection.transaction_mode, 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
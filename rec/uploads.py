@@ -0,0 +1,381 @@
+"""
+Chunked, resumable uploads of 360° images.
+
+Instead of a base64 string inside a JSON body (decoded in memory), clients:
+
+1. initiate an ``UploadSession`` with the file name, total size and target node,
+2. send the file as numbered parts of ``chunk_size`` bytes, in order; each part
+   is streamed from the request to a staging file in small pieces, so memory
+   per request stays bounded by ``READ_SIZE``,
+3. complete the session, which verifies the file and attaches it to the node.
+
+A part that was already stored is acknowledged again, so clients can simply
+retry; after a dropped connection the session's ``received_size`` says where
+to resume. The image header is probed as soon as enough bytes arrived, so a
+file with the wrong format or dimensions is rejected after its first part
+rather than after the whole upload.
+
+The session row is never locked while bytes are streamed or hashed: a short
+transaction leases the session to the request (``lease``/``leased_until``),
+the I/O runs outside any transaction, and a second short transaction records
+the result if the lease is still held. Sessions idle for ``REC_UPLOAD_TTL``
+seconds are deleted with their staged bytes by ``expire_stale()``, which
+``manage.py gc_media`` runs.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import Nodes, UploadSession
+from .transactions import write_transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Bytes read from the request and written to disk at a time
+READ_SIZE = 64 * 1024
+
+# A header that is not recognised within this many bytes is not an image
+MAX_HEADER_SIZE = 2 * 1024 * 1024
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP')
+MAX_DIMENSION = 16384
+
+# Equirectangular panoramas are twice as wide as they are high
+PANORAMA_ASPECT = 2.0
+ASPECT_TOLERANCE = 0.02
+
+
+class UploadError(ValueError):
+    """A client error in the upload protocol; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_upload_size():
+    return getattr(settings, 'REC_UPLOAD_MAX_SIZE', 100 * 1024 * 1024)
+
+
+def staging_dir():
+    path = getattr(settings, 'REC_UPLOAD_DIR', None) or os.path.join(
+        settings.FILE_UPLOAD_TEMP_DIR or tempfile.gettempdir(), 'rec_uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def staging_path(session):
+    return os.path.join(staging_dir(), f'{session.upload_id.hex}.part')
+
+
+def part_count(session):
+    return -(-session.total_size // session.chunk_size)
+
+
+def part_range(session, index):
+    """Byte range [start, end) of part ``index`` (0-based)."""
+    if not 0 <= index < part_count(session):
+        raise UploadError(f'Part {index} is out of range (0-{part_count(session) - 1})')
+    start = index * session.chunk_size
+    return start, min(start + session.chunk_size, session.total_size)
+
+
+def validate_new_upload(filename, total_size, chunk_size):
+    if not filename:
+        raise UploadError('filename is required')
+    if total_size <= 0:
+        raise UploadError('size must be positive')
+    if total_size > max_upload_size():
+        raise UploadError(f'File too large (max {max_upload_size()} bytes)', status=413)
+    if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+        raise UploadError(f'chunk_size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE}')
+
+
+def upload_ttl():
+    """Seconds after its last activity when an unfinished upload is expired."""
+    return getattr(settings, 'REC_UPLOAD_TTL', 24 * 60 * 60)
+
+
+def lease_timeout():
+    """Seconds a request may hold a session while it streams or verifies the file."""
+    return getattr(settings, 'REC_UPLOAD_LEASE', 10 * 60)
+
+
+def _locked(upload_id):
+    """The session ``upload_id``, locked until the end of the caller's transaction."""
+    session = UploadSession.objects.select_for_update().filter(upload_id=upload_id).first()
+    if session is None:
+        raise UploadError('Upload not found', status=404)
+    return session
+
+
+def _check_uploading(session):
+    if session.status != UploadSession.STATUS_UPLOADING:
+        raise UploadError(f'Upload is {session.status}', status=409)
+
+
+def _acquire(session):
+    """Lease the locked ``session`` to the calling request and return the lease."""
+    now = timezone.now()
+    if session.lease and session.leased_until and session.leased_until > now:
+        raise UploadError('The upload is busy with another request; retry shortly', status=409)
+    session.lease = uuid.uuid4().hex
+    session.leased_until = now + timedelta(seconds=lease_timeout())
+    session.save(update_fields=['lease', 'leased_until', 'updated_at'])
+    return session.lease
+
+
+def _reacquire(upload_id, lease):
+    """Lock the session again; fails when the lease was taken over or the upload ended meanwhile."""
+    session = _locked(upload_id)
+    if session.status != UploadSession.STATUS_UPLOADING:
+        discard(session)  # aborted meanwhile; the bytes just staged are not wanted
+        raise UploadError(f'Upload is {session.status}', status=409)
+    if session.lease != lease:
+        raise UploadError('The upload was taken over by another request', status=409)
+    session.lease, session.leased_until = '', None
+    return session
+
+
+def _release(upload_id, lease):
+    UploadSession.objects.filter(upload_id=upload_id, lease=lease).update(lease='', leased_until=None)
+
+
+def _fail(session, message, status=400):
+    """Mark the locked ``session`` failed; the caller discards its staged bytes."""
+    session.status = UploadSession.STATUS_FAILED
+    session.error = message
+    session.save(update_fields=['status', 'error', 'lease', 'leased_until', 'updated_at'])
+    return UploadError(message, status)
+
+
+def _probe(path, received_size, total_size):
+    """
+    Read the image header from the staged bytes; returns (format, width, height),
+    or None when more bytes are needed to recognise it.
+    """
+    try:
+        with Image.open(path) as image:
+            image_format, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        if received_size < min(total_size, MAX_HEADER_SIZE):
+            return None
+        raise UploadError('Not a supported image file')
+
+    if image_format not in ALLOWED_FORMATS:
+        raise UploadError(f'Unsupported image format {image_format}')
+    if max(width, height) > MAX_DIMENSION:
+        raise UploadError(f'Image is {width}x{height}, the maximum dimension is {MAX_DIMENSION}px')
+    if abs(width / height - PANORAMA_ASPECT) > PANORAMA_ASPECT * ASPECT_TOLERANCE:
+        raise UploadError(f'Image is {width}x{height}, 360° panoramas must be twice as wide as high')
+    return image_format, width, height
+
+
+def _stream(path, start, stream, length, index):
+    """Copy ``length`` bytes of ``stream`` into the staging file at ``start``."""
+    with open(path, 'r+b' if start else 'wb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining:
+            piece = stream.read(min(READ_SIZE, remaining))
+            if not piece:
+                f.truncate(start)
+                raise UploadError(f'Part {index} ended after {length - remaining} of {length} bytes')
+            f.write(piece)
+            remaining -= len(piece)
+
+
+def write_part(upload_id, index, stream, length):
+    """
+    Store part ``index`` of upload ``upload_id`` read from ``stream`` (``length`` bytes).
+
+    The session row is locked only briefly: once to check the part and lease
+    the session, and once more to record the stored part. The bytes are
+    streamed in between, outside any transaction. Returns the session and
+    True when the part was written, False when it had been stored before.
+    """
+    with write_transaction():
+        session = _locked(upload_id)
+        _check_uploading(session)
+        start, end = part_range(session, index)
+        if length != end - start:
+            raise UploadError(f'Part {index} must be {end - start} bytes, got {length}')
+        if end <= session.received_size:
+            return session, False  # a retry of a stored part
+        if start != session.received_size:
+            raise UploadError(f'Parts must be sent in order; expected part {session.received_size // session.chunk_size}',
+                              status=409)
+        lease = _acquire(session)
+
+    path = staging_path(session)
+    try:
+        _stream(path, start, stream, length, index)
+    except BaseException:
+        _release(upload_id, lease)
+        raise
+    header = error = None
+    if not session.width:
+        try:
+            header = _probe(path, end, session.total_size)
+        except UploadError as e:
+            error = e
+
+    with write_transaction():
+        session = _reacquire(upload_id, lease)
+        if error is None:
+            session.received_size = end
+            if header:
+                session.image_format, session.width, session.height = header
+            session.save(update_fields=['received_size', 'image_format', 'width', 'height',
+                                        'lease', 'leased_until', 'updated_at'])
+        else:
+            error = _fail(session, str(error))
+    if error is not None:
+        discard(session)
+        raise error
+    return session, True
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for piece in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def _verify(session, path):
+    """Check the staged file of a fully received upload; raises UploadError."""
+    if session.checksum and _sha256(path) != session.checksum.lower():
+        raise UploadError('Checksum mismatch')
+    if not session.width:
+        raise UploadError('Not a supported image file')
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        raise UploadError('Image data is corrupt')
+
+
+def complete(upload_id):
+    """
+    Verify the staged file of upload ``upload_id`` and attach it to the node.
+
+    Like ``write_part``, hashing the file and copying it to storage happen
+    outside the transactions that lease the session and record the result.
+    Returns the session and the node.
+    """
+    with write_transaction():
+        session = _locked(upload_id)
+        _check_uploading(session)
+        if session.received_size != session.total_size:
+            raise UploadError(f'Upload incomplete: {session.received_size} of {session.total_size} bytes received',
+                              status=409)
+        lease = _acquire(session)
+
+    path = staging_path(session)
+    error = None
+    try:
+        _verify(session, path)
+        extension = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}[session.image_format]
+        image360 = session.node.image360
+        with open(path, 'rb') as f:
+            image360.save(f'{session.node.node_code}_360.{extension}', File(f), save=False)
+    except UploadError as e:
+        error = e
+    except BaseException:
+        _release(upload_id, lease)
+        raise
+
+    with write_transaction():
+        session = _reacquire(upload_id, lease)
+        if error is None:
+            node = Nodes.objects.select_for_update().get(pk=session.node_id)
+            node.image360 = image360.name
+            node.save()
+            session.status = UploadSession.STATUS_COMPLETED
+            session.save(update_fields=['status', 'lease', 'leased_until', 'updated_at'])
+        else:
+            error = _fail(session, str(error))
+    discard(session)
+    if error is not None:
+        raise error
+    return session, node
+
+
+def abort(upload_id):
+    """Abort an unfinished upload; returns the session, or None if there is none."""
+    with write_transaction():
+        session = UploadSession.objects.filter(upload_id=upload_id).first()
+        if session is not None and session.status == UploadSession.STATUS_UPLOADING:
+            session.status = UploadSession.STATUS_ABORTED
+            session.save(update_fields=['status', 'updated_at'])
+    if session is not None and session.status == UploadSession.STATUS_ABORTED:
+        discard(session)
+    return session
+
+
+def discard(session):
+    """Remove the staged bytes of a session."""
+    try:
+        os.remove(staging_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def expire_stale(dry_run=False, ttl=None):
+    """
+    Delete upload sessions without activity for ``ttl`` seconds (default
+    ``REC_UPLOAD_TTL``), finished or not, and staging files no remaining
+    unfinished session owns.
+
+    Returns ``{'sessions': n, 'files': [...], 'bytes': n}`` describing what
+    was (or with ``dry_run`` would be) deleted.
+    """
+    ttl = upload_ttl() if ttl is None else ttl
+    stale = UploadSession.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=ttl))
+    report = {'sessions': stale.count(), 'files': [], 'bytes': 0}
+    if not dry_run:
+        stale.delete()
+        live = UploadSession.objects.filter(status=UploadSession.STATUS_UPLOADING)
+    else:
+        live = UploadSession.objects.filter(status=UploadSession.STATUS_UPLOADING).exclude(pk__in=stale)
+    live = {upload_id.hex for upload_id in live.values_list('upload_id', flat=True)}
+
+    directory = staging_dir()
+    now = time.time()
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        # A file younger than a lease may belong to a session created after ``live`` was read
+        if filename.split('.')[0] in live or now - stat.st_mtime < lease_timeout():
+            continue
+        report['files'].append(filename)
+        report['bytes'] += stat.st_size
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    if not dry_run and (report['sessions'] or report['files']):
+        logger.info('Expired %s upload session(s) and %s staging file(s), %s bytes',
+                    report['sessions'], len(report['files']), report['bytes'])
+    return report
@@ -34,17 +34,29 @@ urlpatterns = [
     path('api/find-path/', views.api_find_path, name='api_find_path'),
     path('api/annotations/<int:node_id>/', views.api_annotations, name='api_annotations'),
     path('api/graph-data/', views.api_graph_data, name='api_graph_data'),
+    path('api/tiles/<int:z>/<int:x>/<int:y>/', views.api_graph_tile, name='api_graph_tile'),
+    path('api/map-tiles/<str:digest>/<int:level>/<int:col>_<int:row>.jpg', views.api_map_tile, name='api_map_tile'),
     path('api/node-details/<int:node_id>/', views.api_node_details, name='api_node_details'),
+    path('api/save-node-positions/', api_views.api_save_node_positions, name='api_save_node_positions'),
     
     # Mobile App API Endpoints
     # Public endpoints
     path('api/mobile/nodes/', api_views.api_nodes_list, name='api_mobile_nodes_list'),
     path('api/mobile/nodes/<int:node_id>/', api_views.api_node_detail, name='api_mobile_node_detail'),
+    path('api/mobile/nodes/<int:node_id>/bundle/', api_views.api_node_bundle, name='api_mobile_node_bundle'),
+    path('api/mobile/search/', api_views.api_search, name='api_mobile_search'),
     path('api/mobile/buildings/', api_views.api_buildings_list, name='api_mobile_buildings_list'),
     path('api/mobile/campus-map/', api_views.api_campus_map, name='api_mobile_campus_map'),
     path('api/mobile/find-path/', api_views.api_find_path, name='api_mobile_find_path'),
     path('api/mobile/edges/', api_views.api_edges_list, name='api_mobile_edges_list'),
     path('api/mobile/annotations/', api_views.api_annotations_list, name='api_mobile_annotations_list'),
+    path('api/mobile/annotations/prefetch/', api_views.api_annotations_prefetch, name='api_mobile_annotations_prefetch'),
+    path('api/mobile/nodes/<int:node_id>/annotations/visible/', api_views.api_annotations_visible, name='api_mobile_annotations_visible'),
+    path('api/mobile/route-pack/', api_views.api_route_pack, name='api_mobile_route_pack'),
+    path('api/mobile/batch/', api_views.api_batch, name='api_mobile_batch'),
+    path('api/mobile/spatial/nearest/', api_views.api_spatial_nearest, name='api_mobile_spatial_nearest'),
+    path('api/mobile/spatial/viewport/', api_views.api_spatial_viewport, name='api_mobile_spatial_viewport'),
+    path('api/mobile/spatial/snap/', api_views.api_spatial_snap, name='api_mobile_spatial_snap'),
     
     # Admin authentication
     path('api/mobile/admin/login/', api_views.api_admin_login, name='api_mobile_admin_login'),
@@ -61,4 +73,23 @@ urlpatterns = [
     path('api/mobile/admin/annotations/create/', api_views.api_annotation_create, name='api_mobile_annotation_create'),
     path('api/mobile/admin/annotations/<int:annotation_id>/update/', api_views.api_annotation_update, name='api_mobile_annotation_update'),
     path('api/mobile/admin/annotations/<int:annotation_id>/delete/', api_views.api_annotation_delete, name='api_mobile_annotation_delete'),
+    
+    # Transactional bulk writes
+    path('api/mobile/admin/bulk/', api_views.api_bulk_write, name='api_mobile_bulk_write'),
+    
+    # Chunked, resumable 360° image uploads
+    path('api/mobile/admin/uploads/', api_views.api_upload_initiate, name='api_mobile_upload_initiate'),
+    path('api/mobile/admin/uploads/<uuid:upload_id>/', api_views.api_upload_detail, name='api_mobile_upload_detail'),
+    path('api/mobile/admin/uploads/<uuid:upload_id>/parts/<int:index>/', api_views.api_upload_part, name='api_mobile_upload_part'),
+    path('api/mobile/admin/uploads/<uuid:upload_id>/complete/', api_views.api_upload_complete, name='api_mobile_upload_complete'),
+    
+    # Graph health checks
+    path('api/mobile/admin/graph-health/', api_views.api_graph_health, name='api_mobile_graph_health'),
+    path('api/mobile/admin/edges/<int:edge_id>/closure-impact/', api_views.api_edge_closure_impact, name='api_mobile_edge_closure_impact'),
+    path('api/mobile/admin/cache-stats/', api_views.api_cache_stats, name='api_mobile_cache_stats'),
+    
+    # Background job queue status
+    path('api/mobile/admin/jobs/', api_views.api_jobs_status, name='api_mobile_jobs_status'),
+    path('api/mobile/admin/jobs/<int:job_id>/', api_views.api_job_detail, name='api_mobile_job_detail'),
+    path('api/mobile/admin/jobs/<int:job_id>/retry/', api_views.api_job_retry, name='api_mobile_job_retry'),
 ]
@@ -0,0 +1,160 @@
+"""
+Data versions for the read APIs.
+
+Every table the read endpoints depend on carries a version token that is
+bumped whenever one of its rows changes (see rec/signals.py). Tokens are
+read from the Django cache, so conditional GET checks never touch the
+database: a matching If-None-Match short-circuits to 304 before any queryset
+is built.
+
+A bump writes the new token to the ``DataVersion`` table in the transaction
+of the change and copies it to the cache once that commits. A read replica
+therefore holds the tokens of the data it has replicated, which tells
+rec/db_routing.py whether it has caught up with the versions being served.
+"""
+
+import hashlib
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from .models import DataVersion
+from .transactions import write_transaction
+
+NODES = 'nodes'
+EDGES = 'edges'
+ANNOTATIONS = 'annotations'
+CAMPUS_MAP = 'campus_map'
+
+TABLES = (NODES, EDGES, ANNOTATIONS, CAMPUS_MAP)
+
+# Tables that make up the navigation graph
+GRAPH_TABLES = (NODES, EDGES)
+
+_served = threading.local()
+
+
+def _cache_key(table):
+    return f'rec:version:{table}'
+
+
+def _new_version(previous=None):
+    """Create a fresh (token, last_modified) pair."""
+    now = timezone.now().replace(microsecond=0)
+    if previous is not None and now <= previous[1]:
+        # Last-Modified has one second resolution; keep it strictly increasing
+        now = previous[1] + timedelta(seconds=1)
+    return (uuid.uuid4().hex, now)
+
+
+def _load(table, using=DEFAULT_DB_ALIAS):
+    row = DataVersion.objects.using(using).filter(table=table).values_list('token', 'modified').first()
+    return tuple(row) if row else None
+
+
+def get_version(table):
+    """Return the (token, last_modified) pair for a table."""
+    served = getattr(_served, 'versions', None)
+    if served is not None:
+        return served[table]
+    key = _cache_key(table)
+    version = cache.get(key)
+    if version is None:
+        version = _load(table) or _new_version()
+        # add() so concurrent first readers agree on a single token
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(*tables):
+    """
+    Mark tables as changed, invalidating every ETag derived from them.
+
+    The new tokens are stored with the current transaction and reach the
+    cache once it commits; earlier, a concurrent reader could cache the old,
+    still committed rows under a new token.
+    """
+    with write_transaction():
+        for table in tables:
+            token, modified = _new_version(_load(table))
+            DataVersion.objects.update_or_create(table=table, defaults={'token': token, 'modified': modified})
+        transaction.on_commit(lambda: _publish(tables))
+
+
+def _publish(tables):
+    # The latest committed tokens, so commits publishing out of order still converge
+    for table in tables:
+        version = _load(table)
+        if version is not None:
+            cache.set(_cache_key(table), version, timeout=None)
+
+
+def stored_tokens(using):
+    """Tokens stored in database ``using``, by table."""
+    return dict(DataVersion.objects.using(using).values_list('table', 'token'))
+
+
+@contextmanager
+def serving(versions):
+    """
+    Answer ``get_version()`` in this thread from ``versions`` (all of
+    ``TABLES``) until the block ends or ``stop_serving()`` is called.
+    """
+    previous = getattr(_served, 'versions', None)
+    _served.versions = versions
+    try:
+        yield
+    finally:
+        _served.versions = previous
+
+
+def stop_serving():
+    _served.versions = None
+
+
+def combined_version(*tables):
+    """Single token covering all the given tables."""
+    tokens = '|'.join(get_version(table)[0] for table in tables)
+    return hashlib.sha1(tokens.encode()).hexdigest()
+
+
+def graph_version():
+    """Version token of the navigation graph (nodes and edges)."""
+    return combined_version(*GRAPH_TABLES)
+
+
+def last_modified(*tables):
+    """Most recent modification time across the given tables."""
+    return max(get_version(table)[1] for table in tables)
+
+
+def etag_for(*tables):
+    """Build an ``etag_func`` for ``django.views.decorators.http.condition``."""
+    def etag_func(request, *args, **kwargs):
+        # Payloads embed absolute URLs and depend on the query string
+        parts = (combined_version(*tables), request.get_host(), request.get_full_path())
+        return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+    return etag_func
+
+
+def last_modified_for(*tables):
+    """Build a ``last_modified_func`` for ``django.views.decorators.http.condition``."""
+    def last_modified_func(request, *args, **kwargs):
+        return last_modified(*tables)
+    return last_modified_func
+
+
+def versioned(*tables):
+    """
+    Decorator adding strong ETag / Last-Modified handling to a read view.
+
+    The view body only runs when the client's cached copy is stale.
+    """
+    return condition(etag_func=etag_for(*tables), last_modified_func=last_modified_for(*tables))
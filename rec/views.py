@@ -1,22 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, Http404
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
 from django.db.models import Q
 import json
 
-from .models import Nodes, Edges, Annotation, CampusMap
+from .models import Nodes, Edges, Annotation
+from .blueprint_tiles import open_tile, public_manifest
+from . import lookups
+from .derivatives import public_derivatives
+from .panorama_tiles import manifest_for
 from .pathfinding import get_pathfinder, reset_pathfinder
+from .response_cache import cached_json_response
+from .streaming import StreamingJsonResponse, wants_stream, QUERYSET_CHUNK_SIZE
+from .tiles import cached_tile, is_valid_tile
+from .versioning import versioned, NODES, EDGES, ANNOTATIONS, CAMPUS_MAP
 
 
 # ============= Main Dashboard =============
 def index(request):
     """Main dashboard showing overview."""
+    counts = lookups.counts()
     context = {
-        'total_nodes': Nodes.objects.count(),
-        'total_edges': Edges.objects.count(),
-        'total_annotations': Annotation.objects.count(),
-        'buildings': Nodes.objects.values_list('building', flat=True).distinct(),
+        'total_nodes': counts['nodes'],
+        'total_edges': counts['edges'],
+        'total_annotations': counts['annotations'],
+        'buildings': lookups.buildings(),
     }
     return render(request, 'rec/index.html', context)
 
@@ -50,8 +59,8 @@ def nodes_list(request):
         'search': search,
         'building_filter': building_filter,
         'floor_filter': floor_filter,
-        'buildings': Nodes.objects.values_list('building', flat=True).distinct(),
-        'floors': Nodes.objects.values_list('floor_level', flat=True).distinct().order_by('floor_level'),
+        'buildings': lookups.buildings(),
+        'floors': lookups.floors(),
     }
     return render(request, 'rec/nodes_list.html', context)
 
@@ -80,19 +89,20 @@ def node_create(request):
                 node.map_x = float(map_x)
                 node.map_y = float(map_y)
             
-            node.save()  # QR code auto-generated on save
-            messages.success(request, f'Node "{node.name}" created successfully with QR code!')
+            node.save()  # QR code is generated by a background job
+            messages.success(request, f'Node "{node.name}" created successfully; its QR code will be ready shortly.')
             reset_pathfinder()  # Rebuild graph
             return redirect('nodes_list')
         except Exception as e:
             messages.error(request, f'Error creating node: {str(e)}')
     
     # Get active campus map
-    campus_map = CampusMap.objects.filter(is_active=True).first()
+    campus_map = lookups.active_campus_map()
     
     return render(request, 'rec/node_form.html', {
         'mode': 'create',
-        'campus_map': campus_map
+        'campus_map': campus_map,
+        'blueprint_tiles': public_manifest(campus_map.blueprint_tiles, request) if campus_map else None
     })
 
 
@@ -124,12 +134,12 @@ def node_edit(request, node_id):
                 node.map_x = None
                 node.map_y = None
             
-            # Regenerate QR code if node_code changed
-            if 'regenerate_qr' in request.POST or node.node_code != request.POST.get('old_node_code', ''):
-                node.qrcode.delete(save=False)  # Delete old QR
-                node.qrcode = None
+            # Changes of the QR payload (code, name, building) are picked up on save;
+            # clearing the hash forces a fresh image
+            if 'regenerate_qr' in request.POST:
+                node.qrcode_hash = ''
             
-            node.save()  # Auto-generates QR if needed
+            node.save()  # Queues QR generation if needed
             messages.success(request, f'Node "{node.name}" updated successfully!')
             reset_pathfinder()
             return redirect('nodes_list')
@@ -137,12 +147,13 @@ def node_edit(request, node_id):
             messages.error(request, f'Error updating node: {str(e)}')
     
     # Get active campus map
-    campus_map = CampusMap.objects.filter(is_active=True).first()
+    campus_map = lookups.active_campus_map()
     
     context = {
         'mode': 'edit',
         'node': node,
-        'campus_map': campus_map
+        'campus_map': campus_map,
+        'blueprint_tiles': public_manifest(campus_map.blueprint_tiles, request) if campus_map else None
     }
     return render(request, 'rec/node_form.html', context)
     
@@ -367,28 +378,27 @@ def annotation_delete(request, annotation_id):
 def pathfinding_test(request):
     """Interactive pathfinding test page."""
     nodes = Nodes.objects.all().order_by('building', 'name')
-    campus_map = CampusMap.objects.filter(is_active=True).first()
+    campus_map = lookups.active_campus_map()
     return render(request, 'rec/pathfinding_test.html', {
         'nodes': nodes,
-        'campus_map': campus_map
+        'total_edges': lookups.counts()['active_edges'],
+        'campus_map': campus_map,
+        'blueprint_tiles': public_manifest(campus_map.blueprint_tiles, request) if campus_map else None
     })
 
 
 def map_viewer(request):
     """Interactive campus map viewer showing all positioned nodes."""
-    campus_map = CampusMap.objects.filter(is_active=True).first()
-    
-    total_nodes = Nodes.objects.count()
-    positioned_nodes = Nodes.objects.filter(map_x__isnull=False, map_y__isnull=False).count()
-    buildings = Nodes.objects.values_list('building', flat=True).distinct().order_by('building')
-    floors = Nodes.objects.values_list('floor_level', flat=True).distinct().order_by('floor_level')
+    campus_map = lookups.active_campus_map()
+    counts = lookups.counts()
     
     return render(request, 'rec/map_viewer.html', {
         'campus_map': campus_map,
-        'total_nodes': total_nodes,
-        'positioned_nodes': positioned_nodes,
-        'buildings': buildings,
-        'floors': floors
+        'blueprint_tiles': public_manifest(campus_map.blueprint_tiles, request) if campus_map else None,
+        'total_nodes': counts['nodes'],
+        'positioned_nodes': counts['positioned_nodes'],
+        'buildings': lookups.buildings(),
+        'floors': lookups.floors()
     })
 
 
@@ -416,6 +426,7 @@ def api_find_path(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@versioned(ANNOTATIONS, NODES)
 def api_annotations(request, node_id):
     """API endpoint to get annotations for a panorama node."""
     try:
@@ -443,6 +454,7 @@ def api_annotations(request, node_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@versioned(NODES)
 def api_node_details(request, node_id):
     """API endpoint to get detailed information about a specific node."""
     try:
@@ -458,7 +470,9 @@ def api_node_details(request, node_id):
             'map_x': float(node.map_x) if node.map_x is not None else None,
             'map_y': float(node.map_y) if node.map_y is not None else None,
             'qrcode': node.qrcode.url if node.qrcode else None,
-            'image360': node.image360.url if node.image360 else None
+            'image360': node.image360.url if node.image360 else None,
+            'image360_tiles': manifest_for(node, request),
+            'image360_derivatives': public_derivatives(node.image360_derivatives, request.build_absolute_uri)
         }
         
         return JsonResponse(data)
@@ -467,10 +481,15 @@ def api_node_details(request, node_id):
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@versioned(NODES, EDGES)
 def api_graph_data(request):
-    """API endpoint to get graph visualization data."""
+    """
+    API endpoint to get graph visualization data.
+
+    ``stream=1`` streams the payload instead of building it in memory.
+    """
     try:
-        nodes_data = [{
+        nodes = ({
             'id': n.node_id,
             'code': n.node_code,
             'name': n.name,
@@ -479,22 +498,71 @@ def api_graph_data(request):
             'type': n.type_of_node,
             'map_x': float(n.map_x) if n.map_x is not None else None,
             'map_y': float(n.map_y) if n.map_y is not None else None
-        } for n in Nodes.objects.all()]
+        } for n in Nodes.objects.only(
+            'node_id', 'node_code', 'name', 'building', 'floor_level', 'type_of_node', 'map_x', 'map_y'
+        ).iterator(chunk_size=QUERYSET_CHUNK_SIZE))
         
-        edges_data = [{
+        edges = ({
             'id': e.edge_id,
-            'from': e.from_node.node_id,
-            'to': e.to_node.node_id,
+            'from': e.from_node_id,
+            'to': e.to_node_id,
             'distance': e.distance,
             'compass': e.compass_angle,
             'staircase': e.is_staircase,
             'active': e.is_active
-        } for e in Edges.objects.filter(is_active=True).select_related('from_node', 'to_node')]
+        } for e in Edges.objects.filter(is_active=True).iterator(chunk_size=QUERYSET_CHUNK_SIZE))
         
-        return JsonResponse({
-            'nodes': nodes_data,
-            'edges': edges_data
+        if wants_stream(request):
+            return StreamingJsonResponse({
+                'nodes': nodes,
+                'edges': edges
+            })
+        
+        return cached_json_response(request, (NODES, EDGES), lambda: {
+            'nodes': list(nodes),
+            'edges': list(edges)
         })
     
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+@versioned(NODES, EDGES, CAMPUS_MAP)
+def api_graph_tile(request, z, x, y):
+    """
+    API endpoint returning one z/x/y graph tile (see rec/tiles.py).
+
+    ``floor`` limits the tile to one floor level; ``building`` selects the
+    tiles of that building's blueprint.
+    """
+    try:
+        if not is_valid_tile(z, x, y):
+            return JsonResponse({'error': 'Tile out of range'}, status=404)
+        floor = request.GET.get('floor', '').strip()
+        floor = int(floor) if floor else None
+        building = request.GET.get('building', '').strip()
+        
+        return cached_json_response(request, (NODES, EDGES, CAMPUS_MAP),
+                                    lambda: cached_tile(z, x, y, floor, building))
+    
+    except ValueError:
+        return JsonResponse({'error': 'floor must be an integer'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# Blueprint tiles are content addressed, so a URL never changes meaning
+MAP_TILE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+@require_http_methods(["GET", "HEAD"])
+def api_map_tile(request, digest, level, col, row):
+    """Serve one deep-zoom blueprint tile (see rec/blueprint_tiles.py) with long-lived caching."""
+    try:
+        tile = open_tile(digest, level, col, row)
+    except OSError:
+        raise Http404('Unknown tile')
+    
+    response = FileResponse(tile, content_type='image/jpeg')
+    response['Cache-Control'] = MAP_TILE_CACHE_CONTROL
+    return response
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
+from urllib.parse import urlsplit, unquote
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'rec.db_routing.ReplicaReadsMiddleware',
 ]
 
 TRUSTED_ORIGINS = ['https://schizocarpic-tanya-precorrectly.ngrok-free.dev']
@@ -78,11 +81,89 @@ WSGI_APPLICATION = 'record.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+#
+# SQLite is tuned for concurrent route reads and admin writes: in WAL mode
+# reads do not wait for a writer and writers queue for up to `timeout`
+# seconds. Transactions stay DEFERRED, taking the write lock at their first
+# write; blocks that read before they write use
+# rec.transactions.write_transaction(), which begins IMMEDIATE (otherwise
+# they fail with "database is locked" when another writer got in first).
+# `manage.py db_contention` compares this with SQLite's defaults.
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    # Durable at checkpoints rather than every commit; safe in WAL mode
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',  # 16 MB
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=134217728',  # 128 MB
+)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(SQLITE_PRAGMAS),
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# REC_DB_REPLICA: path of a read replica of db.sqlite3 (kept in sync by e.g.
+# Litestream or LiteFS). GET requests then read from it while it has caught
+# up with the served data versions, see rec/db_routing.py.
+if os.environ.get('REC_DB_REPLICA'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['REC_DB_REPLICA'],
+        'OPTIONS': {
+            'init_command': ';'.join(SQLITE_PRAGMAS[1:] + ('PRAGMA query_only=1',)),
+            'timeout': 20,
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['rec.db_routing.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# Holds the data version tokens, cached responses, graph tiles and lookups
+# (see rec/lookups.py). Web processes and the job worker must share it, so
+# the default is on disk rather than per process. REC_CACHE_URL selects
+# another backend: redis://host:6379/0 (Redis or a compatible server, needs
+# the redis package), locmem:// or file:///path/to/directory.
+
+# Entries the local backends keep before culling (the default, 300, is too few for the tiles)
+CACHE_MAX_ENTRIES = 10000
+
+
+def _cache_from_url(url):
+    parts = urlsplit(url)
+    if parts.scheme in ('redis', 'rediss'):
+        return {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': url}
+    if parts.scheme == 'locmem':
+        return {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': parts.netloc or 'rec',
+                'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES}}
+    if parts.scheme == 'file':
+        return _file_cache(unquote(parts.path))
+    raise ValueError(f'Unsupported REC_CACHE_URL {url!r}')
+
+
+def _file_cache(directory):
+    return {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': str(directory),
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES}}
+
+
+CACHES = {
+    'default': (_cache_from_url(os.environ['REC_CACHE_URL']) if os.environ.get('REC_CACHE_URL')
+                else _file_cache(BASE_DIR / 'cache')),
 }
 
 